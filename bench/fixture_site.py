@@ -0,0 +1,232 @@
+"""
+本地的电商网站模拟，用于离线测量爬虫吞吐：
+ - 列表页：翻页（?page=N，带下一页链接）或无限滚动（滚动到底部时从 /api 接口加载下一批商品）
+ - 详情页：品牌、名称、颜色、键值细节和图片画廊
+ - 可配置商品数量、每页商品数、响应延迟、错误率（500）和限流率（429 + Retry-After）
+ - /__stats 返回各类请求的计数
+只依赖标准库，在后台线程中运行
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LAYOUTS = ('pagination', 'infinite')
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<style>li.product-card {{height: 320px; list-style: none;}} ul.gallery li {{height: 400px;}}</style>
+</head><body>{body}</body></html>"""
+
+CARD = '<li class="product-card"><a href="/item/{id}.html"><img src="/img/{id}-0.jpg"><span>{name}</span></a></li>'
+
+INFINITE_JS = """<script>
+let offset = {offset}, loading = false, done = {done};
+window.addEventListener('scroll', async () => {{
+    if (loading || done || window.innerHeight + window.scrollY < document.body.scrollHeight - 400) return;
+    loading = true;
+    try {{  // 注入的错误响应不是 JSON，下次滚动时重试
+        const data = await (await fetch('/api/c/{category}?offset=' + offset)).json();
+        document.getElementById('grid').insertAdjacentHTML('beforeend', data.html);
+        offset += data.count;
+        done = !data.more;
+    }} catch (e) {{
+    }} finally {{
+        loading = false;
+    }}
+}});
+</script>"""
+
+BRANDS = ('Acne Studios', 'Bottega Veneta', 'Celine', 'Dries Van Noten', 'Etro', 'Fendi', 'Gucci', 'Loewe')
+COLORS = ('black', 'white', 'navy', 'camel', 'olive', 'burgundy')
+
+
+class FixtureSite:
+    def __init__(self, num_items: int = 1000, num_categories: int = 2, per_page: int = 48,
+                 layout: str = 'pagination', images_per_item: int = 4, latency: float = 0.0,
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 seed: int = 0):
+        """
+        :param num_items: 商品总数，平均分配到各品类
+        :param num_categories: 品类数量
+        :param per_page: 每页（或每批滚动加载）的商品数
+        :param layout: 列表页形式，pagination 或 infinite
+        :param images_per_item: 每个商品的图片数
+        :param latency: 每个响应的延迟（秒）
+        :param error_rate: 返回 500 的概率
+        :param throttle_rate: 返回 429 的概率
+        :param port: 监听端口，0 为随机端口
+        :param seed: 随机数种子，错误注入可复现
+        """
+        assert layout in LAYOUTS, f"layout 应为 {LAYOUTS} 之一"
+        self.num_items = num_items
+        self.num_categories = num_categories
+        self.per_page = per_page
+        self.layout = layout
+        self.images_per_item = images_per_item
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # 请求计数：listing / detail / api / image / error / throttled
+        self.counters = {'listing': 0, 'detail': 0, 'api': 0, 'image': 0, 'error': 0, 'throttled': 0}
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def category_urls(self):
+        """
+        与 category-json 相同结构的品类 url：{性别: {品类: {子品类: url}}}
+        """
+        return {'women': {'clothing': {f'cat{c}': f"{self.base_url}/c/{c}/" for c in range(self.num_categories)}}}
+
+    def write_category_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.category_urls(), f)
+
+    def category_items(self, category):
+        """
+        品类中的商品序号范围
+        """
+        size = -(-self.num_items // self.num_categories)
+        return range(category * size, min(self.num_items, (category + 1) * size))
+
+    def count(self, key):
+        with self.lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def roll(self):
+        """
+        按错误率和限流率决定本次响应是否注入错误
+        """
+        with self.lock:
+            value = self.random.random()
+        if value < self.error_rate:
+            return 'error'
+        if value < self.error_rate + self.throttle_rate:
+            return 'throttled'
+        return None
+
+    @staticmethod
+    def item_id(index):
+        return f"FX{index:08d}"
+
+    def cards(self, items):
+        return ''.join(CARD.format(id=self.item_id(i), name=f"Item {i}") for i in items)
+
+    def listing_page(self, category, page_):
+        items = self.category_items(category)
+        if self.layout == 'infinite':
+            first = items[:self.per_page]
+            body = f'<h1>Category {category}</h1><ul id="grid">{self.cards(first)}</ul>'
+            body += INFINITE_JS.format(offset=len(first), done='false' if len(items) > len(first) else 'true',
+                                       category=category)
+            return PAGE.format(title=f"Category {category}", body=body)
+        start = (page_ - 1) * self.per_page
+        body = f'<h1>Category {category}</h1><ul id="grid">{self.cards(items[start:start + self.per_page])}</ul>'
+        if start + self.per_page < len(items):
+            body += f'<a class="next" href="?page={page_ + 1}">Next</a>'
+        return PAGE.format(title=f"Category {category} - page {page_}", body=body)
+
+    def listing_api(self, category, offset):
+        items = self.category_items(category)
+        batch = items[offset:offset + self.per_page]
+        return {'html': self.cards(batch), 'count': len(batch), 'more': offset + len(batch) < len(items),
+                'items': [f"/item/{self.item_id(i)}.html" for i in batch]}
+
+    def detail_page(self, index):
+        rng = random.Random(index)
+        item_id = self.item_id(index)
+        details = ''.join(f'<dt>{key}</dt><dd>{value}</dd>' for key, value in (
+            ('Composition', f"{rng.randint(50, 100)}% cotton"), ('Fit', rng.choice(('regular', 'slim', 'oversized'))),
+            ('Made in', rng.choice(('Italy', 'Portugal', 'France')))))
+        gallery = ''.join(f'<li><img src="/img/{item_id}-{k}.jpg"></li>' for k in range(self.images_per_item))
+        body = (f'<h1 class="brand">{rng.choice(BRANDS)}</h1><p class="name">Item {index}</p>'
+                f'<p class="color">{rng.choice(COLORS)}</p><dl class="details">{details}</dl>'
+                f'<ul class="gallery">{gallery}</ul>')
+        return PAGE.format(title=item_id, body=body)
+
+    def handler_class(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):  # 不输出访问日志
+                pass
+
+            def send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+                data = body if isinstance(body, bytes) else body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = [part for part in url.path.split('/') if part]
+                query = parse_qs(url.query)
+                if parts == ['__stats']:
+                    return self.send(200, json.dumps(site.stats()), 'application/json')
+                if site.latency:
+                    time.sleep(site.latency)
+                if parts[:1] == ['img']:  # 图片不注入错误
+                    site.count('image')
+                    return self.send(200, b'\xff\xd8\xff\xd9', 'image/jpeg')
+                fault = site.roll()
+                if fault == 'error':
+                    site.count('error')
+                    return self.send(500, 'Internal Server Error', 'text/plain')
+                if fault == 'throttled':
+                    site.count('throttled')
+                    return self.send(429, 'Too Many Requests', 'text/plain', {'Retry-After': '1'})
+                try:
+                    if len(parts) == 2 and parts[0] == 'c':
+                        site.count('listing')
+                        return self.send(200, site.listing_page(int(parts[1]), int(query.get('page', ['1'])[0])))
+                    if len(parts) == 3 and parts[:2] == ['api', 'c']:
+                        site.count('api')
+                        offset = int(query.get('offset', ['0'])[0])
+                        return self.send(200, json.dumps(site.listing_api(int(parts[2]), offset)), 'application/json')
+                    if len(parts) == 2 and parts[0] == 'item' and parts[1].endswith('.html'):
+                        index = int(parts[1][2:-5])
+                        if index < site.num_items:
+                            site.count('detail')
+                            return self.send(200, site.detail_page(index))
+                except ValueError:
+                    pass
+                self.send(404, 'Not Found', 'text/plain')
+
+        return Handler
+
+
+if __name__ == '__main__':
+    site = FixtureSite(num_items=1000, layout='pagination')
+    print(f"Fixture site running at {site.start()}")
+    print(json.dumps(site.category_urls(), indent=2))
+    try:
+        site.thread.join()
+    except KeyboardInterrupt:
+        site.stop()
@@ -0,0 +1,247 @@
+"""
+爬虫吞吐基准：用 Spider.async_run 爬取本地的 FixtureSite，输出
+ - items/sec：每秒写入的商品数
+ - page loads / item：网站收到的列表页和详情页请求数 / 商品数
+ - CDP calls / item：Playwright 客户端发往浏览器驱动的协议调用数 / 商品数
+ - peak RSS：本进程及其子进程（Playwright 驱动、浏览器）的内存峰值
+在仓库根目录运行：python -m bench.run_bench
+"""
+import asyncio
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin
+
+from bench.fixture_site import FixtureSite
+from extract_spec import extract
+from rate_limiter import RateLimiter
+from spider import Spider
+
+
+class FixtureSpider(Spider):
+    def __init__(self):
+        super().__init__()
+        self.item_selector = "li.product-card"
+        self.item_spec = {
+            'brand': {'type': 'first', 'selector': "h1.brand", 'required': "未找到商品详情页的 h1.brand"},
+            'item': {'type': 'first', 'selector': "p.name"},
+            'color': {'type': 'first', 'selector': "p.color"},
+            'details': {'type': 'all', 'within': "dl.details", 'selector': "dt, dd"},
+            'image_urls': {'type': 'all', 'within': "ul.gallery", 'selector': "li", 'child': "img", 'prop': 'src'},
+        }
+        # 本地网站不需要限速，只保留限流（429）时的降速
+        self.rate_limiter = RateLimiter(initial_rate=1000.0, max_rate=1000.0, burst=100.0)
+
+    async def next_page_btn(self, page):
+        next_page_btn = await page.query_selector("a.next")
+        if next_page_btn is None:
+            return None
+        return urljoin(page.url, await next_page_btn.get_attribute("href"))
+
+    async def id_from_url(self, url):
+        return url[url.rfind('/') + 1:url.rfind('.html')]
+
+    async def items_in_page(self, page):
+        return await page.eval_on_selector_all("li.product-card a", "els => els.map(el => el.href)")
+
+    async def info_of_item(self, page):
+        data = await extract(page, self.item_spec)
+        details = data.pop("details")
+        data["information"] = dict(zip(details[::2], details[1::2]))
+        data["image_urls"] = [urljoin(page.url, src) for src in data["image_urls"]]
+        return data
+
+    async def items_in_html(self, tree, url):
+        items = [urljoin(url, href) for href in tree.xpath("//li[@class='product-card']/a/@href")]
+        next_url = tree.xpath("//a[@class='next']/@href")
+        return items, urljoin(url, next_url[0]) if next_url else None
+
+    async def info_of_html(self, tree, url):
+        def text(xpath):
+            found = tree.xpath(xpath)
+            return found[0].text_content() if found else None
+
+        details = [el.text_content() for el in tree.xpath("//dl[@class='details']/*")]
+        return {'brand': text("//h1[@class='brand']"), 'item': text("//p[@class='name']"),
+                'color': text("//p[@class='color']"), 'information': dict(zip(details[::2], details[1::2])),
+                'image_urls': [urljoin(url, src) for src in tree.xpath("//ul[@class='gallery']/li/img/@src")]}
+
+
+class ProtocolCounter:
+    """
+    统计 Playwright 客户端的协议调用次数，每次 query_selector / evaluate / goto 等都是一次往返
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.originals = []
+
+    def install(self):
+        try:
+            from playwright._impl._connection import Channel
+        except ImportError:  # Playwright 内部结构变化时不统计
+            return
+        counter = self
+        for name in ('send', 'send_return_as_dict', 'send_no_reply'):
+            original = getattr(Channel, name, None)
+            if original is None:
+                continue
+            self.originals.append((Channel, name, original))
+            if asyncio.iscoroutinefunction(original):
+                async def wrapper(self, *args, _original=original, **kwargs):
+                    counter.calls += 1
+                    return await _original(self, *args, **kwargs)
+            else:
+                def wrapper(self, *args, _original=original, **kwargs):
+                    counter.calls += 1
+                    return _original(self, *args, **kwargs)
+            setattr(Channel, name, wrapper)
+
+    def uninstall(self):
+        for cls, name, original in self.originals:
+            setattr(cls, name, original)
+        self.originals = []
+
+
+class RssSampler:
+    """
+    后台线程定期采样本进程及所有子孙进程的 RSS 总和，记录峰值；没有 /proc 时只统计本进程
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    @staticmethod
+    def tree_rss(root_pid):
+        children = dict()
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(pid))
+        total, stack = 0, [root_pid]
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        while stack:
+            pid = stack.pop()
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, IndexError, ValueError):
+                pass
+            stack.extend(children.get(pid, []))
+        return total
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, self.tree_rss(os.getpid()))
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if os.path.isdir('/proc'):
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        else:  # ru_maxrss 在 Linux 上为 KB
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return self.peak
+
+
+def count_items(root):
+    num_items = 0
+    for folder, dirs, files in os.walk(root):
+        if "items.jsonl" in files:
+            with open(os.path.join(folder, "items.jsonl"), 'rb') as f:
+                num_items += sum(1 for _ in f)
+    return num_items
+
+
+async def run_bench(num_items: int = 1000, num_categories: int = 2, per_page: int = 48, layout: str = 'pagination',
+                    images_per_item: int = 4, latency: float = 0.0, error_rate: float = 0.0,
+                    throttle_rate: float = 0.0, http_listing: bool = False, http_detail: bool = False,
+                    spider_class=FixtureSpider, **run_kwargs):
+    """
+    启动 FixtureSite 并完整爬取一次，返回测量结果
+    :param http_listing: 列表页是否不经过浏览器直接请求
+    :param http_detail: 详情页是否不经过浏览器直接请求
+    :param run_kwargs: 传给 async_run 的参数，如 concurrency、num_browsers、detail_workers
+    """
+    site = FixtureSite(num_items=num_items, num_categories=num_categories, per_page=per_page, layout=layout,
+                       images_per_item=images_per_item, latency=latency, error_rate=error_rate,
+                       throttle_rate=throttle_rate)
+    site.start()
+    root = tempfile.mkdtemp(prefix='bench-')
+    category_json = os.path.join(root, 'category.json')
+    site.write_category_json(category_json)
+    spider = spider_class()
+    spider.http_listing, spider.http_detail = http_listing, http_detail
+    run_kwargs.setdefault('headless', True)
+    run_kwargs.setdefault('max_retry_wait', 0)  # 不等待退避中的重试，留在队列中计入 pending_retries
+    counter, sampler = ProtocolCounter(), RssSampler()
+    counter.install()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        await spider.async_run(os.path.join(root, 'Meta'), category_json, **run_kwargs)
+        seconds = time.perf_counter() - start
+    finally:
+        peak_rss = sampler.stop()
+        counter.uninstall()
+        site.stop()
+    items = count_items(os.path.join(root, 'Meta'))
+    requests = site.stats()
+    page_loads = requests['listing'] + requests['detail']
+    result = {
+        'layout': layout, 'num_items': num_items, 'latency': latency, 'error_rate': error_rate,
+        'throttle_rate': throttle_rate, 'http_listing': http_listing, 'http_detail': http_detail,
+        'run_kwargs': {k: v for k, v in run_kwargs.items() if isinstance(v, (int, float, str, bool))},
+        'items': items, 'seconds': seconds,
+        'items_per_sec': items / seconds if seconds else 0.0,
+        'page_loads': page_loads, 'page_loads_per_item': page_loads / max(items, 1),
+        'cdp_calls': counter.calls, 'cdp_calls_per_item': counter.calls / max(items, 1),
+        'peak_rss_mb': peak_rss / 1024 ** 2,
+        'pending_retries': len(spider.retry_queue) if spider.retry_queue else 0,
+        'requests': requests,
+    }
+    shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def print_result(result):
+    print(f"{result['layout']:<10} {result['items']:>7} items  {result['items_per_sec']:8.2f} items/s  "
+          f"{result['page_loads_per_item']:5.2f} loads/item  {result['cdp_calls_per_item']:7.1f} CDP/item  "
+          f"{result['peak_rss_mb']:7.1f} MB peak RSS  {result['pending_retries']} pending retries")
+
+
+async def main(configs, save_json=None):
+    results = []
+    for config in configs:
+        result = await run_bench(**config)
+        print_result(result)
+        results.append(result)
+    if save_json:
+        with open(save_json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    asyncio.run(main([
+        dict(num_items=1000, layout='pagination'),
+        dict(num_items=1000, layout='infinite'),
+        dict(num_items=1000, layout='pagination', latency=0.05, error_rate=0.02, throttle_rate=0.02),
+        dict(num_items=1000, layout='pagination', http_listing=True, http_detail=True),
+    ], save_json=None))
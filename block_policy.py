@@ -0,0 +1,91 @@
+"""
+资源拦截策略：在爬虫的每个 context 上拦截不需要的请求（图片、字体、媒体、追踪脚本等），
+爬虫只需要图片的 src 属性，不需要下载图片本身
+"""
+import fnmatch
+from urllib.parse import urlparse
+
+# 常见的第三方追踪 / 广告域名，匹配域名本身及其子域名
+TRACKER_DOMAINS = (
+    'google-analytics.com', 'googletagmanager.com', 'googleadservices.com', 'doubleclick.net',
+    'googlesyndication.com', 'facebook.net', 'hotjar.com', 'criteo.com', 'criteo.net',
+    'taboola.com', 'outbrain.com', 'scorecardresearch.com', 'bat.bing.com', 'clarity.ms', 'analytics.tiktok.com',
+    'ct.pinterest.com', 'quantserve.com', 'adnxs.com', 'adsrvr.org', 'rubiconproject.com', 'pubmatic.com',
+    'cdn.segment.com', 'mouseflow.com', 'newrelic.com', 'nr-data.net', 'quantummetric.com', 'contentsquare.net',
+    'cquotient.com', 'rlcdn.com', 'demdex.net', 'omtrdc.net', 'everesttech.net', 'bluecore.com', 'onetrust.com',
+)
+
+# 被拦截请求的估算大小（字节），被拦截的请求拿不到真实大小，按资源类型的典型大小估算节省的流量
+ESTIMATED_SIZES = {
+    'image': 80_000,
+    'media': 500_000,
+    'font': 40_000,
+    'stylesheet': 30_000,
+    'script': 60_000,
+    'xhr': 5_000,
+    'fetch': 5_000,
+    'other': 5_000,
+}
+
+
+class BlockPolicy:
+    def __init__(self, resource_types=('media', 'font', 'image'), url_globs=(), tracker_domains=TRACKER_DOMAINS,
+                 estimated_sizes=None):
+        """
+        :param resource_types: 需要拦截的资源类型（playwright request.resource_type）
+        :param url_globs: 需要拦截的 url 通配符，如 "*.mp4*"、"*/recommendations/*"
+        :param tracker_domains: 需要拦截的第三方追踪域名
+        :param estimated_sizes: 各资源类型被拦截请求的估算大小，用于统计节省的流量
+        """
+        self.resource_types = set(resource_types)
+        self.url_globs = list(url_globs)
+        self.tracker_domains = tuple(tracker_domains)
+        self.estimated_sizes = {**ESTIMATED_SIZES, **(estimated_sizes or {})}
+        # 拦截统计
+        #  - requests: 经过策略的请求数
+        #  - blocked: 拦截的请求数，按拦截原因（resource/glob/tracker）分类
+        #  - bytes_saved: 估算节省的流量
+        self.counters = {'requests': 0, 'blocked': {'resource': 0, 'glob': 0, 'tracker': 0}, 'bytes_saved': 0}
+
+    def _is_tracker(self, url):
+        host = urlparse(url).hostname or ''
+        return any(host == domain or host.endswith('.' + domain) for domain in self.tracker_domains)
+
+    def block_reason(self, request):
+        """
+        返回请求的拦截原因，不拦截时返回 None
+        """
+        if request.resource_type in self.resource_types:
+            return 'resource'
+        if any(fnmatch.fnmatch(request.url, pattern) for pattern in self.url_globs):
+            return 'glob'
+        if self.tracker_domains and self._is_tracker(request.url):
+            return 'tracker'
+        return None
+
+    async def handle(self, route):
+        self.counters['requests'] += 1
+        request = route.request
+        if reason := self.block_reason(request):
+            self.counters['blocked'][reason] += 1
+            self.counters['bytes_saved'] += self.estimated_sizes.get(request.resource_type,
+                                                                     self.estimated_sizes['other'])
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def apply(self, context):
+        """
+        将策略应用到 context 的所有请求上
+        """
+        if not (self.resource_types or self.url_globs or self.tracker_domains):
+            return
+        await context.route("**/*", self.handle)
+
+    def stats(self):
+        return {
+            'requests': self.counters['requests'],
+            'blocked': sum(self.counters['blocked'].values()),
+            **{f'blocked_{reason}': num for reason, num in self.counters['blocked'].items()},
+            'bytes_saved': self.counters['bytes_saved'],
+        }
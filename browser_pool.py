@@ -0,0 +1,350 @@
+"""
+浏览器池：由 Spider.async_run 持有，维护固定数量的常驻 Chromium 浏览器，
+向品类任务租借 context / page，浏览器导航次数达到上限后自动回收重启；
+长期持有的租借在任务之间调用 maybe_recycle，按导航次数和 JS 堆内存更换 page / context，
+更换 context 时保留 cookie 和 localStorage，使长时间运行的内存保持平稳
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+# 页面 JS 堆的已用内存（字节），只有 Chromium 支持 performance.memory
+HEAP_JS = "() => performance.memory ? performance.memory.usedJSHeapSize : 0"
+
+
+class BrowserSlot:
+    """
+    浏览器池中的一个位置，对应一个 Chromium 进程
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.browser = None
+        self.active = 0  # 当前租出的 context 数量
+        self.navigations = 0  # 本次启动以来的导航次数
+        self.launches = 0  # 启动次数（首次启动 + 回收重启）
+        self.relaunching = False  # 正在回收重启，期间不接受租借
+
+
+class BrowserLease:
+    """
+    一次租借：持有一个独立的 context，可在其中创建多个 page，归还时关闭 context
+    """
+
+    def __init__(self, pool, slot, context):
+        self.pool = pool
+        self.slot = slot
+        self.context = context
+        self.navigations = 0  # 当前 context 的导航次数
+        self.pages = dict()  # 当前 context 中打开的 page -> 导航次数
+        self.heap_checked = dict()  # page -> 上次检查内存时的导航次数
+
+    async def new_page(self):
+        """
+        在租借的 context 中新建 page，并统计该 page 主框架的导航次数
+        """
+        page = await self.context.new_page()
+        self.pages[page] = 0
+        page.on("framenavigated", lambda frame: self._on_navigated(page, frame))
+        page.on("close", lambda _: self._forget(page))
+        return page
+
+    def _on_navigated(self, page, frame):
+        if frame == page.main_frame:  # 只统计主框架，忽略 iframe
+            self.navigations += 1
+            self.slot.navigations += 1
+            if page in self.pages:
+                self.pages[page] += 1
+
+    def _forget(self, page):
+        self.pages.pop(page, None)
+        self.heap_checked.pop(page, None)
+
+    async def heap_mb(self, page):
+        try:
+            return await page.evaluate(HEAP_JS) / 1024 ** 2
+        except Exception:
+            return 0.0
+
+    async def recycle_reason(self, page):
+        """
+        :return: 需要更换 context 时返回 browser / context / memory，只需更换 page 时返回 page，否则返回 None
+        """
+        pool, navigations = self.pool, self.pages.get(page, 0)
+        if pool._draining(self.slot):
+            return 'browser'  # 浏览器导航次数已达上限，换到其他（或重启后的）浏览器
+        if self.navigations >= pool.max_context_navigations:
+            return 'context'
+        if pool.max_heap_mb and navigations - self.heap_checked.get(page, 0) >= pool.memory_check_every:
+            self.heap_checked[page] = navigations
+            if await self.heap_mb(page) >= pool.max_heap_mb:
+                return 'memory'
+        if navigations >= pool.max_page_navigations:
+            return 'page'
+        return None
+
+    async def maybe_recycle(self, page):
+        """
+        在两个任务之间调用：按导航次数和内存决定是否更换 page 或 context；
+        context 中还有其他 page（如品类内的详情页 worker 共用租借）时只更换 page
+        :return: (可继续使用的 page, 更换原因或 None)
+        """
+        reason = await self.recycle_reason(page)
+        if reason not in (None, 'page') and set(self.pages) - {page}:
+            # 无法更换 context：内存超限时换 page，其余情况等到 page 自身达到导航上限
+            over = self.pages.get(page, 0) >= self.pool.max_page_navigations
+            reason = 'page' if reason == 'memory' or over else None
+        if reason is None:
+            return page, None
+        if reason != 'page':
+            await self.recycle_context()
+        else:
+            try:
+                await page.close()
+            except Exception as e:
+                print(e)
+            self.pool.lease_stats['page_recycles'] += 1
+        return await self.new_page(), reason
+
+    async def release(self):
+        """
+        关闭 context 并归还浏览器位置，可重复调用；租借损坏时可在 lease() 退出前提前归还
+        """
+        if self.context:
+            try:
+                await self.context.close()
+            except Exception as e:
+                print(e)
+            self.context = None
+        self.pages.clear()
+        self.heap_checked.clear()
+        if self.slot:
+            slot, self.slot = self.slot, None
+            await self.pool._release_slot(slot)
+
+    async def recycle_context(self):
+        """
+        关闭当前 context，重新选择浏览器并创建新的 context，沿用 cookie 和 localStorage；
+        locale、UA 等由浏览器池的 context_kwargs 保持一致
+        """
+        try:
+            storage_state = await self.context.storage_state()
+        except Exception as e:
+            print(e)
+            storage_state = None
+        try:
+            await self.context.close()
+        except Exception as e:
+            print(e)
+        self.context = None
+        self.pages.clear()
+        self.heap_checked.clear()
+        slot, self.slot = self.slot, None
+        await self.pool._release_slot(slot)  # 已达导航上限的浏览器空闲后在这里重启
+        self.slot = await self.pool._acquire_slot()
+        try:
+            self.context = await self.pool._new_context(self.slot, storage_state=storage_state)
+        except Exception:
+            # 租借不再持有 slot，归还时不会重复释放
+            slot, self.slot = self.slot, None
+            await self.pool._release_slot(slot)
+            raise
+        self.navigations = 0
+        self.pool.lease_stats['context_recycles'] += 1
+
+
+class BrowserPool:
+    def __init__(self, playwright, size: int = 1, contexts_per_browser: int = 8, max_navigations: int = 1000,
+                 headless=False, launch_args=None, context_kwargs=None, block_policy=None,
+                 max_page_navigations: int = 100, max_context_navigations: int = 500, max_heap_mb: float = 512,
+                 memory_check_every: int = 20, launch_retries: int = 3, launch_retry_delay: float = 2.0):
+        """
+        :param playwright: async_playwright() 返回的 playwright 对象
+        :param size: 常驻浏览器数量
+        :param contexts_per_browser: 每个浏览器最多同时租出的 context 数量
+        :param max_navigations: 浏览器累计导航次数达到该值后，在空闲时回收重启
+        :param headless: 是否启用无头浏览器
+        :param launch_args: chromium.launch 的启动参数
+        :param context_kwargs: browser.new_context 的参数（UA、locale、header 等）
+        :param block_policy: 资源拦截策略 BlockPolicy，应用到每个租出的 context
+        :param max_page_navigations: page 导航次数达到该值后更换 page（maybe_recycle）
+        :param max_context_navigations: context 导航次数达到该值后更换 context（maybe_recycle）
+        :param max_heap_mb: page 的 JS 堆内存超过该值（MB）时更换 context，0 时不检查
+        :param memory_check_every: 每隔多少次导航检查一次内存
+        :param launch_retries: 回收重启失败后的重试次数，每次等待时间翻倍；仍失败时该位置不再使用
+        :param launch_retry_delay: 第一次重试前的等待时间（秒）
+        """
+        self.playwright = playwright
+        self.size = size
+        self.contexts_per_browser = contexts_per_browser
+        self.max_navigations = max_navigations
+        self.headless = headless
+        self.launch_args = launch_args or []
+        self.context_kwargs = context_kwargs or {}
+        self.block_policy = block_policy
+        self.max_page_navigations = max_page_navigations
+        self.max_context_navigations = max_context_navigations
+        self.max_heap_mb = max_heap_mb
+        self.memory_check_every = memory_check_every
+        self.launch_retries = launch_retries
+        self.launch_retry_delay = launch_retry_delay
+        self.slots = [BrowserSlot(i) for i in range(size)]
+        self._cond = asyncio.Condition()
+        self._closed = False
+        # 租借统计
+        #  - leases: 租借次数
+        #  - wait_total / wait_max: 等待空闲浏览器的时间
+        #  - hold_total / hold_max: 租借持有时间
+        #  - recycles: 浏览器回收重启成功的次数
+        #  - relaunch_failures: 重试后仍重启失败的次数，该位置不再使用
+        #  - page_recycles / context_recycles: 租借期间更换 page / context 的次数
+        self.lease_stats = {'leases': 0, 'wait_total': 0.0, 'wait_max': 0.0,
+                            'hold_total': 0.0, 'hold_max': 0.0, 'recycles': 0, 'relaunch_failures': 0,
+                            'page_recycles': 0, 'context_recycles': 0}
+
+    async def start(self):
+        await asyncio.gather(*[self._launch(slot) for slot in self.slots])
+
+    async def close(self):
+        self._closed = True
+        for slot in self.slots:
+            if slot.browser:
+                try:
+                    await slot.browser.close()
+                except Exception as e:
+                    print(e)
+                slot.browser = None
+
+    async def _launch(self, slot):
+        slot.browser = await self.playwright.chromium.launch(headless=self.headless, args=self.launch_args)
+        slot.navigations = 0
+        slot.launches += 1
+
+    def _draining(self, slot):
+        """
+        导航次数已达上限的浏览器不再接受新的租借，等待现有租借归还后重启
+        """
+        return slot.navigations >= self.max_navigations
+
+    def _pick_slot(self):
+        candidates = [slot for slot in self.slots
+                      if slot.browser and not slot.relaunching and not self._draining(slot)
+                      and slot.active < self.contexts_per_browser]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda slot: slot.active)  # 选择负载最小的浏览器
+
+    async def _relaunch(self, slot):
+        """
+        重启浏览器，失败时按 launch_retry_delay 翻倍等待后重试
+        :return: 是否重启成功
+        """
+        for attempt in range(self.launch_retries + 1):
+            try:
+                await self._launch(slot)
+                return True
+            except Exception as e:
+                print(f"浏览器 {slot.index} 重启失败：{e}")
+                if attempt < self.launch_retries:
+                    await asyncio.sleep(self.launch_retry_delay * 2 ** attempt)
+        return False
+
+    async def _acquire_slot(self):
+        async with self._cond:
+            while (slot := self._pick_slot()) is None:
+                assert not self._closed, "BrowserPool 已关闭"
+                if not any(slot_.browser or slot_.relaunching for slot_ in self.slots):
+                    # 所有浏览器都已重启失败，不再等待
+                    raise RuntimeError("BrowserPool 中没有可用的浏览器")
+                await self._cond.wait()
+            slot.active += 1
+            return slot
+
+    async def _release_slot(self, slot):
+        async with self._cond:
+            slot.active -= 1
+            browser = None
+            if self._draining(slot) and slot.active == 0 and not self._closed and not slot.relaunching:
+                # 空闲且已达导航上限，回收重启；标记为重启中后释放锁，不阻塞其他浏览器的租借和归还
+                slot.relaunching = True
+                browser, slot.browser = slot.browser, None
+            self._cond.notify_all()
+        if browser is None:
+            return
+        try:
+            await browser.close()
+        except Exception as e:
+            print(e)
+        ok = await self._relaunch(slot)
+        async with self._cond:
+            slot.relaunching = False
+            if self._closed and slot.browser:  # 重启期间浏览器池已关闭
+                try:
+                    await slot.browser.close()
+                except Exception as e:
+                    print(e)
+                slot.browser = None
+            self.lease_stats['recycles' if ok else 'relaunch_failures'] += 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def lease(self):
+        """
+        租借一个 context，用法：
+            async with pool.lease() as lease:
+                page = await lease.new_page()
+        """
+        wait_start = time.perf_counter()
+        slot = await self._acquire_slot()
+        try:
+            context = await self._new_context(slot)
+        except Exception:
+            await self._release_slot(slot)
+            raise
+        hold_start = time.perf_counter()
+        self._record('wait', hold_start - wait_start)
+        lease = BrowserLease(self, slot, context)
+        try:
+            yield lease
+        finally:
+            # recycle_context 可能已更换 context 和浏览器，以租借当前持有的为准
+            self._record('hold', time.perf_counter() - hold_start)
+            await lease.release()
+
+    async def _new_context(self, slot, **kwargs):
+        """
+        在 slot 的浏览器中创建 context 并应用资源拦截；失败时由调用方归还 slot
+        """
+        context = await slot.browser.new_context(**self.context_kwargs, **kwargs)
+        if self.block_policy:
+            try:
+                await self.block_policy.apply(context)
+            except Exception:
+                await context.close()
+                raise
+        return context
+
+    def _record(self, kind, seconds):
+        if kind == 'wait':
+            self.lease_stats['leases'] += 1
+        self.lease_stats[f'{kind}_total'] += seconds
+        self.lease_stats[f'{kind}_max'] = max(self.lease_stats[f'{kind}_max'], seconds)
+
+    def stats(self):
+        """
+        返回浏览器池的租借统计，供日志输出
+        """
+        leases = max(self.lease_stats['leases'], 1)
+        return {
+            'browsers': len([slot for slot in self.slots if slot.browser]),
+            'active': sum(slot.active for slot in self.slots),
+            'leases': self.lease_stats['leases'],
+            'wait_avg': self.lease_stats['wait_total'] / leases,
+            'wait_max': self.lease_stats['wait_max'],
+            'hold_avg': self.lease_stats['hold_total'] / leases,
+            'hold_max': self.lease_stats['hold_max'],
+            'recycles': self.lease_stats['recycles'],
+            'relaunch_failures': self.lease_stats['relaunch_failures'],
+            'page_recycles': self.lease_stats['page_recycles'],
+            'context_recycles': self.lease_stats['context_recycles'],
+        }
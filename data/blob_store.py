@@ -0,0 +1,162 @@
+"""
+按内容寻址的图片存储：图片按 sha256 保存为 root/ab/cd/<sha256>.<后缀>，同一内容只保存一份，
+商品文件夹中的图片是指向 blob 的硬链接（不支持硬链接的文件系统退回为复制）；
+root/urls.jsonl 只追加地记录 url -> sha256，启动时读取一次，已下载过的 url 直接链接不再请求；
+损坏的 blob 被删除，并追加 {"url", "removed": true} 使对应的 url 重新下载
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from data.integrity import image_problem
+
+INDEX_NAME = "urls.jsonl"
+
+
+def file_sha256(file, chunk_size: int = 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root):
+        """
+        :param root: 存储目录，应与图片文件夹在同一文件系统上才能使用硬链接
+        """
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.urls = dict()  # url -> {'url', 'sha256', 'size', 'blob'}
+        self.lock = threading.Lock()
+        self.file = None
+        self.can_link = True
+        # 统计
+        #  - stored: 新保存的 blob 数
+        #  - deduped: 内容已存在、只建立链接的图片数
+        #  - saved_bytes: 去重节省的字节数
+        self.counters = {'stored': 0, 'deduped': 0, 'saved_bytes': 0}
+
+    def load(self):
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # 中断时写了一半的最后一行
+                        continue
+                    if record.get('removed'):
+                        self.urls.pop(record['url'], None)
+                    else:
+                        self.urls[record['url']] = record
+        return self
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def blob_path(self, record):
+        return os.path.join(self.root, record['blob'])
+
+    def lookup(self, url):
+        """
+        :return: url 已下载过且 blob 完好（大小一致、文件头尾完整）时返回记录，否则返回 None；
+            损坏的 blob 被删除，之后重新下载的内容不会再链接到它
+        """
+        record = self.urls.get(url)
+        if record is None:
+            return None
+        if (problem := image_problem(self.blob_path(record), record['size'])) is None:
+            return record
+        print(f"{self.blob_path(record)}: {problem}")
+        self.discard(record['sha256'])
+        return None
+
+    def discard(self, sha256):
+        """
+        删除损坏的 blob 及所有指向它的 url 记录，商品文件夹中已有的链接不受影响
+        :return: 删除的 url 记录数
+        """
+        with self.lock:
+            records = [record for record in self.urls.values() if record['sha256'] == sha256]
+            for record in records:
+                del self.urls[record['url']]
+                try:
+                    os.remove(self.blob_path(record))
+                except OSError:  # 已删除或不存在
+                    pass
+            for record in records:
+                self._append({'url': record['url'], 'removed': True})
+        return len(records)
+
+    def _append(self, record):
+        """
+        向 url 索引追加一行，调用方需持有 lock
+        """
+        if self.file is None:
+            os.makedirs(self.root, exist_ok=True)
+            self.file = open(self.index_path, 'a', encoding='utf-8', buffering=1)
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def link(self, record, file):
+        """
+        将 blob 链接（或复制）到商品文件夹中的 file，已有的 file 被原子地替换
+        """
+        blob, tmp = self.blob_path(record), file + '.link'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if self.can_link:
+            try:
+                os.link(blob, tmp)
+            except OSError as e:
+                print(f"Hardlink not supported, copying blobs instead: {e}")
+                self.can_link = False
+        if not self.can_link:
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, file)
+
+    def ingest(self, file, url):
+        """
+        将下载完成的 file 存入 blob 存储并登记 url；内容已存在时 file 替换为指向已有 blob 的链接
+        :return: url 的记录
+        """
+        digest = file_sha256(file)
+        size = os.path.getsize(file)
+        record = {'url': url, 'sha256': digest, 'size': size,
+                  'blob': os.path.join(digest[:2], digest[2:4], digest + os.path.splitext(file)[1])}
+        blob = self.blob_path(record)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            if self.can_link:
+                os.link(file, blob)  # 新内容：file 与 blob 为同一文件，不复制
+            elif not os.path.exists(blob):
+                shutil.copyfile(file, blob)
+            else:
+                raise FileExistsError(blob)
+            stored = True
+        except FileExistsError:
+            stored = image_problem(blob, size) is not None
+            if stored:  # 已有的 blob 已损坏，用新下载的内容替换
+                os.replace(file, blob)
+                self.link(record, file)
+        except OSError as e:  # 跨文件系统等不能硬链接
+            print(f"Hardlink not supported, copying blobs instead: {e}")
+            self.can_link = False
+            shutil.copyfile(file, blob)
+            stored = True
+        if not stored:
+            self.link(record, file)
+        with self.lock:
+            if stored:
+                self.counters['stored'] += 1
+            else:
+                self.counters['deduped'] += 1
+                self.counters['saved_bytes'] += size
+            self.urls[url] = record
+            self._append(record)
+        return record
@@ -35,6 +35,7 @@ def stat_meta_folder(meta_folder):
     """
     # 查找 meta 文件夹下所有 items.jsonl 文件
     items = scan_files_in_dir(meta_folder, postfix={'.jsonl'})
+    items = [item for item in items if item.name == 'items.jsonl']  # 排除 memberships.jsonl 等非商品文件
     # 统计 items.jsonl 文件中的 item 数量 (每个 item 为一行)
     num_items = 0
     num_images = 0
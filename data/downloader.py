@@ -2,141 +2,441 @@
 """
 功能：从品牌文件夹中的 jsonl 文件中下载图片
 实现：遍历所有文件夹查询 .jsonl 文件，读取文件中的图片 url，从 url 下载图片到指定品牌文件夹副本
+下载由 asyncio 的 ImageDownloader 完成：每个域名一个 httpx 连接池（安装 h2 时使用 HTTP/2），
+按域名限制并发，响应分块写入文件，不再为每个 worker 启动线程、为每张图片建立新连接；
+图片先写入 .part 临时文件，校验大小、Content-Type 和文件头尾后再原子地重命名，中断的下载用 Range 续传，
+并用 If-Range 带上 .part.meta 中记录的 ETag / Last-Modified，服务器上的图片已变化时从头下载；
+启用 BlobStore 时相同 url 只下载一次、相同内容只保存一份，商品文件夹中为指向 blob 的硬链接；
+图片 url 下载前经过 image_url 的网站规则改写为目标分辨率的规范 url
 """
+import asyncio
+import itertools
 import json
 import os
-import queue
+import re
 import threading
-import time
 from os import path
-import asyncio
-import requests
+from urllib.parse import urlsplit
+
+import httpx
 from tqdm import tqdm
 
-# 创建连接池
+from data.blob_store import BlobStore
+from data.integrity import InvalidImage, image_problem, scan_images
+from data.manifest import ManifestSet
+from image_url import ImageUrlNormalizer
+
+try:
+    import h2  # noqa: F401  HTTP/2 需要安装 h2：pip install httpx[http2]
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+# 请求头，图片不压缩传输，Range 续传和 Content-Length 校验都按原始字节计算
 headers = {
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-    'Sec-Fetch-Dest': 'document',
-    'Sec-Fetch-Mode': 'navigate',
-    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept': 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Encoding': 'identity',
     'Accept-Language': 'zh-CN,zh-Hans;q=0.9',
-    'Connection': 'keep-alive',
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2.1 Safari/605.1.15',
 }
 
-total, download = 0, 0
-q = queue.Queue()  # 创建队列对象
-lock = threading.Lock()  # 创建一个共享的锁
+
+def _write_part_meta(part, url, response_headers):
+    """
+    从头下载时在 .part 旁记录图片的 ETag / Last-Modified，续传时用于 If-Range
+    """
+    meta = {'url': url, 'etag': response_headers.get('ETag'), 'last_modified': response_headers.get('Last-Modified')}
+    with open(part + '.meta', 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+
+def _part_validator(part, url):
+    """
+    :return: .part 对应的 If-Range 校验值，没有可用的校验值时返回 None；弱 ETag 不能用于 If-Range
+    """
+    try:
+        with open(part + '.meta', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('url') != url:
+        return None
+    etag = meta.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return meta.get('last_modified')
+
+
+def _remove_part(part):
+    for file in (part, part + '.meta'):
+        if path.exists(file):
+            os.remove(file)
 
 
-# 整理任务，并添加到队列中
-def task_maker(src, dst=None, num_per_item: int = None):
-    global q, total
+class Counters:
+    """
+    线程安全的计数器：task_maker 在线程中计数，进度条和汇总在事件循环中读取
+    """
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+def item_images(item: dict, num_per_item: int = None):
+    """
+    :return: (item_id, 图片 url 列表)，Key 中包含 "id" 的为 item id，包含 "image" 的为图片 url
+    """
+    urls = []
+    item_id = None
+    # 遍历字典中的每一项
+    for k, v in item.items():
+        if "id" in k:
+            item_id = v
+        if "image" in k:
+            # 判断是 str 还是 list
+            if isinstance(v, str):
+                urls.append(v)
+            elif isinstance(v, list):
+                urls.extend(v)
+    # 每个 item 只下载 num_per_item 张图片
+    if num_per_item is not None:
+        urls = urls[:num_per_item]
+    return item_id, urls
+
+
+def task_maker(src, dst=None, num_per_item: int = None, counters: Counters = None, manifests: ManifestSet = None,
+               normalizer: ImageUrlNormalizer = None):
+    """
+    生成器：逐行读取 src-Meta 下所有 items.jsonl，逐个产生下载任务 {'url', 'dst', 'name'}，
+    不把整个文件读入内存，内存占用与数据集大小无关
+    :param src: 品牌文件夹，读取 src-Meta，图片保存到 dst
+    :param dst: 图片根目录，默认为 src-Images
+    :param num_per_item: 每个 item 只下载前几张图片
+    :param counters: 统计 items（商品数）、tasks（产生的任务数）、exists（已下载而跳过的图片数）
+    :param manifests: 下载清单，按清单判断是否已下载（url 与清单中的不同时重新下载），任务中带上清单和 (item_id, index)；
+        None 时逐个检查文件是否存在
+    :param normalizer: 图片 url 规范化，逐个改写 url，不去重也不过滤，图片序号与 items.jsonl 保持一致
+    """
+    counters = counters or Counters()
     if dst is None:
         dst = src + "-Images"
-    src = src+'-Meta'
+    src = src + '-Meta'
     for root, dirs, files in os.walk(src):
         for file in files:
-            if file.endswith("items.jsonl"):
-                file = path.join(root, file)
-                # 路径的 src 替换为 dst 得到目标路径
-                f_ = file.replace(src, dst)
-                dst_ = path.dirname(f_)
-                # 读取 jsonl 文件中的每一行数据
-                with open(file, "r", encoding="utf-8") as f:
-                    items = f.readlines()
-                    # 遍历 Item
-                    for item in items:
-                        urls = []
-                        item_id = None
-                        # 将每一行数据转换为字典
-                        item = json.loads(item)
-                        # 遍历字典中的每一项
-                        for k, v in item.items():
-                            # 如果 Key 中包含 "id"，则说明是item id
-                            if "id" in k:
-                                item_id = v
-                            # 如果 Key 中包含 "image"，则说明是图片 url
-                            if "image" in k:
-                                # 判断是 str 还是 list
-                                if isinstance(v, str):
-                                    urls.append(v)
-                                elif isinstance(v, list):
-                                    urls.extend(v)
-                        # 每个 item 只下载 num_per_item 张图片
-                        if num_per_item is not None:
-                            urls = urls[:num_per_item]
-                        # 遍历图片 url, 命名为 item_id-index.postfix
-                        for i, url in enumerate(urls):
-                            # 获取图片后缀名
-                            postfix = url[url.rfind("."):]
-                            name = f"{item_id}-{i}{postfix}"
-                            dst_folder = path.join(dst_, item_id)
-                            dst_file = path.join(dst_folder, name)
-                            # 判断是否已经下载过
-                            if path.isfile(dst_file):
-                                continue
-                            # 加入任务
-                            q.put({"url": url, "dst": path.join(dst_, item_id), "name": f"{item_id}-{i}{postfix}"})
-                            total += 1
-
-
-def downloader():
-    global q, download
-    while True:
-        # 获取数据
-        data = q.get()
-        if data is None:
-            continue
-        # 下载图片
-        download_url(data["url"], data["dst"], data["name"])
-        download += 1
-
-
-def download_url(url, dst, name=None):
-    if not path.isdir(dst):
+            if not file.endswith("items.jsonl"):
+                continue
+            file = path.join(root, file)
+            # 路径的 src 替换为 dst 得到目标路径
+            dst_ = path.dirname(file.replace(src, dst))
+            manifest = manifests.get(dst_) if manifests is not None else None
+            with open(file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    item_id, urls = item_images(json.loads(line), num_per_item)
+                    counters.add('items')
+                    # 遍历图片 url, 命名为 item_id-index.postfix
+                    for i, url in enumerate(urls):
+                        if normalizer:
+                            url = normalizer.normalize(url) or url
+                        postfix = path.splitext(urlsplit(url).path)[1] or '.jpg'  # 不含 query
+                        name = f"{item_id}-{i}{postfix}"
+                        dst_folder = path.join(dst_, item_id)
+                        # 判断是否已经下载过
+                        if manifest.done(item_id, i, url) if manifest else path.isfile(path.join(dst_folder, name)):
+                            counters.add('exists')
+                            continue
+                        counters.add('tasks')
+                        task = {"url": url, "dst": dst_folder, "name": name}
+                        if manifest:
+                            task.update(manifest=manifest, key=(item_id, i))
+                        yield task
+
+
+async def stream_tasks(folders, num_per_item: int = None, counters: Counters = None, manifests: ManifestSet = None,
+                       normalizer: ImageUrlNormalizer = None, batch_size: int = 256, max_batches: int = 4):
+    """
+    多个品牌文件夹同时生成任务，合并为一个异步迭代器；每个文件夹的 task_maker 在线程中按批运行，
+    批次队列有界，下载跟不上时生成暂停（背压），内存中最多 max_batches * batch_size 个待下载任务
+    """
+    batches = asyncio.Queue(maxsize=max_batches)
+
+    async def produce(folder):
+        generator = task_maker(folder, None, num_per_item, counters, manifests, normalizer)
+        try:
+            while batch := await asyncio.to_thread(lambda: list(itertools.islice(generator, batch_size))):
+                await batches.put(batch)
+        finally:
+            await batches.put(None)  # 该文件夹结束（或出错）
+
+    producers = [asyncio.create_task(produce(folder)) for folder in folders]
+    try:
+        remaining = len(producers)
+        while remaining:
+            batch = await batches.get()
+            if batch is None:
+                remaining -= 1
+                continue
+            for task in batch:
+                yield task
+        await asyncio.gather(*producers)  # 抛出生成任务时的异常
+    finally:
+        for producer in producers:
+            producer.cancel()
+
+
+class ImageDownloader:
+    def __init__(self, num_workers: int = 64, per_host: int = 16, timeout: float = 30.0, http2: bool = HTTP2,
+                 chunk_size: int = 64 * 1024, max_try: int = 3, store: BlobStore = None):
+        """
+        :param num_workers: 同时进行的下载数量（协程数）
+        :param per_host: 每个域名的最大并发下载数和连接数
+        :param timeout: 单次请求超时（秒）
+        :param http2: 是否启用 HTTP/2（需要安装 h2），同一连接上并发多个请求
+        :param chunk_size: 分块写入的块大小（字节）
+        :param max_try: 单张图片的最大尝试次数
+        :param store: 按内容寻址的 blob 存储，None 时每张图片单独保存
+        """
+        self.num_workers = num_workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.http2 = http2
+        self.chunk_size = chunk_size
+        self.max_try = max_try
+        self.clients = dict()  # 域名 -> httpx.AsyncClient
+        self.semaphores = dict()  # 域名 -> 并发限制
+        self.store = store
+        self.inflight = dict()  # 正在下载的 url -> 下载结束时完成的 Future
+        # 下载统计
+        #  - done: 完成的图片数（包括 linked）
+        #  - linked: url 已下载过、直接链接 blob 的图片数
+        #  - skipped: 已存在而跳过的图片数
+        #  - failed: 达到最大尝试次数仍失败的图片数
+        #  - bytes: 下载的字节数
+        self.counters = Counters('done', 'linked', 'skipped', 'failed', 'bytes')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients.clear()
+
+    def finished(self):
+        counters = self.counters.snapshot()
+        return counters['done'] + counters['skipped'] + counters['failed']
+
+    def client_for(self, host):
+        """
+        每个域名一个连接池，连接保持复用，不同 CDN 之间互不占用连接
+        """
+        if host not in self.clients:
+            self.clients[host] = httpx.AsyncClient(
+                headers=headers, timeout=self.timeout, follow_redirects=True, http2=self.http2,
+                limits=httpx.Limits(max_connections=self.per_host, max_keepalive_connections=self.per_host))
+            self.semaphores[host] = asyncio.Semaphore(self.per_host)
+        return self.clients[host]
+
+    async def fetch(self, url, file):
+        """
+        流式下载 url 到 file.part，已有 .part 时用 Range 从断点续传；
+        校验通过后重命名为 file，任何失败都不会留下被当作已下载的文件
+        :return: 文件的字节数
+        """
+        part = file + '.part'
+        offset = path.getsize(part) if path.isfile(part) else 0
+        request_headers = None
+        if offset:
+            # 续传时用 If-Range 带上 .part 对应的校验值，服务器上的图片已变化时返回 200 完整内容；
+            # 没有记录校验值时无法确认 .part 与当前图片一致，从头下载
+            validator = _part_validator(part, url)
+            if validator:
+                request_headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+            else:
+                offset = 0
+        host = urlsplit(url).netloc
+        client = self.client_for(host)
+        async with self.semaphores[host]:
+            async with client.stream('GET', url, headers=request_headers) as response:
+                if response.status_code == 416:  # 临时文件已无法续传
+                    _remove_part(part)
+                    raise InvalidImage(f"range {offset}- not satisfiable")
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '')
+                if not content_type.startswith(('image/', 'application/octet-stream')):
+                    raise InvalidImage(f"unexpected content type {content_type!r}")
+                if response.status_code == 206:
+                    content_range = response.headers.get('Content-Range', '')
+                    match = re.fullmatch(r'bytes (\d+)-\d+/(\d+|\*)', content_range)
+                    if not match or int(match[1]) != offset:
+                        _remove_part(part)
+                        raise InvalidImage(f"unexpected content range {content_range!r}")
+                    expected_size = int(match[2]) if match[2] != '*' else None
+                else:  # 服务器不支持 Range 时返回完整内容，从头写入
+                    offset = 0
+                    length = response.headers.get('Content-Length', '')
+                    expected_size = int(length) if length.isdigit() else None
+                    _write_part_meta(part, url, response.headers)
+                with open(part, 'ab' if offset else 'wb') as f:
+                    async for chunk in response.aiter_bytes(self.chunk_size):
+                        f.write(chunk)
+                        self.counters.add('bytes', len(chunk))
+        # 传输中断时 httpx 抛出异常，保留 .part 供下次续传；响应完整但校验失败说明内容有误，删除
+        if problem := image_problem(part, expected_size):
+            _remove_part(part)
+            raise InvalidImage(f"{url}: {problem}")
+        size = path.getsize(part)
+        os.replace(part, file)
+        _remove_part(part)  # 只剩 .part.meta
+        return size
+
+    async def obtain(self, url, file):
+        """
+        得到 url 的图片文件 file：url 已在 blob 存储中时直接链接，同一 url 正在下载时等待其完成；
+        否则下载后存入 blob 存储
+        :return: (字节数, sha256)，未启用 blob 存储时 sha256 为 None
+        """
+        if self.store is None:
+            return await self.fetch(url, file), None
+        while url in self.inflight:
+            await asyncio.wait({self.inflight[url]})
+        if record := self.store.lookup(url):
+            await asyncio.to_thread(self.store.link, record, file)
+            self.counters.add('linked')
+            return record['size'], record['sha256']
+        self.inflight[url] = asyncio.get_running_loop().create_future()
+        try:
+            await self.fetch(url, file)
+            record = await asyncio.to_thread(self.store.ingest, file, url)
+            return record['size'], record['sha256']
+        finally:
+            self.inflight.pop(url).set_result(None)
+
+    async def download(self, task):
+        """
+        :param task: {'url', 'dst', 'name'}，下载到 dst/name，失败时重试；
+            带有 manifest 和 key 时已由清单判断未下载，结果写入清单
+        """
+        dst, name = task['dst'], task.get('name') or task['url'][task['url'].rfind("/") + 1:]
+        file = path.join(dst, name)
+        manifest = task.get('manifest')
+        # 判断是否已经下载过
+        if manifest is None and path.isfile(file):
+            self.counters.add('skipped')
+            return
         os.makedirs(dst, exist_ok=True)
-    # 如果没提供 name, 从 url 中获取图片名
-    if name is None:
-        name = url[url.rfind("/") + 1:]
-    # 判断是否已经下载过
-    if path.isfile(path.join(dst, name)):
-        return
-    # 下载图片
-    with open(path.join(dst, name), 'wb') as f:
-        img = requests.get(url, headers=headers).content
-        f.write(img)
-
-
-def log():
-    global total, download
-    last = download
-    with tqdm(total=total, ncols=100) as pbar:
+        for try_ in range(1, self.max_try + 1):
+            try:
+                size, sha256 = await self.obtain(task['url'], file)
+                self.counters.add('done')
+                if manifest:
+                    manifest.record(*task['key'], name, size, 'done', sha256, task['url'])
+                return
+            except Exception as e:
+                if try_ == self.max_try:
+                    print(f"Failed to download {task['url']}: {e}")
+                    self.counters.add('failed')
+                    if manifest:
+                        manifest.record(*task['key'], name, 0, 'failed', url=task['url'])
+                    return
+                await asyncio.sleep(2 ** try_)
+
+    async def worker(self, tasks: asyncio.Queue):
         while True:
-            pbar.update(download - last)
-            pbar.total = total
-            last = download
-            time.sleep(1)
+            task = await tasks.get()
+            try:
+                if task is None:
+                    break
+                await self.download(task)
+            finally:
+                tasks.task_done()
+
+    async def run(self, tasks):
+        """
+        下载 tasks（异步迭代器）中的所有图片，队列有界，下载跟不上时暂停读取任务
+        """
+        queue_ = asyncio.Queue(maxsize=self.num_workers * 4)
+        workers = [asyncio.create_task(self.worker(queue_)) for _ in range(self.num_workers)]
+        try:
+            async for task in tasks:
+                await queue_.put(task)
+        finally:
+            for _ in workers:
+                await queue_.put(None)
+            await asyncio.gather(*workers)
 
 
-async def main(folders=None, num_workers=16, images_per_item=None):
+async def log(engine: ImageDownloader, counters: Counters):
+    """
+    进度条的总数为已生成的任务数，随扫描进行增长
+    """
+    with tqdm(total=0, ncols=100) as pbar:
+        while True:
+            pbar.total = counters['tasks']
+            pbar.update(engine.finished() - pbar.n)
+            await asyncio.sleep(1)
+
+
+async def main(folders=None, num_workers=64, images_per_item=None, per_host=16, verify=False, scan=False,
+               blob_store=None, image_widths=None):
+    """
+    :param verify: 是否将下载清单与磁盘上的文件核对（清单不存在的文件夹总会核对一次）
+    :param scan: 下载前是否检查已下载图片的完整性，截断或不是图片的文件重新下载
+    :param blob_store: blob 存储目录，默认为第一个品牌文件夹旁的 Blobs，False 时不去重
+    :param image_widths: 按网站规则名设置下载的图片宽度，如 {'zalando': 1200}，见 image_url
+    """
     if folders is None:
         folders = ["Meta/YOOX"]
-    for folder in folders:
-        threading.Thread(target=task_maker, args=(folder, None, images_per_item)).start()
-
-    threading.Thread(target=log).start()
-    threads = [threading.Thread(target=downloader) for _ in range(num_workers)]
-    for t in threads:
-        t.start()
+    if blob_store is None:
+        blob_store = path.join(path.dirname(path.abspath(folders[0])), "Blobs")
+    store = await asyncio.to_thread(BlobStore(blob_store).load) if blob_store else None
+    if scan:
+        result = await asyncio.to_thread(scan_images, [folder + "-Images" for folder in folders], store=store)
+        print(f"{result['checked']} images checked, {result['corrupt']} corrupt images queued again")
+    counters = Counters('items', 'tasks', 'exists')
+    manifests = ManifestSet(verify=verify)
+    async with ImageDownloader(num_workers=num_workers, per_host=per_host, store=store) as engine:
+        log_task = asyncio.create_task(log(engine, counters))
+        try:
+            await engine.run(stream_tasks(folders, images_per_item, counters, manifests,
+                                          ImageUrlNormalizer(widths=image_widths)))
+        finally:
+            log_task.cancel()
+            manifests.close()
+            if store:
+                store.close()
+        print(f"{counters['items']} items, {counters['exists']} images already downloaded, "
+              f"{manifests.verified['adopted']} found on disk, {manifests.verified['missing']} missing on disk")
+        print(f"{engine.counters['done']} downloaded, {engine.counters['skipped']} skipped, "
+              f"{engine.counters['failed']} failed, {engine.counters['bytes'] / 1024 ** 2:.1f} MB")
+        if store:
+            print(f"{engine.counters['linked']} linked without downloading, {store.counters['stored']} blobs stored, "
+                  f"{store.counters['deduped']} duplicates ({store.counters['saved_bytes'] / 1024 ** 2:.1f} MB saved)")
 
 
 def async_main(**kwargs):
-    asyncio.run(main(kwargs))
+    asyncio.run(main(**kwargs))
 
 
 if __name__ == '__main__':
     asyncio.run(main(
         folders=["D:\Spider\Meta\YOOX"],
-        num_workers=16, images_per_item=None))
+        num_workers=64, images_per_item=None))
     pass
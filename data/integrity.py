@@ -0,0 +1,110 @@
+"""
+图片完整性检查：按文件头识别图片格式，按文件尾判断是否被截断；
+下载完成时用于校验临时文件，scan_images 并行检查已下载的图片，
+截断或不是图片的文件被删除并在下载清单中标记为 corrupt，下次运行 task_maker 时重新加入下载
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from data.manifest import MANIFEST_NAME, DownloadManifest
+
+HEAD_SIZE, TAIL_SIZE = 32, 64
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def image_kind(head: bytes):
+    """
+    :return: 按文件头识别的图片格式，无法识别时返回 None
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis', b'heic', b'heix', b'mif1'):
+        return 'avif'
+    return None
+
+
+def image_problem(file, expected_size: int = None):
+    """
+    检查图片文件
+    :param expected_size: 期望的字节数（下载清单或 Content-Length），None 时不检查
+    :return: 问题描述，文件完整时返回 None
+    """
+    try:
+        size = os.path.getsize(file)
+        with open(file, 'rb') as f:
+            head = f.read(HEAD_SIZE)
+            f.seek(max(0, size - TAIL_SIZE))
+            tail = f.read()
+    except OSError:
+        return 'missing'
+    if size == 0:
+        return 'empty'
+    if expected_size is not None and size != expected_size:
+        return f'size {size} != {expected_size}'
+    kind = image_kind(head)
+    if kind is None:
+        return 'not an image'
+    # 各格式的结束标记：JPEG 的 EOI 之后可能有少量填充字节
+    if (kind == 'jpeg' and b'\xff\xd9' not in tail) or (kind == 'png' and b'IEND' not in tail) \
+            or (kind == 'gif' and not tail.endswith(b'\x3b')) \
+            or (kind == 'webp' and int.from_bytes(head[4:8], 'little') + 8 != size):
+        return 'truncated'
+    return None
+
+
+def manifest_folders(images_root):
+    """
+    遍历图片根目录，返回有下载清单的品类文件夹，不进入商品文件夹
+    """
+    for root, dirs, files in os.walk(images_root):
+        if MANIFEST_NAME in files:
+            dirs.clear()
+            yield root
+
+
+def scan_images(images_roots, num_workers: int = 32, store=None):
+    """
+    并行检查图片根目录下所有清单中已下载的图片，有问题的文件删除并标记为 corrupt
+    :param images_roots: 图片根目录列表（如 Meta/YOOX-Images）
+    :param store: blob 存储 BlobStore，图片是指向 blob 的硬链接，同时删除对应的 blob 和 url 记录，
+        否则重新下载时会再次链接到损坏的 blob
+    :return: {'checked': 检查的图片数, 'corrupt': 有问题的图片数}
+    """
+    result = {'checked': 0, 'corrupt': 0}
+
+    def check(manifest, record):
+        file = os.path.join(manifest.folder, record['id'], record['name'])
+        if (problem := image_problem(file, record['size'])) is None:
+            return False
+        print(f"{file}: {problem}")
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+        if store is not None and record.get('sha256'):
+            store.discard(record['sha256'])
+        manifest.record(record['id'], record['index'], record['name'], 0, 'corrupt', url=record.get('url'))
+        return True
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        for images_root in images_roots:
+            for folder in manifest_folders(images_root):
+                manifest = DownloadManifest(folder)
+                manifest.load()
+                records = [record for record in manifest.entries.values() if record['status'] == 'done']
+                try:
+                    for corrupt in executor.map(lambda record: check(manifest, record), records):
+                        result['checked'] += 1
+                        result['corrupt'] += corrupt
+                finally:
+                    manifest.close()
+    return result
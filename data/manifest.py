@@ -0,0 +1,163 @@
+"""
+下载清单：每个品类的图片文件夹下一个只追加的 manifest.jsonl，每行记录一张图片
+{"id": item id, "index": 图片序号, "name": 文件名, "size": 字节数, "status": done / failed / missing / corrupt,
+"url": 下载时的规范 url}，同一图片以最后一行为准；启动时每个文件夹读取一次清单，跳过已下载的图片不再逐个 stat 文件，
+图片的 url 改变（如规范 url 的分辨率调整）后视为未下载；
+verify 将清单与磁盘上的文件核对：登记已有但未记录的文件，标记丢失或大小不符的文件以便重新下载
+"""
+import json
+import os
+import threading
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def split_image_name(item_id: str, name: str):
+    """
+    从文件名 item_id-index.postfix 中解析图片序号，不符合格式时返回 None
+    """
+    index = os.path.splitext(name)[0][len(item_id) + 1:]
+    if not name.startswith(f"{item_id}-") or not index.isdigit():
+        return None
+    return int(index)
+
+
+class DownloadManifest:
+    def __init__(self, folder):
+        """
+        :param folder: 品类的图片文件夹，其下为 item_id/item_id-index.postfix
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.entries = dict()  # (item id, 图片序号) -> 记录
+        self.lock = threading.Lock()
+        self.file = None
+
+    def load(self, verify: bool = False):
+        """
+        读取清单；没有清单但文件夹已存在（清单启用前下载的图片）或 verify 为 True 时与磁盘核对
+        """
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # 中断时写了一半的最后一行
+                        continue
+                    self.entries[(record['id'], record['index'])] = record
+        elif os.path.isdir(self.folder):
+            verify = True
+        if verify:
+            return self.verify()
+        return None
+
+    def done(self, item_id, index: int, url: str = None) -> bool:
+        """
+        :param url: 图片当前的规范 url，与记录中的 url 不同时视为未下载；没有记录 url 的旧记录不比较
+        """
+        record = self.entries.get((item_id, index))
+        if record is None or record['status'] != 'done':
+            return False
+        return url is None or record.get('url') is None or record['url'] == url
+
+    def record(self, item_id, index: int, name: str, size: int = 0, status: str = 'done', sha256: str = None,
+               url: str = None):
+        """
+        追加一条记录，行缓冲写入，中断时最多丢失正在写的一行（对应图片下次重新下载）
+        :param sha256: 图片内容的 sha256（启用 blob 存储时），可在 blob 存储中查找
+        :param url: 下载的规范 url
+        """
+        record = {'id': item_id, 'index': index, 'name': name, 'size': size, 'status': status}
+        if sha256:
+            record['sha256'] = sha256
+        if url:
+            record['url'] = url
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.entries[(item_id, index)] = record
+            if self.file is None:
+                os.makedirs(self.folder, exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+            self.file.write(line)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def scan(self):
+        """
+        :return: 磁盘上的图片 {(item id, 图片序号): (文件名, 字节数)}
+        """
+        files = dict()
+        if not os.path.isdir(self.folder):
+            return files
+        for item_dir in os.scandir(self.folder):
+            if not item_dir.is_dir():
+                continue
+            for entry in os.scandir(item_dir.path):
+                index = split_image_name(item_dir.name, entry.name) if entry.is_file() else None
+                if index is not None:
+                    files[(item_dir.name, index)] = (entry.name, entry.stat().st_size)
+        return files
+
+    def verify(self):
+        """
+        与磁盘核对并重写压缩后的清单
+        :return: {'adopted': 登记的已有文件数, 'missing': 丢失或大小不符的图片数}
+        """
+        files = self.scan()
+        result = {'adopted': 0, 'missing': 0}
+        with self.lock:
+            for key, record in self.entries.items():
+                if record['status'] == 'done' and files.get(key, (None, None))[1] != record['size']:
+                    record['status'] = 'missing'
+                    result['missing'] += 1
+            for (item_id, index), (name, size) in files.items():
+                # 清单中已有记录（如大小不符）的文件不登记，重新下载
+                if size > 0 and (item_id, index) not in self.entries:
+                    self.entries[(item_id, index)] = {'id': item_id, 'index': index, 'name': name, 'size': size,
+                                                      'status': 'done'}
+                    result['adopted'] += 1
+            if self.file:
+                self.file.close()
+                self.file = None
+            if self.entries:
+                with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                    for record in self.entries.values():
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                os.replace(self.path + '.tmp', self.path)
+        return result
+
+
+class ManifestSet:
+    """
+    所有品类文件夹的下载清单，task_maker 在线程中按文件夹取得清单，下载完成后写入
+    """
+
+    def __init__(self, verify: bool = False):
+        """
+        :param verify: 打开每个清单时是否与磁盘核对
+        """
+        self.verify = verify
+        self.manifests = dict()  # 文件夹 -> DownloadManifest
+        self.lock = threading.Lock()
+        self.verified = {'adopted': 0, 'missing': 0}
+
+    def get(self, folder) -> DownloadManifest:
+        with self.lock:
+            manifest = self.manifests.get(folder)
+            if manifest is not None:
+                return manifest
+            manifest = self.manifests[folder] = DownloadManifest(folder)
+        if result := manifest.load(self.verify):
+            with self.lock:
+                for key, value in result.items():
+                    self.verified[key] += value
+        return manifest
+
+    def close(self):
+        with self.lock:
+            for manifest in self.manifests.values():
+                manifest.close()
@@ -0,0 +1,91 @@
+"""
+声明式的商品信息提取：按网站编写提取规则（选择器、键值分组、图片属性），
+在一次 page.evaluate 中完成所有查询并返回结果，代替逐个元素 query_selector / inner_text 的多次往返
+
+规则格式：{字段名: rule}，rule 的可选项：
+ - type: first（第一个匹配元素）/ all（所有匹配元素）/ groups（键值分组）/ click（提取前点击所有匹配元素）
+ - selector: 选择器
+ - within: 在该选择器的第一个匹配元素内查询，默认在整个页面查询
+ - within_required: within 未找到时抛出的错误信息
+ - required: selector 未找到时抛出的错误信息，否则 first 返回 null、all 返回空列表
+ - prop: 读取的属性，text 为 innerText，其余为 getAttribute，默认 text
+ - props: 读取多个属性，每个元素返回 {属性: 值}
+ - child: all 时对每个元素再取第一个匹配 child 的子元素（没有的跳过）
+ - rules: groups 的分组规则列表，每条为 {match: {class: [类名片段], attr: {属性: 值}}, as: key/subkey/value}，
+   按顺序取第一条匹配的规则；key 为一级标题，subkey 为二级标题，value 追加到当前标题下
+ - unique: groups 中同一标题下的值是否去重
+"""
+
+EXTRACT_JS = """(spec) => {
+    const read = (el, prop) => prop === 'text' ? el.innerText : el.getAttribute(prop);
+    const readAll = (el, rule) => rule.props
+        ? Object.fromEntries(rule.props.map(p => [p, read(el, p)]))
+        : read(el, rule.prop || 'text');
+    const matches = (el, match) => {
+        const cls = el.getAttribute('class') || '';
+        if (match.class && !match.class.every(c => cls.includes(c))) return false;
+        if (match.attr && !Object.entries(match.attr).every(([k, v]) => el.getAttribute(k) === v)) return false;
+        return true;
+    };
+    const groups = (els, rule) => {
+        const out = {};
+        let key = null, subkey = null;
+        for (const el of els) {
+            const hit = rule.rules.find(r => matches(el, r.match || {}));
+            const role = hit ? hit.as : 'value';
+            const text = el.innerText;
+            if (role === 'key') {
+                key = text; subkey = null;
+                out[key] = rule.rules.some(r => r.as === 'subkey') ? {} : [];
+            } else if (role === 'subkey') {
+                if (key === null) continue;
+                subkey = text;
+                out[key][subkey] = [];
+            } else {
+                if (key === null) continue;
+                const values = Array.isArray(out[key]) ? out[key] : (subkey === null ? null : out[key][subkey]);
+                if (values === null || (rule.unique && values.includes(text))) continue;
+                values.push(text);
+            }
+        }
+        return out;
+    };
+    const out = {};
+    for (const [name, rule] of Object.entries(spec)) {
+        const scope = rule.within ? document.querySelector(rule.within) : document;
+        if (!scope) {
+            if (rule.within_required) throw new Error(rule.within_required);
+            out[name] = rule.type === 'first' ? null : (rule.type === 'groups' ? {} : []);
+            continue;
+        }
+        if (rule.type === 'click') {
+            scope.querySelectorAll(rule.selector).forEach(el => el.click());
+        } else if (rule.type === 'first') {
+            const el = scope.querySelector(rule.selector);
+            if (!el && rule.required) throw new Error(rule.required);
+            out[name] = el ? readAll(el, rule) : null;
+        } else {
+            let els = [...scope.querySelectorAll(rule.selector)];
+            if (!els.length && rule.required) throw new Error(rule.required);
+            if (rule.type === 'groups') {
+                out[name] = groups(els, rule);
+                continue;
+            }
+            if (rule.child) els = els.map(el => el.querySelector(rule.child)).filter(el => el);
+            out[name] = els.map(el => readAll(el, rule));
+        }
+    }
+    return out;
+}"""
+
+
+async def extract(page, spec: dict):
+    """
+    按规则提取页面信息：先在一次 evaluate 中执行所有 click 规则（让页面展开折叠内容），
+    再在一次 evaluate 中执行其余规则，返回 {字段名: 提取结果}
+    """
+    clicks = {name: rule for name, rule in spec.items() if rule.get('type') == 'click'}
+    reads = {name: rule for name, rule in spec.items() if rule.get('type') != 'click'}
+    if clicks:
+        await page.evaluate(EXTRACT_JS, clicks)
+    return await page.evaluate(EXTRACT_JS, reads)
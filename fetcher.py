@@ -0,0 +1,110 @@
+"""
+不经过浏览器的 HTTP 抓取：服务端渲染的网站可直接用连接池请求页面 HTML，并用 lxml 解析，
+爬虫在 items_in_html / info_of_html 中声明解析方式，解析结果校验失败时回退到 Playwright
+"""
+import re
+
+try:
+    import httpx
+    from lxml import html as lxml_html
+except ImportError:  # 只有开启 http_listing / http_detail 的爬虫需要
+    httpx = None
+    lxml_html = None
+
+
+class HttpFetcher:
+    def __init__(self, headers: dict = None, timeout: float = 20.0, max_connections: int = 20, http2: bool = False):
+        """
+        :param headers: 请求头（UA、Accept-Language 等），与浏览器 context 保持一致
+        :param timeout: 单次请求超时（秒）
+        :param max_connections: 连接池大小
+        :param http2: 是否启用 HTTP/2（需要安装 h2）
+        """
+        assert httpx is not None, "HTTP 抓取需要安装 httpx 和 lxml：pip install httpx lxml"
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.http2 = http2
+        self.client = None
+        # 抓取统计
+        #  - ok: HTTP 抓取并通过校验的页面数
+        #  - fallback: 回退到 Playwright 的页面数
+        self.counters = {'ok': 0, 'fallback': 0}
+
+    async def start(self):
+        self.client = httpx.AsyncClient(
+            headers=self.headers, timeout=self.timeout, follow_redirects=True, http2=self.http2,
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections))
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url):
+        """
+        :return: (状态码, 响应头, 页面文本, 重定向后的 url)
+        """
+        response = await self.client.get(url)
+        return response.status_code, response.headers, response.text, str(response.url)
+
+    @staticmethod
+    def parse(text, base_url=None):
+        """
+        将 HTML 文本解析为 lxml 树
+        """
+        return lxml_html.fromstring(text, base_url=base_url)
+
+    def record(self, ok: bool):
+        self.counters['ok' if ok else 'fallback'] += 1
+
+
+# inner_text 中不显示的元素
+_HIDDEN_TAGS = {'script', 'style', 'noscript', 'template', 'head', 'title', 'meta', 'link'}
+# 块级元素前后换行，p 前后空一行，与浏览器的 innerText 一致
+_BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'dd', 'details', 'dialog', 'div', 'dl', 'dt',
+               'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+               'hr', 'li', 'main', 'nav', 'ol', 'pre', 'section', 'summary', 'table', 'tr', 'ul', 'caption'}
+
+
+def inner_text(element):
+    """
+    lxml 元素的可见文本，近似浏览器的 innerText（即 Playwright 的 inner_text）：
+    忽略 script / style，块级元素和 <br> 换行，行内的连续空白合并为一个空格
+    """
+    pieces = []  # 文本，或块级元素要求的换行数（int）
+
+    def walk(node):
+        tag = node.tag if isinstance(node.tag, str) else ''
+        if tag in _HIDDEN_TAGS:
+            return
+        if tag == 'br':
+            pieces.append('\n')
+            return
+        breaks = 2 if tag == 'p' else 1 if tag in _BLOCK_TAGS else 0
+        if tag in ('td', 'th') and node.getprevious() is not None:
+            pieces.append('\t')
+        pieces.append(breaks)
+        if node.text and tag:
+            pieces.append(re.sub(r'\s+', ' ', node.text))
+        for child in node:
+            walk(child)
+            if child.tail:
+                pieces.append(re.sub(r'\s+', ' ', child.tail))
+        pieces.append(breaks)
+
+    walk(element)
+    text, pending = [], 0
+    for piece in pieces:
+        if isinstance(piece, int):
+            pending = max(pending, piece)
+        elif piece.strip(' '):
+            if text and pending:
+                text.append('\n' * pending)
+            pending = 0
+            text.append(piece)
+        elif text:  # 只有空格：保留一个，行首行尾的空格最后去掉
+            text.append(piece)
+    lines = re.sub(r' {2,}', ' ', ''.join(text)).split('\n')
+    return '\n'.join(line.strip(' ') for line in lines).strip('\n')
@@ -0,0 +1,145 @@
+"""
+图片 url 规范化：页面中的图片 url 尺寸不一（缩略图、原图、带裁剪参数），
+每个网站一个规则，将任意截获的图片 url 改写为目标分辨率的规范 url；
+爬虫写入 items.jsonl 前和 data/downloader 下载前都经过 ImageUrlNormalizer，下载和去重都按规范 url
+"""
+import re
+from urllib.parse import urlparse
+
+
+class ImageUrlRule:
+    """
+    默认规则：补全协议，去除 fragment；子类按网站重写 keep / rewrite
+    """
+    name = 'default'
+    hosts = ()  # 适用的图片域名，匹配域名本身及其子域名
+    width = None  # 默认的目标宽度，None 时不改变尺寸
+
+    def __init__(self, width: int = None):
+        """
+        :param width: 目标宽度（像素），None 时使用规则的默认宽度
+        """
+        if width is not None:
+            self.width = width
+
+    def matches(self, host):
+        return any(host == domain or host.endswith('.' + domain) for domain in self.hosts)
+
+    def keep(self, url):
+        """
+        是否为商品图片（而非图标、占位图等）
+        """
+        return True
+
+    def rewrite(self, url):
+        return url
+
+    def normalize(self, url):
+        """
+        :return: 规范 url，不是商品图片时返回 None
+        """
+        url = (url or '').strip().split('#')[0]
+        if url.startswith('//'):
+            url = 'https:' + url
+        if not url.startswith('http') or not self.keep(url):
+            return None
+        return self.rewrite(url)
+
+
+class FarfetchRule(ImageUrlRule):
+    # .../12/34/56/78/12345678_1234567_480.jpg，文件名最后一段为尺寸
+    name = 'farfetch'
+    hosts = ('farfetch-contents.com',)
+    width = 1000
+
+    def keep(self, url):
+        return 'cdn-static' not in url  # 图标
+
+    def rewrite(self, url):
+        url = url.split('?')[0]
+        return re.sub(r'_\d+(\.\w+)$', rf'_{self.width}\1', url) if self.width else url
+
+
+class YOOXRule(ImageUrlRule):
+    # 裁剪参数在 query 中，去掉后为原图
+    name = 'yoox'
+    hosts = ('yoox.com', 'yoox.biz')
+
+    def rewrite(self, url):
+        return url[:url.find('.jpg') + 4] if '.jpg' in url else url.split('?')[0]
+
+
+class ZalandoRule(ImageUrlRule):
+    # 宽度由 imwidth 参数指定
+    name = 'zalando'
+    hosts = ('ztat.net',)
+    width = 1800
+
+    def rewrite(self, url):
+        url = url[:url.find('.jpg') + 4] if '.jpg' in url else url.split('?')[0]
+        return f"{url}?imwidth={self.width}" if self.width else url
+
+
+class ADIDASRule(ImageUrlRule):
+    # /images/w_600,f_auto,q_auto/<hash>/<name>.jpg，宽度为路径中的 w_ 参数
+    name = 'adidas'
+    hosts = ('assets.adidas.com',)
+    width = 1200
+
+    def rewrite(self, url):
+        url = url.split('?')[0]
+        return re.sub(r'(?<=[/,])w_\d+', f'w_{self.width}', url) if self.width else url
+
+
+class LUISAVIAROMARule(ImageUrlRule):
+    # images.luisaviaroma.cn/<尺寸>/<路径>，Zoom 为最大尺寸
+    name = 'luisaviaroma'
+    hosts = ('images.luisaviaroma.cn', 'images.luisaviaroma.com')
+
+    def rewrite(self, url):
+        parsed = urlparse(url)
+        path = parsed.path.lstrip('/')
+        return f"{parsed.scheme}://{parsed.netloc}/Zoom/{path[path.find('/') + 1:]}"
+
+
+class NetAPorterRule(ImageUrlRule):
+    # .../variants/images/<id>/in/w920_q60.jpg，宽度为文件名中的 w 参数
+    name = 'netaporter'
+    hosts = ('net-a-porter.com',)
+    width = 920
+
+    def rewrite(self, url):
+        return re.sub(r'/w\d+(_q\d+)?(\.\w+)$', rf'/w{self.width}\1\2', url) if self.width else url
+
+
+RULES = (FarfetchRule, YOOXRule, ZalandoRule, ADIDASRule, LUISAVIAROMARule, NetAPorterRule)
+
+
+class ImageUrlNormalizer:
+    def __init__(self, rules=RULES, widths: dict = None):
+        """
+        :param rules: 规则类，按图片域名选择，没有匹配时使用默认规则
+        :param widths: 按规则名设置目标宽度，如 {'zalando': 1200}
+        """
+        widths = widths or {}
+        self.rules = [rule(widths.get(rule.name)) for rule in rules]
+        self.default = ImageUrlRule()
+        self.cache = dict()  # 域名 -> 规则
+
+    def rule_for(self, url):
+        host = urlparse(url if '://' in url else 'https:' + url).hostname or ''
+        if host not in self.cache:
+            self.cache[host] = next((rule for rule in self.rules if rule.matches(host)), self.default)
+        return self.cache[host]
+
+    def normalize(self, url):
+        """
+        :return: 规范 url，不是商品图片时返回 None
+        """
+        return self.rule_for(url or '').normalize(url)
+
+    def normalize_all(self, urls):
+        """
+        规范化并按规范 url 去重，保持顺序，去掉非商品图片
+        """
+        return list(dict.fromkeys(url for url in map(self.normalize, urls) if url))
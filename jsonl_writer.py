@@ -0,0 +1,267 @@
+"""
+后台批量 jsonl 写入：各品类的商品信息先放入队列，由后台协程按数量或时间攒批，
+在线程中写入常驻打开的文件句柄，避免磁盘 IO 阻塞事件循环
+
+每个 jsonl 旁维护一个 id 索引（<jsonl>.ids 每行一个 id，<jsonl>.ids.meta 记录 jsonl 的大小和修改时间），
+续爬时只需读取 id 索引，不必重新解析整个 jsonl
+"""
+import asyncio
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+import jsonlines
+
+DURABILITY = ('none', 'flush', 'fsync')
+
+
+def _index_paths(jsonl_path):
+    return jsonl_path + '.ids', jsonl_path + '.ids.meta'
+
+
+def _replace_text(path, text):
+    """
+    原子地替换文件内容：先写入同一目录下唯一命名的临时文件，多个进程同时重建索引时不会互相覆盖临时文件
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_index_meta(jsonl_path):
+    """
+    记录 jsonl 和 id 索引的当前状态，jsonl 被其他程序修改后索引即失效
+    """
+    ids_path, meta_path = _index_paths(jsonl_path)
+    jsonl_stat, ids_stat = os.stat(jsonl_path), os.stat(ids_path)
+    meta = {'jsonl_size': jsonl_stat.st_size, 'jsonl_mtime_ns': jsonl_stat.st_mtime_ns, 'ids_size': ids_stat.st_size}
+    _replace_text(meta_path, json.dumps(meta))
+
+
+def append_id_index(jsonl_path, ids):
+    """
+    将新写入 jsonl 的 id 追加到索引，调用前 jsonl 需已 flush
+    """
+    ids_path, _ = _index_paths(jsonl_path)
+    with open(ids_path, 'a', encoding='utf-8') as f:
+        f.writelines(f"{id_}\n" for id_ in ids)
+    _write_index_meta(jsonl_path)
+
+
+def id_index_valid(jsonl_path):
+    ids_path, meta_path = _index_paths(jsonl_path)
+    if not (os.path.isfile(ids_path) and os.path.isfile(meta_path)):
+        return False
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        jsonl_stat, ids_stat = os.stat(jsonl_path), os.stat(ids_path)
+    except (OSError, ValueError):
+        return False
+    return (meta.get('jsonl_size') == jsonl_stat.st_size and meta.get('jsonl_mtime_ns') == jsonl_stat.st_mtime_ns
+            and meta.get('ids_size') == ids_stat.st_size)
+
+
+def rebuild_id_index(jsonl_path, key='id'):
+    """
+    解析整个 jsonl 重建 id 索引，返回 id 集合（与读取索引时一致，均为 str）
+    """
+    ids_path, _ = _index_paths(jsonl_path)
+    ids = []
+    with jsonlines.open(jsonl_path) as reader:
+        for item in reader:
+            ids.append(str(item[key]))
+    _replace_text(ids_path, ''.join(f"{id_}\n" for id_ in ids))
+    _write_index_meta(jsonl_path)
+    return set(ids)
+
+
+def read_id_index(jsonl_path, key='id'):
+    """
+    读取 jsonl 中所有记录的 id：索引有效时直接读取索引，否则解析 jsonl 并重建索引
+    :return: id 集合，id 统一为 str
+    """
+    if not os.path.exists(jsonl_path):
+        return set()
+    if not id_index_valid(jsonl_path):
+        return rebuild_id_index(jsonl_path, key)
+    ids_path, _ = _index_paths(jsonl_path)
+    with open(ids_path, 'r', encoding='utf-8') as f:
+        return set(f.read().splitlines())
+
+
+class JsonlWriter:
+    def __init__(self, batch_size: int = 100, flush_interval: float = 1.0, durability: str = 'flush',
+                 max_open_files: int = 256, index_key: str = 'id', max_retries: int = 5, retry_delay: float = 0.5,
+                 metrics=None):
+        """
+        :param batch_size: 攒够多少条写入一次
+        :param flush_interval: 最长多久写入一次（秒）
+        :param durability: 每批写入后的持久化策略
+            - none: 只写入 Python 缓冲区，关闭文件时落盘
+            - flush: flush 到操作系统，进程崩溃不丢数据
+            - fsync: flush 并 fsync，机器断电不丢数据
+        :param max_open_files: 同时保持打开的文件数，超出后关闭最久未写入的文件
+        :param index_key: 写入 id 索引的字段，None 时不维护索引
+        :param max_retries: 一批写入失败（如磁盘已满）后的重试次数，每次等待时间翻倍
+        :param retry_delay: 第一次重试前的等待时间（秒）
+        :param metrics: 耗时统计（Metrics），每批写入（含落盘）的耗时记为 write 阶段，None 时不统计
+        """
+        assert durability in DURABILITY, f"durability 应为 {DURABILITY} 之一"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.max_open_files = max_open_files
+        self.queue = asyncio.Queue()
+        self._files = OrderedDict()  # path -> (file, jsonlines.Writer)，按最近写入排序
+        self.index_key = index_key
+        self._pending_ids = dict()  # path -> 已写入但尚未落盘、未加入索引的 id
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._task = None
+        self.num_written = 0
+        self.error = None  # 重试后仍然失败的写入错误，close 时抛出
+        self.metrics = metrics
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def write(self, path, item: dict, on_written=None):
+        """
+        将一条记录加入写入队列，立即返回
+        :param on_written: 所在批次写入后在事件循环中调用 on_written(error)，成功时 error 为 None
+        """
+        assert self._task and not self._task.done(), "JsonlWriter 未启动或已关闭"
+        await self.queue.put((path, item, on_written))
+
+    async def close(self):
+        """
+        写完队列中剩余的记录并关闭所有文件；有批次重试后仍写入失败时抛出该错误
+        """
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        await asyncio.to_thread(self._close_files)
+        if self.error is not None:
+            raise self.error
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            batch = []
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = await asyncio.wait_for(self.queue.get(), timeout=max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+            if batch:
+                error = await self._write_with_retry(batch)
+                for _, _, on_written in batch:
+                    if on_written:
+                        on_written(error)
+
+    async def _write_with_retry(self, batch):
+        """
+        写入一批记录，失败时等待后重试，已写入的记录不重复写入
+        :return: 重试后仍然失败时返回错误，否则返回 None
+        """
+        progress = [0]  # 已写入的记录数
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.metrics is None:
+                    await asyncio.to_thread(self._write_batch, batch, progress)
+                else:
+                    # 一批中有多个品类的记录，不区分品类
+                    with self.metrics.timer('write', category=''):
+                        await asyncio.to_thread(self._write_batch, batch, progress)
+                return None
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"写入 jsonl 失败，放弃 {len(batch) - progress[0]} 条记录：{e}")
+                    self.error = e
+                    return e
+                delay = self.retry_delay * 2 ** attempt
+                print(f"写入 jsonl 失败，{delay:.1f} 秒后重试：{e}")
+                await asyncio.sleep(delay)
+
+    def _open(self, path):
+        if path in self._files:
+            self._files.move_to_end(path)
+            return self._files[path][1]
+        if len(self._files) >= self.max_open_files:
+            path_, (fp, writer) = self._files.popitem(last=False)
+            writer.close()
+            fp.close()
+            self._sync_index(path_)
+        if self.index_key:
+            self._prepare_index(path)
+        fp = open(path, 'a', encoding='utf-8')
+        self._files[path] = (fp, jsonlines.Writer(fp))
+        return self._files[path][1]
+
+    def _write_batch(self, batch, progress):
+        """
+        :param progress: [已写入的记录数]，重试时从该位置继续
+        """
+        touched = OrderedDict((path, True) for path, _, _ in batch)
+        for path, item, _ in batch[progress[0]:]:
+            self._open(path).write(item)
+            progress[0] += 1
+            self.num_written += 1
+            if self.index_key and self.index_key in item:
+                self._pending_ids.setdefault(path, []).append(item[self.index_key])
+        if self.durability == 'none':  # 不主动落盘，id 索引在关闭文件时更新
+            return
+        for path in touched:
+            fp = self._files[path][0] if path in self._files else None
+            if fp is None:  # 已被 LRU 关闭，关闭时已落盘
+                continue
+            fp.flush()
+            if self.durability == 'fsync':
+                os.fsync(fp.fileno())
+            self._sync_index(path)
+
+    def _prepare_index(self, path):
+        """
+        打开 jsonl 前确认 id 索引与其一致，之后才能只追加新 id
+        """
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            for path_ in _index_paths(path):
+                if os.path.exists(path_):
+                    os.remove(path_)
+            open(path, 'a').close()
+            _replace_text(_index_paths(path)[0], '')
+            _write_index_meta(path)
+        elif not id_index_valid(path):
+            rebuild_id_index(path, self.index_key)
+
+    def _sync_index(self, path):
+        """
+        jsonl 落盘后，把对应的 id 追加到索引
+        """
+        if ids := self._pending_ids.pop(path, None):
+            append_id_index(path, ids)
+
+    def _close_files(self):
+        for path, (fp, writer) in self._files.items():
+            writer.close()
+            fp.flush()
+            if self.durability == 'fsync':
+                os.fsync(fp.fileno())
+            fp.close()
+            self._sync_index(path)
+        self._files.clear()
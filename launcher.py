@@ -0,0 +1,159 @@
+"""
+多进程分片爬取：将 (gender, category, sub_category) 任务列表按顺序轮流分配给 N 个进程，
+每个进程有自己的事件循环和浏览器池，写入各自负责的品类文件夹；
+子进程定期汇报进度，父进程汇总打印各分片和整体的进度以及失败的品类
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+from retry_queue import RetryQueue
+
+
+def shard_tasks(tasks, num_shards: int):
+    """
+    按排序后的顺序轮流分配任务，品类 json 和分片数不变时每个品类总是分到同一个分片；
+    变化时各分片的重试队列由 redistribute_retry_queues 重新分配
+    """
+    tasks = sorted(tasks, key=lambda task: tuple(part or '' for part in task))
+    return [tasks[i::num_shards] for i in range(num_shards)]
+
+
+def redistribute_retry_queues(root, shards):
+    """
+    分片数或品类 json 变化后，各分片目录下的重试队列可能属于其他分片：启动子进程前按本次的分片重新分配，
+    每个品类（及其商品）的记录只保存在负责它的分片中；不再属于任何分片的品类的记录被丢弃
+    :param shards: shard_tasks 的结果
+    """
+    shards_dir = os.path.join(root, "shards")
+    if not os.path.isdir(shards_dir):
+        return
+    paths = [os.path.join(shards_dir, name, "retry_queue.json") for name in sorted(os.listdir(shards_dir))]
+    sources = [RetryQueue(path) for path in paths if os.path.isfile(path)]
+    owners = {tuple(task): shard for shard, tasks in enumerate(shards) for task in tasks}
+    merged, dropped = dict(), 0  # key -> (分片, 'pending' / 'quarantine', entry)，同一 key 保留尝试次数最多的记录
+    for source in sources:
+        for table in ('pending', 'quarantine'):
+            for key, entry in getattr(source, table).items():
+                payload = entry['payload']
+                shard = owners.get((payload['gender'], payload['category'], payload.get('sub_category')))
+                if shard is None:
+                    dropped += 1
+                elif key not in merged or entry['attempts'] > merged[key][2]['attempts']:
+                    merged[key] = (shard, table, entry)
+    targets = [RetryQueue(os.path.join(shards_dir, str(shard), "retry_queue.json")) for shard in range(len(shards))]
+    target_paths = [target.path for target in targets]
+    targets += [source for source in sources if source.path not in target_paths]  # 多出来的分片目录清空
+    for target in targets:
+        target.pending, target.quarantine = dict(), dict()
+    for key, (shard, table, entry) in merged.items():
+        getattr(targets[shard], table)[key] = entry
+    for target in targets:
+        target.dirty = True
+        target.flush()
+    if dropped:
+        print(f"{dropped} 条重试记录的品类已不在品类 json 中，已丢弃")
+
+
+def _run_shard(spider_class, shard, tasks, root, category_json, run_kwargs, progress):
+    """
+    子进程入口
+    """
+    spider = spider_class()
+    spider.progress = progress
+    try:
+        asyncio.run(spider.async_run(root, category_json, tasks=tasks, shard=shard, **run_kwargs))
+        progress.put(('done', shard, spider.progress_snapshot()))
+    except BaseException:
+        progress.put(('error', shard, traceback.format_exc()))
+        raise
+
+
+def print_rollup(snapshots, errors):
+    total_new, total_done, finished, num_tasks = 0, 0, 0, 0
+    for shard in sorted(snapshots):
+        log_info = snapshots[shard]['log_info']
+        new = sum(info['num_new'] for info in log_info.values())
+        done = sum(info['num_done'] for info in log_info.values())
+        ended = sum(1 for info in log_info.values() if info.get('end'))
+        print(f"shard {shard}: {new} new, {new + done} total, {ended}/{len(log_info)} categories ended, "
+              f"{len(snapshots[shard]['failed_tasks'])} failed")
+        total_new, total_done = total_new + new, total_done + done
+        finished, num_tasks = finished + ended, num_tasks + len(log_info)
+    print(f"all shards: {total_new} new, {total_new + total_done} total, {finished}/{num_tasks} categories ended")
+    for shard, error in sorted(errors.items()):
+        print(f"shard {shard} crashed:\n{error}")
+
+
+def run_sharded(spider_class, root: str, category_json: str, num_processes: int = None,
+                report_interval: float = 10.0, **run_kwargs):
+    """
+    :param spider_class: 爬虫类，子进程中创建实例
+    :param root: 爬取结果的根目录
+    :param category_json: 品类 url 的 json 文件
+    :param num_processes: 进程数，默认为 CPU 核数
+    :param report_interval: 汇总打印进度的间隔（秒）
+    :param run_kwargs: 传给每个进程 async_run 的参数（concurrency 等均为单个进程的值）；
+        metrics_port 为第一个分片的端口，其余分片依次加一
+    :return: {'snapshots': {分片: 进度}, 'failed_tasks': 所有失败的品类, 'errors': {分片: 异常信息}}
+    """
+    spider = spider_class()
+    with open(category_json, 'r') as f:
+        spider.category_urls = json.load(f)
+    num_processes = max(1, min(num_processes or os.cpu_count() or 1, len(spider.category_tasks())))
+    shards = shard_tasks(spider.category_tasks(), num_processes)
+    redistribute_retry_queues(root, shards)
+
+    # Playwright 的驱动进程和事件循环不能 fork，使用 spawn 启动子进程
+    context = multiprocessing.get_context('spawn')
+    progress = context.Queue()
+    processes = []
+    for shard, tasks in enumerate(shards):
+        kwargs = dict(run_kwargs)
+        if kwargs.get('metrics_port'):
+            kwargs['metrics_port'] += shard
+        process = context.Process(target=_run_shard, name=f"spider-shard-{shard}",
+                                  args=(spider_class, shard, tasks, root, category_json, kwargs, progress))
+        process.start()
+        processes.append(process)
+
+    snapshots = {shard: {'log_info': {}, 'failed_tasks': []} for shard in range(len(shards))}
+    finished, errors, dead_since = set(), dict(), dict()
+    last_report = time.time()
+    while len(finished) < len(processes):
+        try:
+            kind, shard, payload = progress.get(timeout=1.0)
+            if kind == 'error':
+                errors[shard] = payload
+                finished.add(shard)
+            else:
+                snapshots[shard] = payload
+                if kind == 'done':
+                    finished.add(shard)
+        except queue.Empty:
+            pass
+        # 子进程异常退出（如被系统杀死）时不会发送消息；退出后留出时间读完队列中已发送的消息
+        for shard, process in enumerate(processes):
+            if shard not in finished and not process.is_alive():
+                if time.time() - dead_since.setdefault(shard, time.time()) > 5:
+                    errors[shard] = f"exit code {process.exitcode}"
+                    finished.add(shard)
+        if time.time() - last_report >= report_interval:
+            print_rollup(snapshots, errors)
+            last_report = time.time()
+    for process in processes:
+        process.join()
+    print_rollup(snapshots, errors)
+    failed_tasks = [task for shard in sorted(snapshots) for task in snapshots[shard]['failed_tasks']]
+    return {'snapshots': snapshots, 'failed_tasks': failed_tasks, 'errors': errors}
+
+
+if __name__ == '__main__':
+    from spider import ZalandoSpider
+
+    run_sharded(ZalandoSpider, 'Meta/ZalandoSpider-Meta', 'category-json/zalando_category.json',
+                num_processes=4, concurrency=1, headless=True)
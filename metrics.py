@@ -0,0 +1,182 @@
+"""
+分阶段的耗时统计：goto、scroll、items_in_page、info_of_item、write 等阶段按网站和品类记录耗时直方图和计数器，
+定期导出为 Prometheus 文本和 JSON 快照文件，也可以通过 HTTP 端口读取（/metrics、/metrics.json）
+当前品类通过 contextvars 传递，各阶段不需要额外的参数
+"""
+import asyncio
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# 当前任务正在处理的品类（log_key），由 category_spider / detail_worker 设置
+current_category = contextvars.ContextVar('current_category', default='')
+
+# 直方图的桶上限（秒）
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Prometheus 格式的累计计数：[(le, count), ...]
+        """
+        total, result = 0, []
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _labels(**labels):
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+class Metrics:
+    def __init__(self, site: str):
+        """
+        :param site: 网站名，作为所有指标的 site 标签
+        """
+        self.site = site
+        self.histograms = dict()  # (阶段, 品类) -> Histogram
+        self.counters = dict()  # (名称, 品类) -> 计数
+        self.start_time = time.time()
+
+    def observe(self, phase, seconds, category=None):
+        key = (phase, current_category.get() if category is None else category)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+
+    def inc(self, name, value=1, category=None):
+        key = (name, current_category.get() if category is None else category)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, phase, category=None):
+        """
+        记录代码块的耗时，异常时也记录
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, category)
+
+    def phase_totals(self):
+        """
+        按阶段汇总所有品类：{阶段: (次数, 总耗时)}
+        """
+        totals = dict()
+        for (phase, _), histogram in self.histograms.items():
+            count, total = totals.get(phase, (0, 0.0))
+            totals[phase] = (count + histogram.count, total + histogram.sum)
+        return totals
+
+    def snapshot(self):
+        """
+        JSON 快照
+        """
+        return {
+            'site': self.site,
+            'start_time': self.start_time,
+            'time': time.time(),
+            'phases': [{'phase': phase, 'category': category, 'count': h.count, 'sum': h.sum,
+                        'buckets': {str(le): count for le, count in h.cumulative()}}
+                       for (phase, category), h in sorted(self.histograms.items())],
+            'counters': [{'name': name, 'category': category, 'value': value}
+                         for (name, category), value in sorted(self.counters.items())],
+        }
+
+    def prometheus(self):
+        """
+        Prometheus 文本格式
+        """
+        lines = ['# HELP spider_phase_seconds Time spent in each crawl phase',
+                 '# TYPE spider_phase_seconds histogram']
+        for (phase, category), h in sorted(self.histograms.items()):
+            labels = _labels(site=self.site, category=category, phase=phase)
+            for le, count in h.cumulative():
+                lines.append(f'spider_phase_seconds_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f'spider_phase_seconds_sum{{{labels}}} {h.sum:.6f}')
+            lines.append(f'spider_phase_seconds_count{{{labels}}} {h.count}')
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f'# TYPE spider_{name}_total counter')
+            for (name_, category), value in sorted(self.counters.items()):
+                if name_ == name:
+                    lines.append(f'spider_{name}_total{{{_labels(site=self.site, category=category)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def render(self):
+        """
+        :return: {文件名: 内容}，在事件循环中生成，避免导出线程读取正在修改的字典
+        """
+        return {'metrics.prom': self.prometheus(),
+                'metrics.json': json.dumps(self.snapshot(), ensure_ascii=False)}
+
+    @staticmethod
+    def write_files(folder, files):
+        """
+        将 render 的结果写入 folder（先写临时文件再替换）
+        """
+        os.makedirs(folder, exist_ok=True)
+        for name, text in files.items():
+            path = os.path.join(folder, name)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(path + '.tmp', path)
+
+    async def report(self, folder, interval: float = 10.0):
+        """
+        定期将快照导出到 folder 下的 metrics.prom 和 metrics.json，被取消时再导出一次最终结果
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await asyncio.to_thread(self.write_files, folder, self.render())
+        finally:
+            self.write_files(folder, self.render())
+
+    async def serve(self, port: int, host: str = '127.0.0.1'):
+        """
+        在 port 上提供 /metrics（Prometheus 文本）和 /metrics.json，返回 asyncio Server
+        """
+
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()).strip():  # 跳过请求头
+                    pass
+                path = request.split()[1].decode() if len(request.split()) > 1 else '/'
+                if path == '/metrics.json':
+                    status, content_type, body = '200 OK', 'application/json', json.dumps(self.snapshot())
+                elif path == '/metrics':
+                    status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.prometheus()
+                else:
+                    status, content_type, body = '404 Not Found', 'text/plain', 'Not Found'
+                data = body.encode('utf-8')
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+                             f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,112 @@
+"""
+按 host 的自适应限速：令牌桶控制每个网站的请求速率，速率按 AIMD 调整——
+请求正常时线性提速，遇到 429 / 403 / 超时时成倍降速，使每个网站运行在其能容忍的最高速率
+"""
+import asyncio
+import time
+from urllib.parse import urlparse
+
+# 视为网站限流的状态码
+THROTTLE_STATUS = (403, 429, 503)
+
+
+class Throttled(Exception):
+    """
+    网站返回限流状态码
+    """
+
+    def __init__(self, url, status):
+        super().__init__(f"HTTP {status}: {url}")
+        self.url = url
+        self.status = status
+
+
+class HostBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # 当前速率（请求 / 秒）
+        self.burst = burst  # 令牌桶容量
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # Retry-After 要求的暂停截止时间
+        self.last_decrease = 0.0
+        self.lock = asyncio.Lock()
+        self.successes = 0
+        self.failures = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    def __init__(self, initial_rate: float = 1.0, min_rate: float = 0.05, max_rate: float = 20.0,
+                 increase: float = 0.05, decrease: float = 0.5, burst: float = 2.0, cooldown: float = 5.0):
+        """
+        :param initial_rate: 每个 host 的初始速率（请求 / 秒）
+        :param min_rate: 最低速率
+        :param max_rate: 最高速率
+        :param increase: 每次成功请求增加的速率（加性增）
+        :param decrease: 遇到限流时速率乘以的系数（乘性减）
+        :param burst: 令牌桶容量，允许的瞬时并发请求数
+        :param cooldown: 两次降速之间的最短间隔，避免同一波失败把速率连续减半
+        """
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = burst
+        self.cooldown = cooldown
+        self.hosts = dict()  # host -> HostBucket
+
+    def bucket(self, url) -> HostBucket:
+        host = urlparse(url).hostname or url
+        if host not in self.hosts:
+            self.hosts[host] = HostBucket(self.initial_rate, self.burst)
+        return self.hosts[host]
+
+    async def acquire(self, url):
+        """
+        等待 url 所在 host 的令牌
+        """
+        bucket = self.bucket(url)
+        async with bucket.lock:  # 同一 host 的请求排队取令牌
+            while True:
+                now = time.monotonic()
+                if now < bucket.paused_until:
+                    await asyncio.sleep(bucket.paused_until - now)
+                    continue
+                bucket.refill(now)
+                if bucket.tokens >= 1:
+                    bucket.tokens -= 1
+                    return
+                await asyncio.sleep((1 - bucket.tokens) / bucket.rate)
+
+    def success(self, url):
+        bucket = self.bucket(url)
+        bucket.successes += 1
+        bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def failure(self, url, retry_after=None):
+        """
+        请求被限流或超时：降速，若网站给出 Retry-After 则暂停该 host
+        """
+        bucket = self.bucket(url)
+        bucket.failures += 1
+        now = time.monotonic()
+        if retry_after:
+            try:
+                bucket.paused_until = max(bucket.paused_until, now + float(retry_after))
+            except ValueError:  # HTTP 日期格式的 Retry-After，按冷却时间暂停
+                bucket.paused_until = max(bucket.paused_until, now + self.cooldown)
+        if now - bucket.last_decrease >= self.cooldown:
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            bucket.tokens = min(bucket.tokens, 0.0)
+            bucket.last_decrease = now
+
+    def stats(self):
+        """
+        返回每个 host 的当前速率和请求结果计数
+        """
+        return {host: {'rate': bucket.rate, 'successes': bucket.successes, 'failures': bucket.failures}
+                for host, bucket in self.hosts.items()}
@@ -0,0 +1,83 @@
+"""
+截获网站自身的 JSON 接口：很多网站的列表页和详情页由 XHR / GraphQL 返回的 JSON 渲染，
+监听页面中 url 匹配的响应并保存 JSON，爬虫在 items_in_json / info_of_json 中直接解析，
+不再遍历 DOM 或滚动加载；没有截获到数据时回退到 items_in_page / info_of_item
+"""
+import asyncio
+import fnmatch
+
+
+class ResponseCapture:
+    def __init__(self, page, url_globs):
+        """
+        :param page: 监听的页面
+        :param url_globs: 接口 url 通配符，如 "*/api/graphql*"
+        """
+        self.page = page
+        self.url_globs = list(url_globs)
+        self.payloads = []  # 已解析的 (url, json)
+        self.pending = set()  # 正在读取响应内容的任务
+        self.arrived = asyncio.Event()
+        page.on("response", self.on_response)
+
+    def matches(self, url):
+        return any(fnmatch.fnmatch(url, pattern) for pattern in self.url_globs)
+
+    def on_response(self, response):
+        if not self.matches(response.url):
+            return
+        task = asyncio.ensure_future(self.read(response))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def read(self, response):
+        try:
+            payload = await response.json()
+        except Exception:  # 非 JSON 响应或页面已跳转
+            return
+        self.payloads.append((response.url, payload))
+        self.arrived.set()
+
+    def clear(self):
+        """
+        丢弃已截获的数据，在打开新页面或翻页前调用
+        """
+        self.payloads = []
+        self.arrived.clear()
+
+    async def take(self, timeout: float = 3.0):
+        """
+        等待第一个匹配的响应（最多 timeout 秒）和正在读取的响应，返回并清空已截获的数据
+        :return: [(url, json), ...]
+        """
+        if not self.payloads:
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.pending:
+            await asyncio.wait(list(self.pending), timeout=timeout)
+        payloads = self.payloads
+        self.clear()
+        return payloads
+
+
+def walk_json(payload):
+    """
+    深度优先遍历 JSON 中所有的值（包括 dict 和 list 本身）
+    """
+    stack = [payload]
+    while stack:
+        value = stack.pop()
+        yield value
+        if isinstance(value, dict):
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+
+
+def find_strings(payload, predicate):
+    """
+    返回 JSON 中所有满足 predicate 的字符串，去重且保持顺序
+    """
+    return list(dict.fromkeys(value for value in walk_json(payload) if isinstance(value, str) and predicate(value)))
@@ -0,0 +1,166 @@
+"""
+持久化的重试队列：记录失败的品类任务和商品详情页，按带抖动的指数退避安排重试，
+超过最大尝试次数的放入隔离列表，之后的运行直接跳过；队列保存在 json 文件中，跨运行保留
+单次运行中的尝试次数有上限，网站长时间故障时剩余的尝试留给之后的运行，不会在一次运行中全部用完而被隔离
+"""
+import json
+import os
+import random
+import time
+
+KINDS = ('category', 'item')
+
+
+class RetryQueue:
+    def __init__(self, path, max_attempts: int = 5, base_delay: float = 30.0, max_delay: float = 3600.0,
+                 jitter: float = 0.5, attempts_per_run: int = 2, save_interval: float = 5.0):
+        """
+        :param path: 队列的 json 文件路径
+        :param max_attempts: 最大尝试次数，达到后放入隔离列表
+        :param base_delay: 第一次重试的等待时间（秒），之后每次翻倍
+        :param max_delay: 最长等待时间（秒）
+        :param jitter: 抖动比例，实际等待时间在 [delay * (1 - jitter), delay] 之间随机
+        :param attempts_per_run: 单次运行中最多失败几次，之后的重试推迟到下次运行
+        :param save_interval: 两次写入文件的最短间隔（秒），期间的修改由下一次 save 或 flush 写入
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts_per_run = attempts_per_run
+        self.save_interval = save_interval
+        self.run_failures = dict()  # key -> 本次运行中的失败次数，不保存
+        self.saved_at = 0.0
+        self.dirty = False
+        # key -> entry，entry 包含 kind、payload、attempts、next_time、last_error
+        self.pending = dict()
+        self.quarantine = dict()
+        self.load()
+
+    @staticmethod
+    def key(kind, payload):
+        """
+        品类任务以 性别/品类/子品类 为 key，商品以 url 为 key
+        """
+        assert kind in KINDS, f"kind 应为 {KINDS} 之一"
+        if kind == 'category':
+            return 'category:' + '/'.join(p for p in (payload['gender'], payload['category'],
+                                                     payload.get('sub_category')) if p)
+        return 'item:' + payload['url']
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.pending = data.get('pending', {})
+        self.quarantine = data.get('quarantine', {})
+
+    def save(self):
+        """
+        标记队列已修改，距上次写入超过 save_interval 时写入文件；运行结束时需调用 flush
+        """
+        self.dirty = True
+        if time.time() - self.saved_at >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        立即写入尚未保存的修改
+        """
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'pending': self.pending, 'quarantine': self.quarantine}, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.saved_at, self.dirty = time.time(), False
+
+    def delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def failed(self, kind, payload, error=None):
+        """
+        记录一次失败，返回 entry；达到最大尝试次数时移入隔离列表
+        """
+        key = self.key(kind, payload)
+        entry = self.pending.pop(key, None) or {'kind': kind, 'payload': payload, 'attempts': 0}
+        entry['attempts'] += 1
+        self.run_failures[key] = self.run_failures.get(key, 0) + 1
+        entry['last_error'] = str(error)[:500] if error else None
+        if entry['attempts'] >= self.max_attempts:
+            self.quarantine[key] = entry
+        else:
+            entry['next_time'] = time.time() + self.delay(entry['attempts'])
+            self.pending[key] = entry
+        self.save()
+        return entry
+
+    def add_linked(self, kind, payload, linked: dict, error=None):
+        """
+        同一任务还需要在 linked（如商品所在的另一个品类）中完成，记录在 entry 的 payload['linked'] 中，重试时一并处理；
+        任务不在队列中时按 linked 记录一次失败
+        """
+        key = self.key(kind, payload)
+        entry = self.pending.get(key) or self.quarantine.get(key)
+        if entry is None:
+            return self.failed(kind, {**payload, **linked}, error)
+        if linked not in entry['payload'].setdefault('linked', []):
+            entry['payload']['linked'].append(linked)
+            self.save()
+        return entry
+
+    def succeeded(self, kind, payload):
+        if self.pending.pop(self.key(kind, payload), None) is not None:
+            self.save()
+
+    def is_quarantined(self, kind, payload):
+        return self.key(kind, payload) in self.quarantine
+
+    def release_quarantined(self, kind=None):
+        """
+        将隔离列表中的 entry 放回队列，尝试次数清零，立即可以重试（如网站故障恢复后）
+        :param kind: 只放回该类型，None 时全部放回
+        :return: 放回的数量
+        """
+        keys = [key for key, entry in self.quarantine.items() if kind is None or entry['kind'] == kind]
+        now = time.time()
+        for key in keys:
+            entry = self.quarantine.pop(key)
+            entry['attempts'], entry['next_time'] = 0, now
+            self.pending[key] = entry
+            self.run_failures.pop(key, None)
+        if keys:
+            self.save()
+        return len(keys)
+
+    def deferred(self, key):
+        """
+        本次运行中失败次数已达上限，留给下次运行
+        """
+        return self.run_failures.get(key, 0) >= self.attempts_per_run
+
+    def take_due(self, now=None):
+        """
+        取出所有已到重试时间、且未推迟到下次运行的 entry，重试后需调用 failed / succeeded；
+        entry 仍保留在队列中并推迟下次重试时间，重试过程中程序退出时下次运行会再次重试
+        """
+        now = time.time() if now is None else now
+        due = [entry for key, entry in self.pending.items() if entry['next_time'] <= now and not self.deferred(key)]
+        for entry in due:
+            entry['next_time'] = now + self.delay(entry['attempts'])
+        if due:
+            self.save()
+        return due
+
+    def next_time(self):
+        """
+        本次运行中最早的重试时间，没有可在本次运行中重试的 entry 时返回 None
+        """
+        return min((entry['next_time'] for key, entry in self.pending.items() if not self.deferred(key)),
+                   default=None)
+
+    def __len__(self):
+        return len(self.pending)
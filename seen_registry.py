@@ -0,0 +1,68 @@
+"""
+站点级别的已爬取商品登记：同一商品常出现在多个品类 / 子品类中，
+所有品类任务共享一个登记表，商品已被其他品类爬取时只记录品类归属，不再打开详情页；
+商品正在被其他品类爬取时先等待，写入磁盘后再记录归属，爬取失败时等待的品类交给重试队列
+"""
+import os
+
+from jsonl_writer import read_id_index
+
+
+class SeenRegistry:
+    def __init__(self):
+        self.owners = dict()  # 商品 id -> 首次爬取（或正在爬取）该商品的品类，为品类文件夹相对 root 的路径
+        self.done = set()  # 已写入磁盘的商品 id
+        self.waiters = dict()  # 正在爬取的商品 id -> 等待记录归属的品类 [(品类状态, 商品 url), ...]
+        self.num_linked = 0  # 只记录归属、未重复爬取的次数
+
+    def load(self, root, folders=None):
+        """
+        从 items.jsonl 的 id 索引登记已爬取的商品
+        :param folders: 只读取这些品类文件夹（多进程运行时为本分片的品类，索引过期时会重建，
+            不能读取其他进程正在写入的文件夹），None 时读取 root 下所有品类
+        """
+        if folders is None:
+            if not os.path.isdir(root):
+                return
+            folders = [folder for folder, dirs, files in os.walk(root) if "items.jsonl" in files]
+        for folder in folders:
+            if os.path.isfile(os.path.join(folder, "items.jsonl")):
+                owner = os.path.relpath(folder, root)
+                for item_id in read_id_index(os.path.join(folder, "items.jsonl")):
+                    self.owners.setdefault(item_id, owner)
+                    self.done.add(item_id)
+
+    def claim(self, item_id, owner):
+        """
+        登记 owner 将爬取该商品
+        :return: 商品已被其他品类爬取或正在爬取时返回该品类，否则返回 None
+        """
+        current = self.owners.setdefault(item_id, owner)
+        return None if current == owner else current
+
+    def wait(self, item_id, waiter):
+        """
+        商品正在被其他品类爬取，登记 waiter，由 mark_done / release 返回
+        """
+        self.waiters.setdefault(item_id, []).append(waiter)
+
+    def mark_done(self, item_id):
+        """
+        商品已写入磁盘
+        :return: 等待记录归属的品类
+        """
+        self.done.add(item_id)
+        return self.waiters.pop(item_id, [])
+
+    def release(self, item_id, owner):
+        """
+        owner 爬取商品失败，释放登记，以便其他品类再次尝试
+        :return: 等待该商品的品类，需要由调用方重新安排爬取
+        """
+        if self.owners.get(item_id) == owner and item_id not in self.done:
+            del self.owners[item_id]
+            return self.waiters.pop(item_id, [])
+        return []
+
+    def __len__(self):
+        return len(self.owners)
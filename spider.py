@@ -1,4 +1,5 @@
 import os
+import socket
 from pprint import pprint
 
 # os.environ['HTTP2_SESSION_RECV_WINDOW'] = '0'
@@ -7,12 +8,27 @@ import json
 import os.path
 import time
 from abc import abstractmethod
+from contextlib import AsyncExitStack
+from urllib.parse import urljoin, urlparse
 
 import jsonlines
 import asyncio
 
 from jsmin import jsmin
 from playwright.async_api import async_playwright
+
+from block_policy import BlockPolicy
+from browser_pool import BrowserPool
+from extract_spec import extract
+from fetcher import HttpFetcher, inner_text
+from image_url import ImageUrlNormalizer
+from jsonl_writer import JsonlWriter, read_id_index
+from metrics import Metrics, current_category
+from rate_limiter import THROTTLE_STATUS, RateLimiter, Throttled
+from response_capture import ResponseCapture, find_strings, walk_json
+from retry_queue import RetryQueue
+from seen_registry import SeenRegistry
+from work_queue import open_work_queue
 # import sys
 # import playwright
 # playwright.log.enable(sys.stdout)
@@ -28,11 +44,108 @@ HEADER = {
     'Sec-Fetch-Site': 'same-origin',
 }
 
+# 滚动 gap 像素并返回：是否到达底部、页面高度、商品卡片数量、已发出的资源请求数；
+# 资源请求由 PerformanceObserver 计数，不受 resource timing 缓冲区（默认 250 条）已满的影响
+SETTLE_JS = """([gap, selector]) => {
+    if (!window.__settleResources) {
+        window.__settleResources = {count: performance.getEntriesByType('resource').length};
+        new PerformanceObserver((list) => { window.__settleResources.count += list.getEntries().length; })
+            .observe({type: 'resource'});
+    }
+    if (gap > 0) window.scrollBy(0, gap);
+    const height = Math.max(document.body.scrollHeight, document.documentElement.scrollHeight);
+    return {
+        bottom: window.scrollY + window.innerHeight >= height - 2,
+        height: height,
+        count: selector ? document.querySelectorAll(selector).length : 0,
+        resources: window.__settleResources.count,
+    };
+}"""
+
+
+class CategoryState:
+    """
+    单个品类任务的状态，在列表页遍历和详情页 worker 之间共享
+    """
+
+    def __init__(self, gender: str, category: str, sub_category: str, category_url: str, folder: str,
+                 done_item_ids: set, owner: str):
+        self.gender = gender
+        self.category = category
+        self.sub_category = sub_category
+        self.category_url = category_url
+        self.folder = folder
+        self.dst_jsonl = os.path.join(folder, "items.jsonl")
+        self.done_item_ids = done_item_ids  # 已写入的商品 id
+        self.queued_ids = set()  # 已加入详情页队列的商品 id
+        self.in_flight = set()  # 已入队、尚未写入磁盘的商品 url，保存在断点中
+        self.checkpoint = dict()  # 上次运行保存的断点
+        self.owner = owner  # 在站点登记表中的名称（品类文件夹相对 root 的路径）
+        self.log_key = f"{gender}/{category}" + (f"/{sub_category}" if sub_category else "")
+        self.next_seq = 0  # 下一个入队商品的序号
+        self.next_write = 0  # ordered_output 时下一个待写入的序号
+        self.results = dict()  # ordered_output 时缓存已完成、尚未轮到写入的商品
+        self.pending = 0  # 已入队、尚未完成的商品数量
+        self.failed = False  # 列表页遍历是否失败
+        self.checkpoint_path = os.path.join(folder, "checkpoint.json")
+        self.drained = asyncio.Event()
+        self.drained.set()
+
+    @property
+    def payload(self):
+        """
+        品类在重试队列中的记录
+        """
+        return {'gender': self.gender, 'category': self.category, 'sub_category': self.sub_category}
+
+    def load_checkpoint(self):
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                self.checkpoint = json.load(f)
+        return self.checkpoint
+
+    def save_checkpoint(self, listing_url: str = None, page_: int = 0, finished: bool = False):
+        """
+        保存断点：下一个待遍历的列表页 url 和页码，以及尚未完成的商品 url
+        """
+        self.checkpoint = {'listing_url': listing_url, 'page': page_, 'in_flight': sorted(self.in_flight),
+                           'finished': finished, 'time': time.time()}
+        with open(self.checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, ensure_ascii=False)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def finished_recently(self, max_age: float):
+        """
+        断点是否为 max_age 秒内完成的遍历；更早完成的品类需要重新遍历列表页以发现新商品
+        """
+        return bool(self.checkpoint.get('finished')) and time.time() - self.checkpoint.get('time', 0) < max_age
+
+    def item_queued(self):
+        seq, self.next_seq = self.next_seq, self.next_seq + 1
+        self.pending += 1
+        self.drained.clear()
+        return seq
+
+    def item_waiting(self):
+        """
+        商品正在被其他品类爬取，等待其写入后记录归属；不占用序号
+        """
+        self.pending += 1
+        self.drained.clear()
+
+    def item_done(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self.drained.set()
+
+
 class Spider:
     def __init__(self, test_mode=False):
         self.root = None
+        self.shard = None  # 多进程运行时本进程的分片编号
         self.category_urls = None
         self.test_mode = test_mode
+        # 本次运行中列表页失败的品类，只用于多进程运行时由 launcher 汇总显示，重试由 retry_queue 负责
         self.failed_tasks = []
         # 用于记录爬取信息
         #  - category: 性别-品类-子品类
@@ -41,6 +154,52 @@ class Spider:
         #  - num_new: 新爬取的商品数量
         self.log_info = dict()
         self.next_page_click = False
+        # 列表页商品卡片的选择器，用于判断滚动加载是否完成；None 时只根据页面高度和网络请求判断
+        self.item_selector = None
+        self.item_spec = None  # 详情页的声明式提取规则，见 extract_spec
+        # 图片 url 规范化，按图片域名选择网站规则，写入前将 image_urls 改写为目标分辨率并去重，见 image_url
+        self.image_url_normalizer = ImageUrlNormalizer()
+        self.scroll_by_wheel = False  # 是否用鼠标滚轮滚动（部分网站只响应 wheel 事件）
+        self.settle_time = 0.5  # 页面内容保持不变多久视为加载完成
+        self.max_settle_time = 15  # 单次滚动加载的最长时间
+        self.browser_pool = None  # 由 async_run 创建并持有
+        self.writer = None  # 后台 jsonl 写入器，由 async_run 创建并持有
+        # 站点级别的已爬取商品登记，跨品类去重；None 则只在品类内去重
+        self.seen = SeenRegistry()
+        self.background_tasks = set()  # spawn 创建的后台任务
+        self.item_workers = 4  # 每个品类同时打开的商品详情页数量
+        self.item_max_try = 5  # 单个商品详情页的最大尝试次数
+        self.ordered_output = False  # 是否按列表页顺序写入 items.jsonl
+        self.queue_size = 200  # 详情页队列的容量，列表页超前太多时等待
+        self.item_queue = None  # 站点共享的详情页队列，由 async_run 在 detail_workers > 0 时创建
+        # 按 host 的自适应限速，所有页面跳转都经过它
+        self.rate_limiter = RateLimiter()
+        self.retry_queue = None  # 持久化的重试队列，由 async_run 在 root 下创建
+        self.force_rescan = False  # 忽略品类断点，从第一页重新遍历
+        # 品类遍历完成后多久内不再重新遍历（秒），只用于中断后续爬时跳过刚完成的品类；
+        # 超过后重新遍历列表页，已爬取的商品按 done_item_ids 跳过
+        self.rescan_interval = 6 * 3600
+        # 不经过浏览器、直接请求 HTML 的页面类型，需重写 items_in_html / info_of_html，校验失败时回退到浏览器
+        self.http_listing = False
+        self.http_detail = False
+        self.fetcher = None  # HTTP 连接池，由 async_run 在开启 http_listing / http_detail 时创建
+        # 截获网站自身的 JSON 接口（需重写 items_in_json / info_of_json），没有截获到数据时回退到 DOM 解析；
+        # 无限滚动加载的列表页不要设置 capture_listing，否则只能得到第一批商品
+        self.response_capture = False
+        self.capture_listing = ()  # 列表页接口的 url 通配符
+        self.capture_detail = ()  # 详情页接口的 url 通配符
+        self.capture_timeout = 3.0  # 页面跳转后等待接口响应的最长时间
+        # 截获统计：listing / detail 为直接从 JSON 得到结果的页面数，fallback 为回退到 DOM 解析的页面数
+        self.capture_counters = {'listing': 0, 'detail': 0, 'fallback': 0}
+        # 资源拦截策略，默认拦截图片、字体、媒体和第三方追踪请求；子类可按网站调整，None 则不拦截
+        self.block_policy = BlockPolicy()
+        # 分阶段耗时直方图和计数器，按网站和品类统计，由 async_run 定期导出
+        self.metrics = Metrics(type(self).__name__)
+        self.progress = None  # 多进程运行时向父进程汇报进度的队列，设置后 log 不再打印，见 launcher
+        # 多机协作：从共享工作队列领取品类和商品任务，见 work_queue；由 async_run 设置
+        self.work_queue = None
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = 300.0  # 租约时长（秒），持有期间每 1/3 租约时长续约一次
 
     @staticmethod
     async def read_json(json_file):
@@ -52,35 +211,120 @@ class Spider:
     @staticmethod
     async def read_done_item_ids(dst_jsonl):
         """
-        读取已经爬取过的商品 id
-        """
-        if not os.path.exists(dst_jsonl):
-            return set()
-        ids = set()
-        with jsonlines.open(dst_jsonl) as reader:
-            for item in reader:
-                ids.add(item['id'])
-        return ids
-
-    @staticmethod
-    async def scroll_to_bottom(page, gap=1200, sleep_time=0.15):
-        if gap == 0:
-            await page.evaluate("window.scrollTo(0, document.body.scrollHeight);")
-            return
-        max_height, height = await page.evaluate("function(){return document.body.scrollHeight}"), 0
-        while max_height >= height:
-            height += gap
-            await page.evaluate(f"window.scrollTo(0, {height});")
-            await asyncio.sleep(sleep_time)
-
-    @staticmethod
-    async def write_item_info(item_info, dst_jsonl):
+        读取已经爬取过的商品 id，优先读取 items.jsonl 旁的 id 索引，索引过期时自动重建
+        """
+        return await asyncio.to_thread(read_id_index, dst_jsonl)
+
+    async def goto(self, page, url, wait_until="domcontentloaded"):
+        """
+        经过限速器的页面跳转：429 / 403 / 503 和超时时降速并抛出异常，正常响应时提速
+        """
+        await self.rate_limiter.acquire(url)
+        try:
+            with self.metrics.timer('goto'):
+                response = await page.goto(url, wait_until=wait_until)
+        except Exception as e:
+            if "timeout" in str(e).lower():
+                self.rate_limiter.failure(url)
+            raise
+        if response is not None and response.status in THROTTLE_STATUS:
+            self.rate_limiter.failure(url, retry_after=response.headers.get('retry-after'))
+            self.metrics.inc('throttled')
+            raise Throttled(url, response.status)
+        self.rate_limiter.success(url)
+        return response
+
+    async def fetch_html(self, url):
+        """
+        经过限速器用 HTTP 请求页面，返回 lxml 解析的页面，失败时返回 None
+        """
+        await self.rate_limiter.acquire(url)
+        try:
+            with self.metrics.timer('http'):
+                status, headers, text, final_url = await self.fetcher.get(url)
+        except Exception as e:
+            if "timeout" in type(e).__name__.lower():
+                self.rate_limiter.failure(url)
+            await self._print(f"HTTP fetch failed: {e} {url}")
+            return None
+        if status in THROTTLE_STATUS:
+            self.rate_limiter.failure(url, retry_after=headers.get('retry-after'))
+            self.metrics.inc('throttled')
+            return None
+        if status != 200:
+            return None
+        self.rate_limiter.success(url)
+        return self.fetcher.parse(text, final_url)
+
+    async def listing_via_http(self, listing_url):
+        """
+        用 HTTP 获取列表页的商品 url 和下一页 url，失败或没有解析到商品时返回 None
+        """
+        tree = await self.fetch_html(listing_url)
+        try:
+            result = await self.items_in_html(tree, listing_url) if tree is not None else None
+            item_urls, next_url = result or ([], None)
+        except Exception as e:
+            await self._print(f"items_in_html failed: {e} {listing_url}")
+            item_urls, next_url = [], None
+        self.fetcher.record(bool(item_urls))
+        return (item_urls, next_url) if item_urls else None
+
+    async def item_via_http(self, item_url):
+        """
+        用 HTTP 获取商品信息，失败或未通过 validate_item 时返回 None
+        """
+        tree = await self.fetch_html(item_url)
+        try:
+            item_dict = await self.info_of_html(tree, item_url) if tree is not None else None
+        except Exception as e:
+            await self._print(f"info_of_html failed: {e} {item_url}")
+            item_dict = None
+        ok = self.validate_item(item_dict)
+        self.fetcher.record(ok)
+        return item_dict if ok else None
+
+    async def scroll_and_settle(self, page, item_selector=None, gap=1200, step_time=0.15):
+        """
+        逐步滚动页面，直到到达底部且页面内容稳定：商品卡片数量、页面高度、已发出的网络请求数
+        在 settle_time 内都不再变化；总耗时不超过 max_settle_time
+        :param item_selector: 商品卡片的选择器，数量不再增长视为加载完成
+        :param gap: 每次滚动的像素
+        :param step_time: 两次滚动之间的间隔
+        :return: 最终的商品卡片数量
+        """
+        with self.metrics.timer('scroll'):
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.max_settle_time
+            last_state, stable_since, state = None, loop.time(), {'count': 0}
+            while loop.time() < deadline:
+                if self.scroll_by_wheel:
+                    await page.mouse.wheel(0, gap)
+                # 一次 evaluate 完成滚动并返回页面状态，减少往返
+                state = await page.evaluate(SETTLE_JS, [0 if self.scroll_by_wheel else gap, item_selector])
+                key = (state['height'], state['count'], state['resources'])
+                now = loop.time()
+                if key != last_state or not state['bottom']:
+                    last_state, stable_since = key, now
+                elif now - stable_since >= self.settle_time:
+                    break
+                await asyncio.sleep(step_time)
+        return state['count']
+
+    async def write_item_info(self, item_info, dst_jsonl, on_written=None):
         """
         将商品信息以 a 模式写入文件dst_jsonl
+        :param on_written: 写入磁盘后调用 on_written(error)，成功时 error 为 None
         """
+        if self.writer:  # 交给后台写入器批量写入，写入耗时由写入器按批统计
+            await self.writer.write(dst_jsonl, item_info, on_written)
+            return
         # Jsonl 写入
-        with jsonlines.open(dst_jsonl, mode='a') as writer:
-            writer.write(item_info)
+        with self.metrics.timer('write'):
+            with jsonlines.open(dst_jsonl, mode='a') as writer:
+                writer.write(item_info)
+        if on_written:
+            on_written(None)
 
     @abstractmethod
     async def next_page_btn(self, page):
@@ -110,6 +354,101 @@ class Spider:
         """
         ...
 
+    async def items_in_html(self, tree, url):
+        """
+        从列表页 HTML 中获取所有商品的 url 和下一页的 url，开启 http_listing 时需要重写；
+        默认返回 None，回退到浏览器
+        :param tree: lxml 解析的页面
+        :param url: 页面 url
+        :return: (商品 url 列表, 下一页 url，没有下一页时为 None)
+        """
+        return None
+
+    async def info_of_html(self, tree, url):
+        """
+        从商品详情页 HTML 中获取商品信息，开启 http_detail 时需要重写；默认返回 None，回退到浏览器
+        """
+        return None
+
+    async def items_in_json(self, payloads, url):
+        """
+        从截获的列表页接口 JSON 中获取所有商品的 url，开启 response_capture 并设置 capture_listing 时需要重写；
+        默认返回 None，回退到 DOM
+        :param payloads: [(接口 url, json), ...]
+        :param url: 页面 url
+        """
+        return None
+
+    async def info_of_json(self, payloads, url):
+        """
+        从截获的详情页接口 JSON 中获取商品信息，开启 response_capture 并设置 capture_detail 时需要重写；
+        默认返回 None，回退到 DOM
+        """
+        return None
+
+    def capture_for(self, page, url_globs):
+        """
+        为页面创建接口截获，未开启 response_capture 或网站没有对应接口时返回 None
+        """
+        if self.response_capture and url_globs:
+            return ResponseCapture(page, url_globs)
+        return None
+
+    async def listing_via_capture(self, capture, page):
+        """
+        用截获的接口数据获取列表页的商品 url，没有截获到、解析失败或数据不完整时返回空列表
+        """
+        listing_url = page.url
+        payloads = await capture.take(self.capture_timeout)
+        try:
+            item_urls = await self.items_in_json(payloads, listing_url) if payloads else None
+        except Exception as e:
+            await self._print(f"items_in_json failed: {e} {listing_url}")
+            item_urls = None
+        if item_urls and not await self.capture_complete(page, item_urls):
+            item_urls = None
+        item_urls = item_urls or []
+        self.capture_counters['listing' if item_urls else 'fallback'] += 1
+        return item_urls
+
+    async def capture_complete(self, page, item_urls):
+        """
+        截获的商品数不少于页面中已渲染的商品卡片数时，才认为接口数据完整、可以跳过滚动；
+        页面分多个接口加载商品（如首屏由服务端渲染）时只能截获到部分商品
+        """
+        if not self.item_selector:
+            return True
+        try:
+            count = await page.evaluate("s => document.querySelectorAll(s).length", self.item_selector)
+        except Exception as e:
+            await self._print(f"Count items failed: {e}")
+            return True
+        if len(item_urls) < count:
+            await self._print(f"Captured {len(item_urls)} < {count} items in page, scroll instead: {page.url}")
+            return False
+        return True
+
+    async def item_via_capture(self, capture, item_url):
+        """
+        用截获的接口数据获取商品信息，失败或未通过 validate_item 时返回 None
+        """
+        payloads = await capture.take(self.capture_timeout)
+        try:
+            item_dict = await self.info_of_json(payloads, item_url) if payloads else None
+        except Exception as e:
+            await self._print(f"info_of_json failed: {e} {item_url}")
+            item_dict = None
+        ok = self.validate_item(item_dict)
+        self.capture_counters['detail' if ok else 'fallback'] += 1
+        return item_dict if ok else None
+
+    @staticmethod
+    def validate_item(item_dict):
+        """
+        校验 HTTP 抓取或接口截获得到的商品信息，不通过时回退到浏览器 DOM 解析
+        """
+        return bool(item_dict) and bool(item_dict.get("image_urls"))
+
     @staticmethod
     async def convert_category_url(url):
         """
@@ -127,12 +466,18 @@ class Spider:
             if len(self.log_info) == 0:
                 await asyncio.sleep(2)
                 continue
+            if self.progress is not None:  # 由父进程汇总打印
+                self.progress.put(('progress', self.shard, self.progress_snapshot()))
+                await asyncio.sleep(5)
+                continue
             print(f"{'=' * (log_width // 2)} Log {'=' * (log_width // 2)}")
             keys = sorted(self.log_info.keys())  # 对日志按照 key 进行排序
             for key in keys:
                 log_str = f"{key[:40]}:".ljust(40)
                 log_str += f"{self.log_info[key]['num_new']} new, ".rjust(13)
                 log_str += f"{self.log_info[key]['num_done'] + self.log_info[key]['num_new']} total".rjust(12)
+                if num_linked := self.log_info[key].get('num_linked'):
+                    log_str += f", {num_linked} linked"
                 if end_info := self.log_info[key].get('end'):
                     log_str += end_info
                 elif self.log_info[key]['num_new'] > 0:
@@ -145,195 +490,834 @@ class Spider:
             speed = min((time.time() - earliest_time) / (total_new + 0.0001), 999.99)
             print(
                 f"{total_new} new, {total_done + total_new} total, {speed:.2f} s/item")
+            if self.browser_pool:
+                pool = self.browser_pool.stats()
+                print(f"Browsers: {pool['browsers']}, active leases: {pool['active']}, leases: {pool['leases']}, "
+                      f"wait {pool['wait_avg']:.2f}/{pool['wait_max']:.2f} s (avg/max), "
+                      f"hold {pool['hold_avg']:.1f}/{pool['hold_max']:.1f} s, recycles: {pool['recycles']} "
+                      f"({pool['relaunch_failures']} failed), "
+                      f"page/context recycles: {pool['page_recycles']}/{pool['context_recycles']}")
+            if self.fetcher:
+                print(f"HTTP: {self.fetcher.counters['ok']} pages without browser, "
+                      f"{self.fetcher.counters['fallback']} fell back to browser")
+            if self.response_capture:
+                print(f"Captured: {self.capture_counters['listing']} listing pages, "
+                      f"{self.capture_counters['detail']} items from JSON, "
+                      f"{self.capture_counters['fallback']} fell back to DOM")
+            if phases := self.metrics.phase_totals():
+                print("Phases: " + ", ".join(f"{phase} {total / count:.2f} s x {count}"
+                                             for phase, (count, total) in sorted(phases.items())))
+            rates = self.rate_limiter.stats()
+            for host in sorted(rates):
+                print(f"{host}: {rates[host]['rate']:.2f} req/s, "
+                      f"{rates[host]['successes']} ok, {rates[host]['failures']} throttled")
+            if self.block_policy:
+                block = self.block_policy.stats()
+                print(f"Blocked: {block['blocked']}/{block['requests']} requests "
+                      f"({block['blocked_resource']} resource, {block['blocked_glob']} glob, "
+                      f"{block['blocked_tracker']} tracker), ~{block['bytes_saved'] / 1024 ** 2:.1f} MB saved")
             print(f"{'=' * (log_width+5)}")
             await asyncio.sleep(5)
 
+    def progress_snapshot(self):
+        """
+        各品类的进度和失败的品类，用于多进程运行时汇总
+        """
+        return {
+            'log_info': {key: {k: v for k, v in info.items() if k in ('num_new', 'num_done', 'num_linked', 'end')}
+                         for key, info in self.log_info.items()},
+            'failed_tasks': [list(task) for task in self.failed_tasks],
+        }
+
     async def _print(self, message):
         if self.test_mode:
             print(message)
 
-    async def category_spider(self, gender: str, category: str, sub_category: str = None, headless=False,
+    async def item_spider(self, item_page, item_url, gender: str, category: str, sub_category: str = None,
+                          capture=None):
+        """
+        爬取单个商品详情页，失败时重试，超过 item_max_try 次返回 None
+        :param capture: 详情页的接口截获，None 时只解析 DOM
+        """
+        item_id = await self.id_from_url(item_url)
+        for _ in range(self.item_max_try):
+            item_info = {'id': item_id}
+            # 获取商品信息，开启 http_detail 时先尝试不经过浏览器
+            try:
+                if self.http_detail and (item_dict := await self.item_via_http(item_url)) is not None:
+                    item_info.update(item_dict)
+                else:
+                    if capture:
+                        capture.clear()
+                    await self.goto(item_page, item_url)
+                    item_dict = await self.item_via_capture(capture, item_url) if capture else None
+                    if item_dict is None:
+                        await self.scroll_and_settle(item_page)  # 滚动到页面底部，等待动态加载完成
+                        with self.metrics.timer('info_of_item'):
+                            item_dict = await self.info_of_item(item_page)
+                    item_info.update(item_dict)  # 获取商品信息
+            except Exception as e:
+                # 被限流时限速器已降速，重试会按新的速率排队，不再固定等待
+                print(e)
+                continue
+            if item_info.get('image_urls'):
+                item_info['image_urls'] = self.image_url_normalizer.normalize_all(item_info['image_urls'])
+            item_info['gender'] = gender
+            item_info['category'] = category
+            if sub_category:
+                item_info['sub_category'] = sub_category
+            return item_info
+        print(f"Failed to open {item_url} after {self.item_max_try} tries")
+        return None
+
+    async def detail_worker(self, queue: asyncio.Queue, lease):
+        """
+        详情页 worker：从队列中取出 (品类状态, 序号, 商品 url) 爬取商品详情，取到 None 时退出
+        :param queue: 商品队列，可以是单个品类的队列，也可以是整个站点共享的队列
+        :param lease: 浏览器池租借，用于创建商品页面
+        """
+        item_page = await lease.new_page()
+        capture = self.capture_for(item_page, self.capture_detail)
+        fallback = None  # 更换 page / context 失败后改用的新租借（AsyncExitStack），同一时间最多一个
+        try:
+            while True:
+                task = await queue.get()
+                try:
+                    if task is None:
+                        break
+                    state, seq, item_url = task
+                    current_category.set(state.log_key)  # 耗时统计记在商品所属的品类下
+                    try:
+                        item_page, recycled = await self.recycle_page(lease, item_page)
+                    except Exception as e:
+                        print(f"更换 page 失败，改用新的浏览器租借：{e}")
+                        # 先归还损坏的租借再租借新的：浏览器池没有多余的 context 名额，
+                        # 品类内共用的租借中还有其他 page（如列表页）时由其持有者归还
+                        if fallback is not None:
+                            await fallback.aclose()
+                        elif not set(lease.pages) - {item_page}:
+                            await lease.release()
+                        fallback = AsyncExitStack()
+                        lease = await fallback.enter_async_context(self.browser_pool.lease())
+                        item_page, recycled = await lease.new_page(), True
+                    if recycled:
+                        capture = self.capture_for(item_page, self.capture_detail)
+                    item_info = await self.item_spider(item_page, item_url, state.gender, state.category,
+                                                       state.sub_category, capture=capture)
+                    await self.finish_item(state, seq, item_url, item_info)
+                finally:
+                    queue.task_done()
+        finally:
+            try:
+                await item_page.close()
+            finally:
+                if fallback is not None:
+                    await fallback.aclose()
+
+    async def recycle_page(self, lease, page):
+        """
+        在两个任务之间检查 page 的导航次数和内存，达到上限时更换 page 或 context（保留 cookie），
+        更换次数按原因记入耗时统计的 page_recycles、context_recycles、memory_recycles、browser_recycles
+        :return: (可继续使用的 page, 是否已更换)
+        """
+        page, reason = await lease.maybe_recycle(page)
+        if reason:
+            self.metrics.inc(f'{reason}_recycles')
+        return page, reason is not None
+
+    async def finish_item(self, state, seq: int, item_url: str, item_info):
+        """
+        写入爬取完成的商品，item_info 为 None 表示爬取失败；
+        商品写入磁盘后才移出 in_flight 并计为完成，断点中不会漏掉还在写入队列里的商品
+        """
+        item_payload = {'url': item_url, **state.payload}
+        if item_info is None:
+            self.metrics.inc('item_failures')
+            entry = self.retry_queue.failed('item', item_payload, f"failed after {self.item_max_try} tries")
+            if {key: entry['payload'].get(key) for key in state.payload} != state.payload:
+                # 重试记录属于之前失败的另一个品类，本品类记在 linked 中
+                self.retry_queue.add_linked('item', item_payload, state.payload)
+            if self.seen is not None:
+                item_id = await self.id_from_url(item_url)
+                self.fail_waiters(item_id, self.seen.release(item_id, state.owner))
+        else:
+            self.retry_queue.succeeded('item', item_payload)
+        if self.ordered_output:
+            # 按入队顺序写入：results 缓存已完成的商品，失败的记为 None，保证序号连续
+            state.results[seq] = (item_url, item_info)
+            ready = []
+            while state.next_write in state.results:
+                ready.append(state.results.pop(state.next_write))
+                state.next_write += 1
+        else:
+            ready = [(item_url, item_info)]
+        for item_url_, item_info_ in ready:
+            if not item_info_:  # 失败的商品已进入重试队列
+                state.in_flight.discard(item_url_)
+                state.item_done()
+                continue
+
+            def on_written(error, url=item_url_, item_id=item_info_['id']):
+                if error is None:
+                    state.in_flight.discard(url)
+                    if self.seen is not None:  # 写入后才为等待的品类记录归属
+                        for waiter in self.seen.mark_done(item_id):
+                            self.spawn(self.link_item(*waiter, item_id, state.owner))
+                elif self.seen is not None:
+                    self.fail_waiters(item_id, self.seen.release(item_id, state.owner))
+                state.item_done()
+
+            try:
+                await self.write_item_info(item_info_, state.dst_jsonl, on_written)
+            except BaseException:
+                state.item_done()
+                raise
+            # 更新日志和计数器
+            state.done_item_ids.add(item_info_['id'])
+            self.log_info[state.log_key]['num_new'] += 1
+            self.metrics.inc('items')
+
+    async def enqueue_items(self, state, item_urls, queue: asyncio.Queue):
+        """
+        将列表页中未爬取的商品加入详情页队列，队列已满时等待（背压）
+        已被其他品类爬取（或正在爬取）的商品，只记录品类归属
+        """
+        for item_url in item_urls:
+            item_id = await self.id_from_url(item_url)
+            if item_id in state.done_item_ids or item_id in state.queued_ids:
+                continue
+            if self.retry_queue.is_quarantined('item', {'url': item_url}):  # 多次失败的商品不再尝试
+                continue
+            if self.seen is not None and (source := self.seen.claim(item_id, state.owner)):
+                state.queued_ids.add(item_id)
+                state.in_flight.add(item_url)
+                state.item_waiting()
+                if item_id in self.seen.done:
+                    await self.link_item(state, item_url, item_id, source)
+                else:  # 其他品类正在爬取，写入后再记录归属
+                    self.seen.wait(item_id, (state, item_url))
+                continue
+            state.queued_ids.add(item_id)
+            state.in_flight.add(item_url)
+            await queue.put((state, state.item_queued(), item_url))
+
+    async def link_item(self, state, item_url, item_id, source):
+        """
+        商品已由 source 品类写入，只记录本品类的归属；由 item_waiting 计数，写入后计为完成
+        """
+        membership = {'id': item_id, 'gender': state.gender, 'category': state.category, 'source': source}
+        if state.sub_category:
+            membership['sub_category'] = state.sub_category
+
+        def on_written(error):
+            if error is None:
+                state.in_flight.discard(item_url)
+            state.item_done()
+
+        try:
+            await self.write_item_info(membership, os.path.join(state.folder, "memberships.jsonl"), on_written)
+        except BaseException:
+            state.item_done()
+            raise
+        state.done_item_ids.add(item_id)
+        self.retry_queue.succeeded('item', {'url': item_url})
+        self.seen.num_linked += 1
+        self.metrics.inc('linked', category=state.log_key)
+        self.log_info[state.log_key]['num_linked'] = self.log_info[state.log_key].get('num_linked', 0) + 1
+
+    def fail_waiters(self, item_id, waiters):
+        """
+        等待的商品在其所属品类中爬取失败：记在该商品的重试记录中，重试时各品类重新登记
+        """
+        for state, item_url in waiters:
+            self.retry_queue.add_linked('item', {'url': item_url}, state.payload, "linked item failed in its owner")
+            state.in_flight.discard(item_url)
+            state.queued_ids.discard(item_id)
+            state.item_done()
+
+    def spawn(self, coro):
+        """
+        在后台运行 coro，保留任务的引用直到完成
+        """
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def open_category(self, gender: str, category: str, sub_category: str = None):
+        """
+        获取品类的 url 和文件夹，读取已爬取的商品 id，返回品类状态
+        """
+        category_url = self.category_urls[gender][category]
+        category_folder = os.path.join(self.root, gender, category)
+        if sub_category:
+            category_url = category_url[sub_category]
+            category_folder = os.path.join(category_folder, sub_category)
+        category_url = await self.convert_category_url(category_url)
+        if not os.path.exists(category_folder):
+            os.makedirs(category_folder)
+        done_item_ids = await self.read_done_item_ids(os.path.join(category_folder, "items.jsonl"))
+        # 已记录归属的商品（在其他品类中爬取过）也视为已完成
+        done_item_ids |= await self.read_done_item_ids(os.path.join(category_folder, "memberships.jsonl"))
+        state = CategoryState(gender, category, sub_category, category_url, category_folder, done_item_ids,
+                              owner=os.path.relpath(category_folder, self.root))
+        state.load_checkpoint()
+        # 记录到日志中，重试时沿用已有的记录
+        if state.log_key in self.log_info:
+            self.log_info[state.log_key].pop('end', None)
+        else:
+            self.log_info[state.log_key] = {'start_time': time.time(), 'num_done': len(done_item_ids), 'num_new': 0}
+        return state
+
+    async def walk_listing(self, state, page, queue: asyncio.Queue, lease=None):
+        """
+        遍历品类的列表页，将商品 url 加入详情页队列；不等待详情页爬取，直接翻到下一页
+        :param lease: 列表页所在的浏览器池租借，按 url 翻页时在翻页前检查是否需要更换 page
+        """
+        gender, category, sub_category, log_key = state.gender, state.category, state.sub_category, state.log_key
+        listing_url, page_ = state.category_url, 0
+        if not self.force_rescan:
+            # 先重新加入上次未写入的商品；遍历未完成时从断点处的列表页继续
+            await self.enqueue_items(state, state.checkpoint.get('in_flight', []), queue)
+            if state.checkpoint.get('listing_url') and not state.checkpoint.get('finished'):
+                listing_url, page_ = state.checkpoint['listing_url'], state.checkpoint['page']
+                await self._print(f"Resume {log_key} from page {page_}: {listing_url}")
+        loaded = False
+        capture = self.capture_for(page, self.capture_listing)
+        category_max_try, category_try_ = 8, 0
+        # 类别页面的 Loop
+        while True:
+            if self.http_listing and not loaded and (result := await self.listing_via_http(listing_url)):
+                # HTTP 获取列表页成功，不打开浏览器页面；失败时用浏览器打开同一列表页
+                item_urls, next_url = result
+                page_ += 1
+                self.metrics.inc('pages')
+                await self.enqueue_items(state, item_urls, queue)
+                if not next_url:
+                    self.log_info[log_key]['end'] = ', finished'
+                    break
+                listing_url = next_url
+                state.save_checkpoint(listing_url, page_)
+                continue
+            try:
+                if not loaded:
+                    if capture:
+                        capture.clear()
+                    await self.goto(page, listing_url)
+                    loaded = True
+                # 优先使用截获的接口数据，没有时滚动到页面底部，等待商品卡片不再增长
+                item_urls = await self.listing_via_capture(capture, page) if capture else []
+                if not item_urls:
+                    await self.scroll_and_settle(page, self.item_selector)
+                    with self.metrics.timer('items_in_page'):
+                        item_urls = await self.items_in_page(page)  # 获取当前页面的所有商品的 url
+                await self._print(f"PAGE: {page_}, ITEMS: {len(item_urls)}")
+            except Exception as e:
+                print(e)
+                category_try_ += 1
+                if category_try_ >= category_max_try:
+                    print(f"当前品类 {log_key} 页面爬取失败：{e}")
+                    self.log_info[log_key]['end'] = f', Fail to Open Page: {e} {page.url}'
+                    self.failed_tasks.append([gender, category, sub_category])
+                    self.retry_queue.failed('category', state.payload, e)
+                    state.failed = True
+                    break
+                continue
+
+            # 如果当前页面没有商品，则说明已经到达最后一页
+            if len(item_urls) == 0:
+                self.log_info[log_key]['end'] = ', finished'
+                break
+
+            page_ += 1  # 当前页面的页码
+            self.metrics.inc('pages')
+            # 根据 id 去除已经爬取过的商品，其余加入详情页队列
+            await self.enqueue_items(state, item_urls, queue)
+
+            # 如果存在下一页按钮，则点击下一页按钮
+            try:
+                next_page_btn = await self.next_page_btn(page)
+                print(next_page_btn)
+                if next_page_btn and self.http_listing and not self.next_page_click:
+                    # 下一页同样先尝试 HTTP，失败时才在浏览器中打开
+                    listing_url, loaded = next_page_btn, False
+                    state.save_checkpoint(listing_url, page_)
+                    continue
+                if next_page_btn:
+                    old_url = page.url
+                    if capture:  # 只保留下一页的接口数据
+                        capture.clear()
+                    if self.next_page_click:
+                        await self.rate_limiter.acquire(old_url)
+                        await next_page_btn.click()
+                    else:
+                        if lease:  # 下一页 url 已知，在新的 page 中打开不会丢失位置
+                            page, recycled = await self.recycle_page(lease, page)
+                            if recycled:
+                                capture = self.capture_for(page, self.capture_listing)
+                        await self.goto_next_page(page, next_page_btn, category_max_try)
+                    # 等待 url 发生变化，页面内容的加载由下一轮 scroll_and_settle 等待
+                    try:
+                        await page.wait_for_url(lambda url: url != old_url, wait_until="domcontentloaded",
+                                                timeout=10000)
+                        # 保存断点：url 能定位到下一页时记录该 url，否则只更新未完成的商品
+                        listing_url = page.url
+                    except Exception as e:
+                        await self._print(f"URL not changed after next page: {e}")
+                    state.save_checkpoint(listing_url if listing_url != state.category_url else None, page_)
+                else:  # 未找到下一页按钮，说明已经到达最后一页
+                    self.log_info[log_key]['end'] = ', finished'
+                    break
+            except Exception as e:
+                print(e)
+                self.log_info[log_key]['end'] = f', Fail to Next Page: {e} {page.url}'
+                self.failed_tasks.append([gender, category, sub_category])
+                self.retry_queue.failed('category', state.payload, e)
+                state.failed = True
+                break
+
+    async def goto_next_page(self, page, next_url, max_try: int):
+        """
+        打开下一页：被限流时限速器已降速（或按 Retry-After 暂停），按新的速率重试，不将品类记为失败
+        """
+        for try_ in range(max_try):
+            try:
+                return await self.goto(page, next_url)
+            except Throttled as e:
+                if try_ == max_try - 1:
+                    raise
+                await self._print(f"Next page throttled, retrying: {e}")
+
+    async def category_spider(self, gender: str, category: str, sub_category: str = None,
                               semaphore=asyncio.Semaphore(5)):
         """
         用来爬去一个品类的服装页面，该页面应该包含商品列表、页码/总页数、换页按钮等元素
+        列表页和详情页同时进行：列表页将商品 url 放入队列，详情页 worker 从队列中取出爬取
+         - 设置了 self.item_queue（站点共享的详情页 worker）时放入共享队列
+         - 否则为本品类启动 item_workers 个详情页 worker
         :param semaphore: 限制最大并行数
         :param gender: 性别（或类型，如有 kids 等）
         :param category: 服装类别
         :param sub_category:  服装类别的子分类
-        :param headless: 是否启用无头浏览器
-        """
+        :return: 品类状态
+        """
+        state = await self.open_category(gender, category, sub_category)
+        current_category.set(state.log_key)
+        if state.finished_recently(self.rescan_interval) and not self.force_rescan:
+            self.log_info[state.log_key]['end'] = ', finished (checkpoint)'
+            self.retry_queue.succeeded('category', state.payload)
+            return state
         async with semaphore:
-            async with async_playwright() as playwright:
-                browser = await playwright.chromium.launch(headless=headless, args=['--start-maximized'])
-                context = await browser.new_context(
-                    extra_http_headers=HEADER,
-                    user_agent=USER_AGENT,
-                    locale="en-GB",  # zh-CN、en-GB
-                    no_viewport=True,
-                )
-                # 拦截 webp
-                # abort_types = ['media', 'font'] #, "image"] #'stylesheet']
-                # await context.route("**/*", lambda
-                #     route: route.abort() if route.request.resource_type in abort_types else route.continue_())
-                page = await context.new_page()
+            # 从浏览器池租借 context，不再为每个品类单独启动浏览器
+            async with self.browser_pool.lease() as lease:
+                # 资源拦截由浏览器池在创建 context 时按 self.block_policy 设置
+                page = await lease.new_page()
                 # await page.route( "**", lambda route: route.continue_(http_version="http/1.1"))
                 # await page.route("**/*.{png,jpg,jpeg}", lambda route: route.abort())  # 禁止加载图片
-
-                # 获取服装类别的 url, 读取类别对应的 item.jsonl 文件
-                category_url = self.category_urls[gender][category]
-                category_folder = os.path.join(self.root, gender, category)
-                if sub_category:
-                    category_url = category_url[sub_category]
-                    category_folder = os.path.join(category_folder, sub_category)
-                category_url = await self.convert_category_url(category_url)
-                if not os.path.exists(category_folder):
-                    os.makedirs(category_folder)
-                dst_jsonl = os.path.join(category_folder, "items.jsonl")
-                done_item_ids = await self.read_done_item_ids(dst_jsonl)
-
-                # 记录到日志中
-                log_key = f"{gender}/{category}"
-                if sub_category:
-                    log_key += f"/{sub_category}"
-                self.log_info[log_key] = {'start_time': time.time(), 'num_done': len(done_item_ids), 'num_new': 0}
-
-                # 开始爬取
-                page_ = 0
-                category_max_try, category_try_ = 8, 0
-                # 类别页面的 Loop
-                while True:
+                if self.item_queue is not None:
+                    await self.walk_listing(state, page, self.item_queue, lease)
+                else:
+                    queue = asyncio.Queue(maxsize=self.queue_size)
+                    workers = [asyncio.create_task(self.detail_worker(queue, lease))
+                               for _ in range(self.item_workers)]
                     try:
-                        if page_ == 0:
-                            await page.goto(category_url, wait_until="domcontentloaded")
-                        await self.scroll_to_bottom(page)  # 滚动到页面底部，以防有网页动态加载
-                        await asyncio.sleep(1)  # 给页面加载留出时间
-                        item_urls = await self.items_in_page(page)  # 获取当前页面的所有商品的 url
-                        await self._print(f"PAGE: {page_}, ITEMS: {len(item_urls)}")
-                    except Exception as e:
-                        print(e)
-                        category_try_ += 1
-                        if category_try_ >= category_max_try:
-                            print(f"当前品类 {log_key} 页面爬取失败：{e}")
-                            self.log_info[log_key]['end'] = f', Fail to Open Page: {e} {page.url}'
-                            self.failed_tasks.append([gender, category, sub_category])
-                            break
-                        continue
-
-                    # 如果当前页面没有商品，则说明已经到达最后一页
-                    if len(item_urls) == 0:
-                        self.log_info[log_key]['end'] = ', finished'
-                        break
+                        await self.supervise(self.walk_listing(state, page, queue, lease), workers)
+                    except BaseException:
+                        await self.stop_workers(queue, workers, cancel=True)
+                        raise
+                    await self.stop_workers(queue, workers)
+        # 等待共享队列中本品类的商品爬取完成
+        await state.drained.wait()
+        if not state.failed:
+            self.retry_queue.succeeded('category', state.payload)
+            state.save_checkpoint(finished=True)
+        return state
+
+    async def retry_items(self, items):
+        """
+        重新爬取重试队列中到期的商品，按品类分组放入详情页队列
+        :param items: 商品记录列表，包含 url、gender、category、sub_category，
+            以及同样包含该商品、等待记录归属的品类 linked（可选）
+        """
+        groups = dict()
+        for payload in items:
+            for category_payload in [payload, *payload.get('linked', [])]:
+                groups.setdefault((category_payload['gender'], category_payload['category'],
+                                   category_payload.get('sub_category')), []).append(payload['url'])
+
+        states = [(await self.open_category(gender, category, sub_category), item_urls)
+                  for (gender, category, sub_category), item_urls in groups.items()]
+        if len(states) == 1:  # 在创建 worker 之前设置，worker 复制当前品类，耗时统计不会记在空品类下
+            current_category.set(states[0][0].log_key)
+
+        async def feed(queue):
+            for state, item_urls in states:
+                current_category.set(state.log_key)
+                for item_url in item_urls:  # 已在其他地方爬取成功的商品直接移出重试队列
+                    if await self.id_from_url(item_url) in state.done_item_ids:
+                        self.retry_queue.succeeded('item', {'url': item_url})
+                await self.enqueue_items(state, item_urls, queue)
+            await asyncio.gather(*[state.drained.wait() for state, _ in states])
+
+        if self.item_queue is not None:
+            await feed(self.item_queue)
+            return
+        async with self.browser_pool.lease() as lease:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            workers = [asyncio.create_task(self.detail_worker(queue, lease)) for _ in range(self.item_workers)]
+            try:
+                await self.supervise(feed(queue), workers)
+            except BaseException:
+                await self.stop_workers(queue, workers, cancel=True)
+                raise
+            await self.stop_workers(queue, workers)
 
-                    # 根据 id 去除已经爬取过的商品
-                    item_urls = [url for url in item_urls if await self.id_from_url(url) not in done_item_ids]
-
-                    page_ += 1  # 当前页面的页码
-                    item_index = 0  # 当前页面正在爬取的商品的索引
-                    item_max_try, item_try_ = 5, 0
-                    item_page = await context.new_page()
-                    while item_index < len(item_urls):
-                        item_url = item_urls[item_index]
-                        item_id = await self.id_from_url(item_url)
-                        item_info = {'id': item_id}
-                        # 获取商品信息
-                        try:
-                            await item_page.goto(item_url, wait_until="domcontentloaded")
-                            await self.scroll_to_bottom(item_page)  # 滚动到页面底部，以防有网页动态加载
-                            item_dict = await self.info_of_item(item_page)
-                            item_info.update(item_dict)  # 获取商品信息
-                        except Exception as e:
-                            print(e)
-                            item_try_ += 1
-                            if item_try_ >= item_max_try:
-                                print(f"Failed to open {item_url} after {item_max_try} tries")
-                                item_index += 1
-                            await asyncio.sleep(10)  # 缓冲时间，防止被 ban
-                            continue
-
-                        item_info['gender'] = gender
-                        item_info['category'] = category
-                        if sub_category:
-                            item_info['sub_category'] = sub_category
-                        await self.write_item_info(item_info, dst_jsonl)
-                        # 更新日志和计数器
-                        item_index += 1
-                        done_item_ids.add(item_id)
-                        self.log_info[log_key]['num_new'] += 1
-                    await item_page.close()
-
-                    # 如果存在下一页按钮，则点击下一页按钮
-                    try:
-                        next_page_btn = await self.next_page_btn(page)
-                        print(next_page_btn)
-                        if next_page_btn:
-                            old_url = page.url
-                            if self.next_page_click:
-                                await next_page_btn.click()
-                            else:
-                                await page.goto(next_page_btn, wait_until="domcontentloaded")
-                            # 等待 url 发生变化
-                            wait_time = 0
-                            while page.url == old_url and wait_time < 10:
-                                await asyncio.sleep(1.0)
-                                wait_time += 1
-                            await asyncio.sleep(1.0)  # 给页面加载留出时间
-                        else:  # 未找到下一页按钮，说明已经到达最后一页
-                            self.log_info[log_key]['end'] = ', finished'
-                            break
-                    except Exception as e:
-                        print(e)
-                        self.log_info[log_key]['end'] = f', Fail to Next Page: {e} {page.url}'
-                        self.failed_tasks.append([gender, category, sub_category])
-                        break
+    @staticmethod
+    async def supervise(coro, workers):
+        """
+        运行向详情页队列放入商品的 coro，同时监视 worker：worker 在 coro 完成前退出（异常）时取消 coro 并抛出，
+        避免在没有消费者的有界队列上永远等待
+        """
+        main = asyncio.ensure_future(coro)
+        try:
+            while not main.done():
+                done, _ = await asyncio.wait([main, *workers], return_when=asyncio.FIRST_COMPLETED)
+                for worker in done - {main}:
+                    if not worker.cancelled() and worker.exception():
+                        raise worker.exception()
+                    raise RuntimeError("详情页 worker 提前退出")
+            return main.result()
+        finally:
+            if not main.done():
+                main.cancel()
+                await asyncio.gather(main, return_exceptions=True)
 
-    async def async_run(self, root: str, category_json: str, concurrency: int = 2, headless=False):
-        self.root = root
-        with open(category_json, 'r') as f:
-            self.category_urls = json.load(f)
-        semaphore = asyncio.Semaphore(concurrency)
-        task_list = [asyncio.create_task(self.log())]
+    @staticmethod
+    async def stop_workers(queue: asyncio.Queue, workers, cancel: bool = False):
+        """
+        通知详情页 worker 退出：正常结束时放入 None，出错时直接取消（worker 可能已退出，不能再等待队列）
+        """
+        for worker in workers:
+            if cancel:
+                worker.cancel()
+            else:
+                await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=cancel)
+
+    async def run_retries(self, semaphore, max_retry_wait: float):
+        """
+        处理重试队列：到期的品类重新遍历列表页，到期的商品重新打开详情页；
+        下一次重试在 max_retry_wait 秒以内时等待，否则留给下次运行；
+        本次运行中失败次数已达 retry_queue.attempts_per_run 的任务也留给下次运行
+        """
+        while (next_time := self.retry_queue.next_time()) is not None:
+            wait = next_time - time.time()
+            if wait > max_retry_wait:
+                break
+            if wait > 0:
+                await asyncio.sleep(wait)
+            entries = self.retry_queue.take_due()
+            task_list = [asyncio.create_task(self.category_spider(entry['payload']['gender'],
+                                                                  entry['payload']['category'],
+                                                                  entry['payload'].get('sub_category'),
+                                                                  semaphore=semaphore))
+                         for entry in entries if entry['kind'] == 'category']
+            items = [entry['payload'] for entry in entries if entry['kind'] == 'item']
+            if items:
+                task_list.append(asyncio.create_task(self.retry_items(items)))
+            await asyncio.gather(*task_list)
+        if len(self.retry_queue):
+            print(f"{len(self.retry_queue)} 个任务将在下次运行时重试")
+
+    async def seed_work_queue(self, tasks):
+        """
+        将品类任务（带 url）放入工作队列，已存在或已完成的任务不重复放入
+        """
+        payloads = []
+        for gender, category, sub_category in tasks:
+            url = self.category_urls[gender][category]
+            url = url[sub_category] if sub_category else url
+            payloads.append({'gender': gender, 'category': category, 'sub_category': sub_category, 'url': url})
+        await asyncio.to_thread(self.work_queue.put_many, 'category', payloads)
+
+    async def run_leased(self, task, semaphore):
+        """
+        处理领取的任务，期间定期续约；租约被其他节点接管时取消任务
+        """
+        payload = task['payload']
+        # 本节点的品类 json 中可能没有该品类：品类任务带有 url，商品任务（及其 linked 品类）带有 category_url
+        if task['kind'] == 'category':
+            self.register_category_url(payload, payload.get('url'))
+        else:
+            for category_payload in [payload, *payload.get('linked', [])]:
+                self.register_category_url(category_payload, category_payload.get('category_url'))
+        if task['kind'] == 'category':
+            work = asyncio.create_task(self.category_spider(payload['gender'], payload['category'],
+                                                            payload.get('sub_category'), semaphore=semaphore))
+        else:
+            work = asyncio.create_task(self.retry_items([payload]))
+        lost = False
+        while not work.done():
+            await asyncio.wait({work}, timeout=self.lease_ttl / 3)
+            if not work.done() and not await asyncio.to_thread(self.work_queue.heartbeat, task['key'],
+                                                                self.worker_id, self.lease_ttl):
+                lost = True
+                work.cancel()
+        try:
+            result = await work
+        except asyncio.CancelledError:
+            if not lost:
+                raise
+            await self._print(f"Lease lost: {task['key']}")
+            return
+        except Exception as e:
+            await asyncio.to_thread(self.work_queue.fail, task['key'], self.worker_id, e)
+            return
+        # 失败的任务交给工作队列重新分配（可能分配给其他节点），不再留在本地重试队列
+        if task['kind'] == 'category':
+            failed = result.failed
+            self.retry_queue.succeeded('category', result.payload)
+            await self.hand_off_items(result)
+        else:
+            failed = self.retry_queue.key('item', payload) in self.retry_queue.pending
+            self.retry_queue.succeeded('item', payload)
+        if failed:
+            await asyncio.to_thread(self.work_queue.fail, task['key'], self.worker_id, "failed",
+                                    self.retry_queue.delay(task['attempts']))
+        else:
+            await asyncio.to_thread(self.work_queue.complete, task['key'], self.worker_id)
 
+    def register_category_url(self, payload, category_url):
+        if not category_url:
+            return
+        node = self.category_urls.setdefault(payload['gender'], {})
+        if payload.get('sub_category'):
+            node.setdefault(payload['category'], {})[payload['sub_category']] = category_url
+        else:
+            node[payload['category']] = category_url
+
+    def raw_category_url(self, payload):
+        """
+        品类 json 中的 url（未经 convert_category_url），本节点没有该品类时返回 None
+        """
+        url = self.category_urls.get(payload['gender'], {}).get(payload['category'])
+        if payload.get('sub_category'):
+            url = url.get(payload['sub_category']) if isinstance(url, dict) else None
+        return url if isinstance(url, str) else None
+
+    async def hand_off_items(self, state):
+        """
+        品类任务完成后，将其中爬取失败的商品作为 item 任务放入工作队列，由任意节点重试，不再留在本地重试队列；
+        任务带有品类的 category_url，没有该品类的节点也能处理
+        """
+        payloads = []
+        for key, entry in list(self.retry_queue.pending.items()):
+            payload = entry['payload']
+            if entry['kind'] != 'item' or {k: payload.get(k) for k in state.payload} != state.payload:
+                continue
+            payload = {**payload, 'category_url': self.raw_category_url(payload),
+                       'linked': [{**linked, 'category_url': self.raw_category_url(linked)}
+                                  for linked in payload.get('linked', [])]}
+            payloads.append(payload)
+            self.retry_queue.succeeded('item', payload)
+        if payloads:
+            await asyncio.to_thread(self.work_queue.put_many, 'item', payloads)
+
+    async def work_queue_worker(self, semaphore):
+        """
+        不断从工作队列领取任务，队列中没有待处理和被领取中的任务时退出；
+        其他节点持有的租约可能过期，因此没有可领取的任务时等待后再试
+        """
+        while True:
+            task = await asyncio.to_thread(self.work_queue.lease, self.worker_id, self.lease_ttl)
+            if task is None:
+                if not await asyncio.to_thread(self.work_queue.unfinished):
+                    break
+                await asyncio.sleep(min(30.0, self.lease_ttl / 10))
+                continue
+            await self.run_leased(task, semaphore)
+
+    async def shared_detail_worker(self):
+        """
+        站点共享的详情页 worker，租借独立的 context，消费所有品类的商品队列
+        """
+        async with self.browser_pool.lease() as lease:
+            await self.detail_worker(self.item_queue, lease)
+
+    def category_tasks(self):
+        """
+        展开品类 json，返回 (gender, category, sub_category) 列表，没有子品类时 sub_category 为 None
+        """
+        tasks = []
         for gender in self.category_urls:
             for category in self.category_urls[gender]:
                 if isinstance(self.category_urls[gender][category], str):
-                    task = asyncio.create_task(self.category_spider(gender, category,
-                                                                    semaphore=semaphore, headless=headless))
-                    task_list.append(task)
+                    tasks.append((gender, category, None))
                 else:
                     for sub_category in self.category_urls[gender][category]:
-                        task = asyncio.create_task(self.category_spider(gender, category, sub_category,
-                                                                        semaphore=semaphore, headless=headless))
-                        task_list.append(task)
-
-        await asyncio.gather(*task_list)
+                        tasks.append((gender, category, sub_category))
+        return tasks
+
+    async def async_run(self, root: str, category_json: str, concurrency: int = 2, headless=False,
+                        num_browsers: int = 1, max_navigations: int = 1000, item_workers: int = None,
+                        ordered_output: bool = None, durability: str = 'flush', detail_workers: int = None,
+                        max_retry_wait: float = 600, force_rescan: bool = False, response_capture: bool = None,
+                        metrics_interval: float = 10.0, metrics_port: int = None, tasks: list = None,
+                        shard: int = None, work_queue=None, max_page_navigations: int = 100,
+                        max_context_navigations: int = 500, max_heap_mb: float = 512,
+                        release_quarantined: bool = False):
+        """
+        :param root: 爬取结果的根目录
+        :param category_json: 品类 url 的 json 文件
+        :param concurrency: 同时爬取的品类数量
+        :param headless: 是否启用无头浏览器
+        :param num_browsers: 浏览器池中常驻的浏览器数量
+        :param max_navigations: 单个浏览器导航次数达到该值后回收重启
+        :param item_workers: 每个品类同时打开的商品详情页数量，None 时使用 self.item_workers
+        :param ordered_output: 是否按列表页顺序写入商品，None 时使用 self.ordered_output
+        :param durability: items.jsonl 每批写入后的持久化策略：none / flush / fsync
+        :param detail_workers: 站点共享的详情页 worker 数量，所有品类的列表页共用一个有界队列；
+            None 时为 concurrency * item_workers，0 时每个品类使用自己的 item_workers 个 worker
+        :param max_retry_wait: 主流程结束后，最多等待多久（秒）进行下一次重试，更晚的重试留给下次运行
+        :param force_rescan: 忽略品类断点（包括已完成的品类），从第一页重新遍历所有品类
+        :param response_capture: 是否截获网站的 JSON 接口，None 时使用 self.response_capture
+        :param metrics_interval: 每隔多少秒将耗时统计导出到 root 下的 metrics.prom 和 metrics.json
+        :param metrics_port: 提供 /metrics 和 /metrics.json 的 HTTP 端口，None 时不启动
+        :param tasks: 只爬取这些 (gender, category, sub_category)，None 时爬取 category_json 中的所有品类
+        :param shard: 分片编号，多进程运行时各分片的重试队列和耗时统计保存在 root/shards/<shard> 下
+        :param work_queue: 多机协作的工作队列（WorkQueue 或 url，如 sqlite:///queue.db）：
+            category_json 中的品类放入队列后，各节点从队列领取品类和商品任务，不会重复；
+            category_json 可以为 None，只处理队列中已有的任务
+        :param max_page_navigations: 详情页 / 列表页的 page 导航次数达到该值后换新 page
+        :param max_context_navigations: context 导航次数达到该值后换新 context，沿用 cookie 和 localStorage
+        :param max_heap_mb: page 的 JS 堆内存超过该值（MB）时换新 context，0 时不检查
+        :param release_quarantined: 将之前多次失败而隔离的品类和商品放回重试队列（如网站故障恢复后）
+        """
+        self.root = root
+        self.shard = shard
+        state_dir = root if shard is None else os.path.join(root, "shards", str(shard))
+        self.force_rescan = force_rescan
+        self.retry_queue = RetryQueue(os.path.join(state_dir, "retry_queue.json"))
+        if release_quarantined and (released := self.retry_queue.release_quarantined()):
+            print(f"{released} 个隔离的任务已放回重试队列")
+        if item_workers is not None:
+            self.item_workers = item_workers
+        if ordered_output is not None:
+            self.ordered_output = ordered_output
+        if response_capture is not None:
+            self.response_capture = response_capture
+        self.category_urls = dict()
+        if category_json:
+            with open(category_json, 'r') as f:
+                self.category_urls = json.load(f)
+        if work_queue is not None:
+            self.work_queue = open_work_queue(work_queue) if isinstance(work_queue, str) else work_queue
+            await self.seed_work_queue(tasks if tasks is not None else self.category_tasks())
+        semaphore = asyncio.Semaphore(concurrency)
+        if detail_workers is None:
+            detail_workers = concurrency * self.item_workers
+        num_leases = concurrency + detail_workers  # 列表页每个品类一个 context，共享 worker 每个一个 context
+
+        async with async_playwright() as playwright:
+            self.browser_pool = BrowserPool(playwright, size=num_browsers,
+                                            contexts_per_browser=max(1, -(-num_leases // num_browsers)),
+                                            max_navigations=max_navigations, headless=headless,
+                                            max_page_navigations=max_page_navigations,
+                                            max_context_navigations=max_context_navigations,
+                                            max_heap_mb=max_heap_mb,
+                                            launch_args=['--start-maximized'],
+                                            context_kwargs=dict(
+                                                extra_http_headers=HEADER,
+                                                user_agent=USER_AGENT,
+                                                locale="en-GB",  # zh-CN、en-GB
+                                                no_viewport=True,
+                                            ),
+                                            block_policy=self.block_policy)
+            await self.browser_pool.start()
+            self.writer = JsonlWriter(durability=durability, metrics=self.metrics)
+            await self.writer.start()
+            if self.http_listing or self.http_detail:
+                # Accept-Encoding 交给 httpx 按已安装的解码器设置
+                self.fetcher = HttpFetcher(headers={**{k: v for k, v in HEADER.items() if k != 'Accept-Encoding'},
+                                                    'User-Agent': USER_AGENT})
+                await self.fetcher.start()
+            if self.seen is not None:
+                # 多进程运行时只登记本分片的品类，其他分片的索引由各自的进程读取和重建
+                folders = None if shard is None else [
+                    os.path.join(self.root, *[part for part in task if part]) for task in (tasks or [])]
+                await asyncio.to_thread(self.seen.load, self.root, folders)
+            log_task = asyncio.create_task(self.log())
+            metrics_task = asyncio.create_task(self.metrics.report(state_dir, metrics_interval))
+            metrics_server = await self.metrics.serve(metrics_port) if metrics_port else None
+            detail_tasks = []
+            if detail_workers > 0:
+                self.item_queue = asyncio.Queue(maxsize=self.queue_size)
+                detail_tasks = [asyncio.create_task(self.shared_detail_worker()) for _ in range(detail_workers)]
+
+            async def crawl():
+                task_list, category_tasks = [], tasks if tasks is not None else self.category_tasks()
+                if self.work_queue is not None:
+                    task_list = [asyncio.create_task(self.work_queue_worker(semaphore)) for _ in range(concurrency)]
+                    category_tasks = []  # 品类由工作队列分配
+                for gender, category, sub_category in category_tasks:
+                    if self.retry_queue.is_quarantined('category', {'gender': gender, 'category': category,
+                                                                    'sub_category': sub_category}):
+                        continue  # 多次失败的品类不再尝试
+                    task = asyncio.create_task(self.category_spider(gender, category, sub_category,
+                                                                    semaphore=semaphore))
+                    task_list.append(task)
+                await asyncio.gather(*task_list)
+                # 重试本次及之前运行中失败的品类和商品
+                await self.run_retries(semaphore, max_retry_wait)
 
-        task_list = [asyncio.create_task(self.log())]
-        for gender, category, sub_category in self.failed_tasks:
-            task = asyncio.create_task(self.category_spider(gender, category,
-                                                            semaphore=semaphore, headless=headless))
-            task_list.append(task)
-        await asyncio.gather(*task_list)
+            try:
+                try:
+                    await self.supervise(crawl(), detail_tasks)
+                except BaseException:
+                    await self.stop_workers(self.item_queue, detail_tasks, cancel=True)
+                    raise
+                # 所有品类完成后通知共享 worker 退出
+                await self.stop_workers(self.item_queue, detail_tasks)
+            finally:
+                self.item_queue = None
+                # 日志和指标导出协程不会自行结束，爬取完成后取消；指标导出在取消时写入最终结果
+                log_task.cancel()
+                metrics_task.cancel()
+                await asyncio.gather(log_task, metrics_task, return_exceptions=True)
+                self.retry_queue.flush()  # 写入 save_interval 内尚未保存的修改
+                if metrics_server:
+                    metrics_server.close()
+                    await metrics_server.wait_closed()
+                try:
+                    await self.writer.close()  # 写完队列中剩余的商品，重试后仍写入失败时抛出
+                finally:
+                    if self.fetcher:
+                        await self.fetcher.close()
+                    await self.browser_pool.close()
 
 
 class ItalistSpider(Spider):
     def __init__(self, test_mode=False):
         super().__init__(test_mode=test_mode)
+        self.item_selector = "div[id='product-page-container'] a"
+        # 列表页和详情页均为服务端渲染，先用 HTTP 抓取，解析不到时回退到浏览器
+        self.http_listing = True
+        self.http_detail = True
+
+    @staticmethod
+    def next_listing_url(url):
+        # https://www.italist.com/cn/women/clothing/coats-jackets/blazers/29/?skip=180
+        # 如果有 skip= 则把 skip= 后面的数字加 60
+        if url.find('skip=') != -1:
+            return url[:url.find('skip=') + 5] + str(int(url[url.find('skip=') + 5:]) + 60)
+        return url + '?skip=60'
 
     # TODO: 以下仅适用于 Italist
     async def next_page_btn(self, page):
         """
         获取下一页按钮
         """
-        old_url = page.url
-        # https://www.italist.com/cn/women/clothing/coats-jackets/blazers/29/?skip=180
-        # 如果有 skip= 则把 skip= 后面的数字加 60
-        if old_url.find('skip=') != -1:
-            new_url = old_url[:old_url.find('skip=') + 5] + str(int(old_url[old_url.find('skip=') + 5:]) + 60)
-        else:
-            new_url = old_url + '?skip=60'
-
-
-        return new_url
+        return self.next_listing_url(page.url)
 
     # TODO: 以下仅适用于 Italist
     async def id_from_url(self, url):
@@ -363,6 +1347,24 @@ class ItalistSpider(Spider):
         items = [item for item, id_ in zip(items, ids) if len(id_) == 17 and id_.find('/') == 8]
         return items
 
+    # TODO: 以下仅适用于 Italist
+    async def items_in_html(self, tree, url):
+        """
+        从列表页 HTML 中获取所有商品的 url 和下一页 url
+        """
+        items = tree.xpath("//div[@id='product-page-container']//a/@href")
+        items = ["https://www.italist.com" + item if not item.startswith('http') else item for item in items]
+        ids = await asyncio.gather(*[self.id_from_url(item) for item in items])
+        items = [item for item, id_ in zip(items, ids) if len(id_) == 17 and id_.find('/') == 8]
+        # 有下一页链接时使用该链接；没有时只有满页（每页 60 个商品）才可能有下一页
+        if next_href := tree.xpath("//link[@rel='next']/@href | //a[@rel='next']/@href"):
+            next_url = urljoin(url, next_href[0])
+        elif len(set(items)) >= 60:
+            next_url = self.next_listing_url(url)
+        else:
+            next_url = None
+        return items, next_url
+
     # TODO: 以下仅适用于 Italist
     async def info_of_item(self, page):
         """
@@ -407,10 +1409,54 @@ class ItalistSpider(Spider):
 
         return item_info
 
+    # TODO: 以下仅适用于 Italist
+    async def info_of_html(self, tree, url):
+        """
+        从商品详情页 HTML 中获取商品信息，与 info_of_item 的结果一致
+        """
+        item_info = dict()
+        basic_info = tree.xpath("//div[contains(@class, 'product-actions-sticky')]")
+        assert basic_info, "未找到商品详情页的div class product-actions-sticky, 也许页面结构已经改变！"
+        basic_info = basic_info[0]
+        if brand := basic_info.xpath(".//h2[contains(@class, 'brand')]"):
+            item_info["brand"] = inner_text(brand[0])
+        if item_category := basic_info.xpath(".//h1[contains(@class, 'model')]"):
+            item_info["item"] = inner_text(item_category[0])
+        information, key_ = {}, None
+        for accordion_div in basic_info.xpath(".//div[contains(@class, 'accordion-heading') "
+                                              "or contains(@class, 'accordion-content')]"):
+            if "accordion-heading" in accordion_div.get("class"):
+                key_ = inner_text(accordion_div)
+                information[key_] = []
+            elif key_:
+                text = inner_text(accordion_div)
+                if text not in information[key_]:
+                    information[key_].append(text)
+        item_info['information'] = information
+        urls = tree.xpath("//div[contains(@class, 'image-product-info-container')]//img/@src")
+        item_info["image_urls"] = [url for url in urls if url and url.endswith('.jpg')]
+        return item_info
+
 
 class FARFETCHSpider(Spider):
     def __init__(self):
         super().__init__()
+        self.item_selector = "li[data-testid='productCard']"
+        # 详情页提取规则，见 extract_spec，所有元素在一次 evaluate 中读取
+        details = "div[id='tabpanel-0'], div[data-component='AccordionPanel']"
+        self.item_spec = {
+            # 系列 <p class="ltr-xkwp1l-Body e1m5ny110">
+            'series': {'type': 'first', 'within': details, 'selector': "p[class*='ltr-'][class*='-Body']",
+                       'within_required': "未找到商品详情页的 TabPanels, 也许页面结构已经改变！"},
+            # 品牌、品类、描述与 Key (h4 class="ltr-2pfgen-Body-BodyBold") / Values (p class="ltr-4y8w0i-Body")
+            'head_texts': {'type': 'all', 'within': details, 'props': ['text', 'class', 'data-component'],
+                           'selector': "a[class*='ltr-'][class*='-Heading-HeadingBold'], p[data-component*='Body'], "
+                                       "li[data-component*='Body'], h4[data-component*='BodyBold']"},
+            # 页面中所有 class="ltr-1w2up3s" 的 img, src 属性即为图片的 url, 但是有重复的
+            'image_urls': {'type': 'all', 'selector': "img[class*='ltr-']", 'prop': 'src',
+                           'required': "未找到商品详情页的 img[class*='ltr-'], 也许页面结构已经改变！"},
+        }
+        self.capture_listing = ("*/plpslice/listing-api/*",)  # 列表页商品接口
 
     @staticmethod
     async def convert_farfetch_json(json_file):
@@ -479,6 +1525,18 @@ class FARFETCHSpider(Spider):
         # print(items)
         return items
 
+    # TODO: 以下仅适用于 FARFETCH
+    async def items_in_json(self, payloads, url):
+        """
+        从列表页接口中获取所有商品的 url：接口中形如 /shopping/...-item-12345678.aspx 的字符串
+        """
+        items = []
+        for _, payload in payloads:
+            items += find_strings(payload, lambda value: '-item-' in value and value.endswith('.aspx'))
+        items = ["https://www.farfetch.cn" + item if not item.startswith('http') else item for item in
+                 dict.fromkeys(items)]
+        return items
+
     # TODO: 以下仅适用于 FARFETCH
     async def info_of_item(self, page):
         """
@@ -488,50 +1546,40 @@ class FARFETCHSpider(Spider):
 
         # 等到页面中 div data-component="TabPanels"加载完成
         await page.wait_for_selector("div[id='tabpanel-0'], div[data-component='AccordionPanel']")
-        # 商品细节 div class="ltr-9vdnw4"
-        item_details = await page.query_selector("div[id='tabpanel-0'], div[data-component='AccordionPanel']")
-        assert item_details, "未找到商品详情页的 TabPanels, 也许页面结构已经改变！"
-        # 系列 <p class="ltr-xkwp1l-Body e1m5ny110">
-        series = await item_details.query_selector("p[class*='ltr-'][class*='-Body']")
-        if series:
-            item_info["series"] = await series.inner_text()
-        # Key   h4 class="ltr-2pfgen-Body-BodyBold"  Values  p class="ltr-4y8w0i-Body"
-        head_texts = await item_details.query_selector_all(
-            "a[class*='ltr-'][class*='-Heading-HeadingBold'], p[data-component*='Body'], li[data-component*='Body'], h4[data-component*='BodyBold']")
+        data = await extract(page, self.item_spec)
+        if data["series"] is not None:
+            item_info["series"] = data["series"]
+        head_texts = data["head_texts"]
         start_index = 0
-        # 找到第一个 a[class*='ltr-8gbn9h-Heading-HeadingBold'] 的 inner_text 作为 品牌
+        # 找到第一个 a[class*='ltr-8gbn9h-Heading-HeadingBold'] 的 text 作为 品牌
         for i in range(len(head_texts)):
-            if "-Heading-HeadingBold" in await head_texts[i].get_attribute("class") and "ltr-" in await head_texts[i].get_attribute("class"):
-                item_info["brand"] = await head_texts[i].inner_text()
+            class_ = head_texts[i]["class"] or ""
+            if "-Heading-HeadingBold" in class_ and "ltr-" in class_:
+                item_info["brand"] = head_texts[i]["text"]
                 start_index = i + 1
                 break
         # 下一个是品类
-        item_info["item"] = await head_texts[start_index].inner_text()
+        item_info["item"] = head_texts[start_index]["text"]
         # 如果第二个是p data-component="Body" 则是描述
-        if await head_texts[1].get_attribute("data-component") == "Body":
-            item_info["description"] = await head_texts[start_index + 1].inner_text()
+        if head_texts[1]["data-component"] == "Body":
+            item_info["description"] = head_texts[start_index + 1]["text"]
             start_index += 2
         else:
             start_index += 1
         # 其余的如果是 h4 则作为 key, 如果是 p 则作为 value
         key_ = None
         information = dict()
-        for i in range(start_index, len(head_texts)):
-            if "ltr-" in await head_texts[i].get_attribute("class") and '-Body-BodyBold' in await head_texts[i].get_attribute("class"):
-                key_ = await head_texts[i].inner_text()
+        for head_text in head_texts[start_index:]:
+            class_ = head_text["class"] or ""
+            if "ltr-" in class_ and '-Body-BodyBold' in class_:
+                key_ = head_text["text"]
                 information[key_] = []
             elif key_:
-                text = await head_texts[i].inner_text()
-                if text not in information[key_]:
-                    information[key_].append(text)
+                if head_text["text"] not in information[key_]:
+                    information[key_].append(head_text["text"])
         item_info["information"] = information
 
-        # 查找页面中所有图片，class="ltr-1w2up3s" 的 img, 该 img 的 src 属性即为图片的 url, 但是有重复的
-        imgs = await page.query_selector_all("img[class*='ltr-']")
-        assert imgs, "未找到商品详情页的 img[class*='ltr-'], 也许页面结构已经改变！"
-        urls = await asyncio.gather(*[img.get_attribute("src") for img in imgs])
-        urls = list(dict.fromkeys(urls))  # 去重，但不改变顺序
-        item_info["image_urls"] = [url for url in urls if 'cdn-static'not in url]#去除小图标
+        item_info["image_urls"] = data["image_urls"]  # 去重、去除小图标由 image_url_normalizer 完成
         # print(item_info)
         return item_info
 
@@ -539,6 +1587,27 @@ class FARFETCHSpider(Spider):
 class YOOXSpider(Spider):
     def __init__(self):
         super().__init__()
+        self.item_selector = "li[class='item']"
+        # 详情页提取规则，见 extract_spec
+        basic_info = "div[class*='ItemInfo_item-info']"  # 基础信息 class="ItemInfo_item-info__KcZIo" 的 div
+        self.item_spec = {
+            # 颜色 div class="MuiBody2-body2 ColorPicker_color-selected-title__oB1iK"
+            'color': {'type': 'first', 'selector': "div[class*='ColorPicker_color-selected-title']"},
+            # 品牌名，class 为 MuiTitle3-title3的 h1
+            'brand': {'type': 'first', 'within': basic_info, 'selector': "h1[class*='ItemInfo_designer']",
+                      'within_required': "未找到商品详情页的 ItemInfo_item-info__KcZIo, 也许页面结构已经改变！"},
+            'series': {'type': 'first', 'within': basic_info, 'selector': "b"},  # 系列
+            # 品类 class="MuiBody1-body1 ItemInfo_microcat__ffpIA"
+            'item': {'type': 'first', 'within': basic_info, 'selector': "h2[class*='ItemInfo_microcat']"},
+            # class="item_details-container__u52Wd" 的第一个 div 中 class 为 MuiTitle4-title4 的 span 作为 key，
+            # MuiBody1-body1 的 span 作为 value
+            'information': {'type': 'groups', 'within': "div[class*='item_details-container']",
+                            'selector': "span[class*='Muititle4-title4'], span[class*='MuiBody1-body1']",
+                            'within_required': "未找到商品详情页的 item_details-container__u52Wd, 也许页面结构已经改变！",
+                            'rules': [{'match': {'class': ['Muititle4-title4']}, 'as': 'key'}], 'unique': True},
+            # style 中包含 zoom-in 的 span 中的 img 标签的 src 属性即为图片的 url
+            'image_urls': {'type': 'all', 'selector': "span[style*='zoom-in']", 'child': "img", 'prop': 'src'},
+        }
 
     # TODO: 以下仅适用于 YOOX
     async def next_page_btn(self, page):
@@ -576,52 +1645,11 @@ class YOOXSpider(Spider):
         """
         获取当前商品详情页面的商品信息，包括图像 urls、文本描述
         """
-        # TODO: 以下仅适用于 YOOX
-        item_info = dict()
-        # 基础信息 class="ItemInfo_item-info__KcZIo" 的 div
-        basic_info = await page.query_selector("div[class*='ItemInfo_item-info']")
-        assert basic_info, "未找到商品详情页的 ItemInfo_item-info__KcZIo, 也许页面结构已经改变！"
-        # 颜色 div class="MuiBody2-body2 ColorPicker_color-selected-title__oB1iK"
-        color = await page.query_selector("div[class*='ColorPicker_color-selected-title']")
-        brand = await basic_info.query_selector("h1[class*='ItemInfo_designer']")  # 品牌名，class 为 MuiTitle3-title3的 h1
-        series = await basic_info.query_selector("b")  # 系列，品牌同级的下一个h2 class="MuiBody1-body1"
-        item_category = await basic_info.query_selector(
-            "h2[class*='ItemInfo_microcat']")  # 品类 class="MuiBody1-body1 ItemInfo_microcat__ffpIA"
+        data = await extract(page, self.item_spec)
         # 如果存在则添加到 item_info 中
-        if color:
-            item_info["color"] = await color.inner_text()
-        if brand:
-            item_info["brand"] = await brand.inner_text()
-        if series:
-            item_info["series"] = await series.inner_text()
-        if item_category:
-            item_info["item"] = await item_category.inner_text()
-
-        # 获取页面中 class="item_details-container__u52Wd" 的第一个 div
-        item_details = await page.query_selector("div[class*='item_details-container']")
-        assert item_details, "未找到商品详情页的 item_details-container__u52Wd, 也许页面结构已经改变！"
-
-        # 获取item_details中所有 class 为 MuiTitle4-title4 或 MuiBody1-body1 的 span
-        information = dict()
-        spans = await item_details.query_selector_all("span[class*='Muititle4-title4'], span[class*='MuiBody1-body1']")
-        key_ = None
-        for span in spans:
-            # 如果 span 的 class 是 MuiTitle4-title4 则作为 key
-            if "Muititle4-title4" in await span.get_attribute("class"):
-                key_ = await span.inner_text()
-                information[key_] = []
-            elif key_:
-                text = await span.inner_text()
-                if text not in information[key_]:
-                    information[key_].append(text)
-        item_info["information"] = information
-
-        # 查找页面中所有 style 中包含 zoom-in 的 span, 该 span 中的 img 标签的 src 属性即为图片的 url
-        spans = await page.query_selector_all("span[style*='zoom-in']")
-        urls = await asyncio.gather(*[span.query_selector("img") for span in spans])
-        urls = await asyncio.gather(*[url.get_attribute("src") for url in urls])
-        urls = [url[:url.find(".jpg") + 4] for url in urls]  # 截取到.jpg
-        item_info["image_urls"] = urls
+        item_info = {key: data[key] for key in ("color", "brand", "series", "item") if data[key] is not None}
+        item_info["information"] = data["information"]
+        item_info["image_urls"] = data["image_urls"]  # 由 image_url_normalizer 改写为规范 url
 
         return item_info
 
@@ -630,6 +1658,8 @@ class ADIDASSpider(Spider):
     def __init__(self):
         super().__init__()
         self.next_page_click =True
+        self.item_selector = "a[class*='card-swiper']"
+        self.scroll_by_wheel = True  # 列表页只响应鼠标滚轮加载
     # 以下仅适用于 ADIDAS
     async def next_page_btn(self, page):
         """
@@ -660,10 +1690,7 @@ class ADIDASSpider(Spider):
         """
         获取当前页面的所有商品的 url
         """
-        # page 滚动到底部，间隔 1s
-        for _ in range(15):
-            await page.mouse.wheel(0, 2000)  # 连续向下滚动，每次100像素
-            await asyncio.sleep(1)
+        # 滚动加载由 category_spider 中的 scroll_and_settle 完成（scroll_by_wheel）
         # 获取所有 a class="card-swiper"
         items = await page.query_selector_all("a[class*='card-swiper']")
         # 获取 所有 item 第一个 a 标签的 href 属性
@@ -716,11 +1743,7 @@ class ADIDASSpider(Spider):
         pagination_div = await page.query_selector("div[slot='pagination']")
         images = await pagination_div.query_selector_all("img")
         image_links = await asyncio.gather(*[url.get_attribute("src") for url in images])
-        image_links = ["https:"+_[:_.rfind("?")] for _ in image_links]
-        item_info["image_urls"] = image_links
-
-        # wait for 1s
-        await asyncio.sleep(1)
+        item_info["image_urls"] = image_links  # 由 image_url_normalizer 补全协议、设置宽度
 
         return item_info
 
@@ -728,6 +1751,36 @@ class ADIDASSpider(Spider):
 class ZalandoSpider(Spider):
     def __init__(self):
         super().__init__()
+        self.item_selector = "a[class*='_LM JT3_zV CKDt_l CKDt_l LyRfpJ']"
+        # 详情页提取规则，见 extract_spec
+        basic_info = "x-wrapper-re-1-4"  # 基础信息 <x-wrapper-re-1-4 re-hydration-id="re-1-4" style="display:block">
+        self.item_spec = {
+            # 展开所有折叠的商品细节
+            'expand': {'type': 'click', 'selector': (
+                "button[class*='_ZDS_REF_SCOPE_ SX0LGY DJxzzA u9KIT8 uEg2FS U_OhzR ZkIJC- Vn-7c- FCIprz heWLCX "
+                "Wu1CzW Md_Vex NN8L-8 _d3F40 P3OKTW mo6ZnF K82if3 VWL_Ot HlZ_Tf _13ipK_ LyRfpJ Z1Xqqm _8xiD-i "
+                "sKmkSN pMa0tB']")},
+            # 颜色 span class="sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA"
+            'color': {'type': 'first', 'selector': "span[class*='sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA']"},
+            # 品牌名 h3 class="FtrEr_ QdlUSH FxZV-M HlZ_Tf _5Yd-hZ"
+            'brand': {'type': 'first', 'within': basic_info, 'selector': "h3[class*='FtrEr_ QdlUSH FxZV-M HlZ_Tf _5Yd-hZ']",
+                      'within_required': "未找到商品详情页的 x-wrapper-re-1-4, 也许页面结构已经改变！"},
+            # 品类 sapn class="EKabf7 R_QwOV"
+            'item': {'type': 'first', 'within': basic_info, 'selector': "span[class*='EKabf7 R_QwOV']"},
+            # 1\ <h5 class="sDq_FX EKH5rj FxZV-M HlZ_Tf">  一级标题
+            # 2\ <dt class="sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA" role="term">Outer fabric material:</dt>  键
+            # 3\ <dd class="sDq_FX lystZ1 FxZV-M HlZ_Tf zN9KaA" role="definition">100% polyester</dd> 值
+            'information': {'type': 'groups',
+                            'selector': "h5[class*='sDq_FX EKH5rj FxZV-M HlZ_Tf'], dt[role='term'], dd[role='definition']",
+                            'rules': [{'match': {'attr': {'role': 'term'}}, 'as': 'subkey'},
+                                      {'match': {'attr': {'role': 'definition'}}, 'as': 'value'},
+                                      {'match': {}, 'as': 'key'}]},
+            # ul aria-label="Product media gallery" 中每个 li 的 img
+            'image_urls': {'type': 'all', 'within': "ul[aria-label='Product media gallery']", 'selector': "li",
+                           'child': "img", 'prop': 'src',
+                           'within_required': "未找到商品详情页的 Product media gallery, 也许页面结构已经改变！"},
+        }
+        self.capture_listing = ("*/api/graphql*",)  # 列表页由 GraphQL 接口加载
 
     # TODO: 以下仅适用于 Zalando
     async def next_page_btn(self, page):
@@ -763,67 +1816,31 @@ class ZalandoSpider(Spider):
         items = [item for item, id_ in zip(items, ids) if len(id_) == 13 and id_[-4] == '-']
         return items
 
+    # TODO: 以下仅适用于 Zalando
+    async def items_in_json(self, payloads, url):
+        """
+        从 GraphQL 接口中获取所有商品的 url，与 items_in_page 使用相同的 id 校验
+        """
+        # 只接受与列表页同一域名下的商品 url，排除接口中的广告、品牌页等其他链接
+        prefix = f"https://{urlparse(url).hostname}/"
+        items = []
+        for _, payload in payloads:
+            items += find_strings(payload, lambda value: value.startswith(prefix) and value.endswith('.html')
+                                  and '/' not in value[len(prefix):])
+        items = list(dict.fromkeys(items))
+        ids = await asyncio.gather(*[self.id_from_url(item) for item in items])
+        return [item for item, id_ in zip(items, ids) if len(id_) == 13 and id_[-4] == '-']
+
     # TODO: 以下仅适用于 Zalando
     async def info_of_item(self, page):
         """
         获取当前商品详情页面的商品信息，包括图像 urls、文本描述
         """
-        item_info = dict()
-        # 基础信息 <x-wrapper-re-1-4 re-hydration-id="re-1-4" style="display:block">
-        basic_info = await page.query_selector("x-wrapper-re-1-4")
-        assert basic_info, "未找到商品详情页的 x-wrapper-re-1-4, 也许页面结构已经改变！"
-        # 颜色 span class="sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA"
-        color = await page.query_selector("span[class*='sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA']")
-        # 品牌名 h3 class="FtrEr_ QdlUSH FxZV-M HlZ_Tf _5Yd-hZ"
-        brand = await basic_info.query_selector("h3[class*='FtrEr_ QdlUSH FxZV-M HlZ_Tf _5Yd-hZ']")
-        # 品类 sapn class="EKabf7 R_QwOV"
-        item_category = await basic_info.query_selector("span[class*='EKabf7 R_QwOV']")
-
+        data = await extract(page, self.item_spec)
         # 如果存在则添加到 item_info 中
-        if color:
-            item_info["color"] = await color.inner_text()
-        if brand:
-            item_info["brand"] = await brand.inner_text()
-        if item_category:
-            item_info["item"] = await item_category.inner_text()
-
-        # 获取item_details中所有
-        # 1\ <h5 class="sDq_FX EKH5rj FxZV-M HlZ_Tf">  一级标题
-        # 2\ <dt class="sDq_FX lystZ1 dgII7d HlZ_Tf zN9KaA" role="term">Outer fabric material:</dt>  键
-        # 3\ <dd class="sDq_FX lystZ1 FxZV-M HlZ_Tf zN9KaA" role="definition">100% polyester</dd> 值
-        information = dict()
-        btns = await page.query_selector_all(
-            "button[class*='_ZDS_REF_SCOPE_ SX0LGY DJxzzA u9KIT8 uEg2FS U_OhzR ZkIJC- Vn-7c- FCIprz heWLCX Wu1CzW "
-            "Md_Vex NN8L-8 _d3F40 P3OKTW mo6ZnF K82if3 VWL_Ot HlZ_Tf _13ipK_ LyRfpJ Z1Xqqm _8xiD-i sKmkSN pMa0tB']")
-        for btn in btns:
-            try:
-                await btn.click()
-            except Exception as e:
-                print(e)
-        texts = await page.query_selector_all(
-            "h5[class*='sDq_FX EKH5rj FxZV-M HlZ_Tf'], dt[role='term'], dd[role='definition']")
-        # 如果是 h5 则作为一级 key，如果是 dt 则作为 key, 如果是 dd 则作为 value
-        key_ = None
-        key__ = None
-        for text in texts:
-            if "term" == await text.get_attribute("role"):
-                key__ = await text.inner_text()
-                information[key_][key__] = []
-            elif "definition" == await text.get_attribute("role"):
-                value = await text.inner_text()
-                information[key_][key__].append(value)
-            else:
-                key_ = await text.inner_text()
-                information[key_] = dict()
-        item_info["information"] = information
-
-        # ul aria-label="Product media gallery"
-        gallery = await page.query_selector("ul[aria-label='Product media gallery']")
-        lis = await gallery.query_selector_all("li")
-        urls = await asyncio.gather(*[li.query_selector("img") for li in lis])
-        urls = await asyncio.gather(*[url.get_attribute("src") for url in urls])
-        urls = [url[:url.find(".jpg") + 4] for url in urls]  # 截取到.jpg
-        item_info["image_urls"] = urls
+        item_info = {key: data[key] for key in ("color", "brand", "item") if data[key] is not None}
+        item_info["information"] = data["information"]
+        item_info["image_urls"] = data["image_urls"]  # 由 image_url_normalizer 改写为规范 url
 
         return item_info
 
@@ -831,6 +1848,7 @@ class ZalandoSpider(Spider):
 class I24SSpider(Spider):
     def __init__(self, test_mode=False):
         super().__init__(test_mode=test_mode)
+        self.item_selector = "a[class*='product_btn__QSoXG']"
 
     # TODO: 以下仅适用于 XX
     async def next_page_btn(self, page):
@@ -924,6 +1942,7 @@ class I24SSpider(Spider):
 class LUISAVIAROMASpider(Spider):
     def __init__(self):
         super().__init__()
+        self.item_selector = "article[data-id='item']"
 
     # TODO: 以下仅适用于 Luisa Via Roma
     async def next_page_btn(self, page):
@@ -971,11 +1990,7 @@ class LUISAVIAROMASpider(Spider):
         image_div = await page.query_selector("div[data-id='Images']")
         images = await image_div.query_selector_all("img")
         image_links = await asyncio.gather(*[url.get_attribute("src") for url in images])
-        precessed_links = []
-        for i, link in enumerate(image_links):
-            link = link.split("images.luisaviaroma.cn/")[1]
-            link = link[link.find('/')+1:]
-            precessed_links.append("https://images.luisaviaroma.cn/Zoom/" + link)
+        # 由 image_url_normalizer 改写为 Zoom 尺寸
 
         # 1.基础信息 div id="item-info" 的
         basic_info_div = await page.query_selector("div[id='item-info']")
@@ -1001,13 +2016,16 @@ class LUISAVIAROMASpider(Spider):
         item_info["brand"] = brand
         item_info["item"] = item
         item_info["information"] = detail_info_list
-        item_info["image_urls"] = precessed_links
+        item_info["image_urls"] = image_links
         return item_info
 
 
 class NetAPorterSpider(Spider):
     def __init__(self):
         super().__init__()
+        self.item_selector = "div[class*='ProductList0__productItemContainer']"
+        self.capture_listing = ("*/api/*/search/*",)  # 列表页商品搜索接口
+        self.capture_detail = ("*/api/*/productview/*",)  # 详情页商品接口
 
     # 以下仅适用于 Net-A-Porter
     async def next_page_btn(self, page):
@@ -1045,6 +2063,43 @@ class NetAPorterSpider(Spider):
                  items]
         return items
 
+    # 以下仅适用于 Net-A-Porter
+    async def items_in_json(self, payloads, url):
+        """
+        从商品搜索接口中获取所有商品的 url：接口中形如 /shop/product/.../1647597310972290 的字符串
+        """
+        items = []
+        for _, payload in payloads:
+            items += find_strings(payload, lambda value: '/shop/product/' in value)
+        items = ["https://www.net-a-porter.com" + item if not item.startswith('http') else item for item in
+                 dict.fromkeys(items)]
+        return items
+
+    # 以下仅适用于 Net-A-Porter
+    async def info_of_json(self, payloads, url):
+        """
+        从商品接口中获取商品信息：products 中 partNumber 与 url 中 id 相同的商品，
+        字段与 info_of_item 一致，图片为其中 /variants/images/ 下的 url（跳过 {width} 等模板）
+        """
+        item_id = await self.id_from_url(url)
+        for _, payload in payloads:
+            for product in walk_json(payload):
+                if not (isinstance(product, dict) and str(product.get('partNumber')) == item_id):
+                    continue
+                colours = product.get('productColours') or [{}]
+                item_info = {"brand": product.get('designerName'), "item": product.get('name'),
+                             "color": colours[0].get('label')}
+                information = {}
+                for key, field in (('editors_notes', 'editorialDescription'), ('size_fit', 'sizeAndFit'),
+                                   ('details', 'technicalDescription')):
+                    if product.get(field):
+                        information[key] = product[field]
+                item_info['information'] = information
+                item_info["image_urls"] = find_strings(
+                    colours[0] or product, lambda value: '/variants/images/' in value and '{' not in value)
+                return item_info
+        return None
+
     # 以下仅适用于 Net-A-Porter
     async def info_of_item(self, page):
         """
@@ -1104,8 +2159,7 @@ class NetAPorterSpider(Spider):
         pagination_div = await page.query_selector("div[class*='imageCarouselThumbnails']")
         images = await pagination_div.query_selector_all("img")
         image_links = await asyncio.gather(*[url.get_attribute("src") for url in images])
-        image_links = ["https:"+_ for _ in image_links]
-        item_info["image_urls"] = image_links
+        item_info["image_urls"] = image_links  # 由 image_url_normalizer 补全协议
 
         # wait for 1s
         # await asyncio.sleep(1)
@@ -1124,10 +2178,8 @@ async def test_function(url):
             locale="en-GB",  # zh-CN、en-GB
             no_viewport=True
         )
-        # 拦截 webp
-        abort_types = ['media', 'font', "image"] #'stylesheet']
-        await context.route("**/*", lambda
-            route: route.abort() if route.request.resource_type in abort_types else route.continue_())
+        # 拦截图片、字体、媒体和追踪请求
+        await BlockPolicy().apply(context)
         page = await context.new_page()
         # await page.route("**/*.{png,jpg,jpeg}", lambda route: route.abort())  # 禁止加载图片
         await page.goto(url, wait_until='domcontentloaded')
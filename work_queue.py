@@ -0,0 +1,186 @@
+"""
+多机协作的工作队列：品类任务和商品 url 放入共享队列，各节点的 Spider 以租约方式领取，
+持有期间定期续约（心跳），节点宕机后租约过期，任务重新分配给其他节点；
+后端可替换，SqliteWorkQueue 基于 SQLite 的文件锁，适用于单机多进程、共享文件系统和测试
+"""
+import json
+import os
+import sqlite3
+import time
+from abc import abstractmethod
+from contextlib import closing
+
+from retry_queue import RetryQueue
+
+
+class WorkQueue:
+    """
+    工作队列接口，任务为 {'key', 'kind', 'payload', 'attempts'}，kind 为 category 或 item，
+    key 与 RetryQueue.key 相同，重复放入的任务被忽略
+    """
+
+    def put(self, kind, payload):
+        """
+        放入任务，已存在（包括已完成）的任务不重复放入
+        """
+        self.put_many(kind, [payload])
+
+    @abstractmethod
+    def put_many(self, kind, payloads):
+        """
+        批量放入任务
+        """
+        ...
+
+    @abstractmethod
+    def lease(self, worker: str, ttl: float, kinds=None):
+        """
+        领取一个待处理的任务（或租约已过期的任务），租约 ttl 秒后过期
+        :return: 任务，没有可领取的任务时返回 None
+        """
+        ...
+
+    @abstractmethod
+    def heartbeat(self, key, worker: str, ttl: float):
+        """
+        续约，租约已被其他节点接管时返回 False
+        """
+        ...
+
+    @abstractmethod
+    def complete(self, key, worker: str):
+        """
+        任务完成
+        """
+        ...
+
+    @abstractmethod
+    def fail(self, key, worker: str, error=None, delay: float = 0.0):
+        """
+        任务失败，delay 秒后可被重新领取；达到最大尝试次数时标记为 failed
+        """
+        ...
+
+    @abstractmethod
+    def counts(self):
+        """
+        :return: {状态: 任务数}
+        """
+        ...
+
+    def unfinished(self):
+        """
+        待处理和被领取中的任务数，为 0 时所有节点都可以退出
+        """
+        counts = self.counts()
+        return counts.get('pending', 0) + counts.get('leased', 0)
+
+
+class SqliteWorkQueue(WorkQueue):
+    def __init__(self, path, max_attempts: int = 5):
+        """
+        :param path: SQLite 数据库文件路径
+        :param max_attempts: 最大尝试次数（包括租约过期），达到后标记为 failed
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                not_before REAL NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, not_before)")
+
+    def connect(self):
+        """
+        每次操作打开新连接，可在任意线程和进程中使用；isolation_level=None 时手动控制事务，
+        sqlite3 连接的 with 语句不会关闭连接，用 closing 关闭
+        """
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def put_many(self, kind, payloads):
+        now = time.time()
+        rows = [(RetryQueue.key(kind, payload), kind, json.dumps(payload, ensure_ascii=False), now)
+                for payload in payloads]
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR IGNORE INTO tasks (key, kind, payload, updated) VALUES (?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+
+    def lease(self, worker: str, ttl: float, kinds=None):
+        now = time.time()
+        kinds = tuple(kinds or ('category', 'item'))
+        with self.connect() as conn:
+            # BEGIN IMMEDIATE 获取写锁，查询和更新之间其他节点不能领取同一任务
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("UPDATE tasks SET state = 'failed', worker = NULL, last_error = 'lease expired', "
+                             "updated = ? WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                             (now, now, self.max_attempts))
+                row = conn.execute(
+                    f"SELECT key, kind, payload, attempts FROM tasks WHERE kind IN ({','.join('?' * len(kinds))}) "
+                    "AND ((state = 'pending' AND not_before <= ?) OR (state = 'leased' AND lease_until < ?)) "
+                    "ORDER BY rowid LIMIT 1", (*kinds, now, now)).fetchone()
+                if row:
+                    conn.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_until = ?, "
+                                 "attempts = attempts + 1, updated = ? WHERE key = ?",
+                                 (worker, now + ttl, now, row[0]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {'key': row[0], 'kind': row[1], 'payload': json.loads(row[2]), 'attempts': row[3] + 1}
+
+    def _update_lease(self, sql, params):
+        with self.connect() as conn:
+            return conn.execute(sql, params).rowcount == 1
+
+    def heartbeat(self, key, worker: str, ttl: float):
+        now = time.time()
+        return self._update_lease("UPDATE tasks SET lease_until = ?, updated = ? "
+                                  "WHERE key = ? AND worker = ? AND state = 'leased'", (now + ttl, now, key, worker))
+
+    def complete(self, key, worker: str):
+        return self._update_lease("UPDATE tasks SET state = 'done', worker = NULL, last_error = NULL, updated = ? "
+                                  "WHERE key = ? AND worker = ? AND state = 'leased'", (time.time(), key, worker))
+
+    def fail(self, key, worker: str, error=None, delay: float = 0.0):
+        now = time.time()
+        return self._update_lease(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, not_before = ?, last_error = ?, updated = ? "
+            "WHERE key = ? AND worker = ? AND state = 'leased'",
+            (self.max_attempts, now + delay, str(error)[:500] if error else None, now, key, worker))
+
+    def counts(self):
+        with self.connect() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+
+# 后端：url 前缀 -> 类
+BACKENDS = {'sqlite': SqliteWorkQueue}
+
+
+def open_work_queue(url: str, **kwargs):
+    """
+    按 url 打开工作队列，如 sqlite:///data/queue.db（相对路径）、sqlite:////tmp/queue.db（绝对路径）；
+    没有前缀时视为 SQLite 文件路径
+    """
+    scheme, sep, path = url.partition('://')
+    if not sep:
+        scheme, path = 'sqlite', url
+    elif scheme == 'sqlite':
+        path = path[1:]
+    assert scheme in BACKENDS, f"未知的工作队列后端 {scheme}，可选 {list(BACKENDS)}"
+    return BACKENDS[scheme](path, **kwargs)